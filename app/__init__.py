@@ -1,33 +1,79 @@
 # app/__init__.py
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
-from config import Config
-import logging
-from logging.handlers import SMTPHandler, RotatingFileHandler
-import os
 from flask_bootstrap import Bootstrap
+from config import Config
+from app import fragments, replicas, tokens
+
+db = SQLAlchemy(session_options={'class_': replicas.RoutingSession})
+login = LoginManager()
+login.login_view = 'main.login'
+bootstrap = Bootstrap()
+# Mail wird erst beim Versand initialisiert (MailQueue.drain), Migrate nur
+# für CLI-Kommandos (create_app)
+mail = Mail()
+
+
+def create_app(config_class=Config):
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    db.init_app(app)
+    replicas.init_app(app, db)
+    login.init_app(app)
+    bootstrap.init_app(app)
+    tokens.cache.init_app(app)
+    fragments.cache.init_app(app)
+    graph.follows.init_app(app)
+    stream.broker.init_app(app)
+    sqlite.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        # Alembic kostet beim Start spürbar Zeit und wird nur für
+        # ``flask db ...`` gebraucht
+        from flask_migrate import Migrate
+        Migrate(app, db, render_as_batch=True)
+
+    # profiling zuerst, damit sein before_request auch die übrigen Hooks misst
+    from app.profiling import bp as profiling_bp
+    app.register_blueprint(profiling_bp)
+
+    from app.metrics import bp as metrics_bp
+    app.register_blueprint(metrics_bp)
+
+    from app.fragments import bp as fragments_bp
+    app.register_blueprint(fragments_bp)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+
+    from app.routes import bp as main_bp
+    app.register_blueprint(main_bp)
+
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp)
+
+    from app.cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
+
+    if not app.debug and not app.testing and app.config['LOG_FILE']:
+        directory = os.path.dirname(app.config['LOG_FILE'])
+        if directory and not os.path.exists(directory):
+            os.mkdir(directory)
+        file_handler = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=10240, backupCount=10)
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.setLevel(logging.INFO)
+        app.logger.info('==== Microblog starup ====')
+
+    return app
+
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app,db)
-login = LoginManager(app)
-login.login_view = 'login'
-bootstrap = Bootstrap(app)
-mail = Mail(app)
-
-if not app.debug:
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/microblog.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(logging.INFO)
-    app.logger.info('==== Microblog starup ====')
-
-from app import routes, models, errors, api
\ No newline at end of file
+from app import graph, models, sqlite, stream
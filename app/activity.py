@@ -0,0 +1,86 @@
+# app/activity.py
+"""Write-behind für User.last_seen.
+
+Statt bei jedem Request zu committen, merkt sich der Tracker den Zeitpunkt im
+Speicher und schreibt alle offenen Werte periodisch in einem gebündelten
+UPDATE (sowie beim Beenden des Prozesses). Werte, die jünger als
+LAST_SEEN_GRANULARITY sind, werden gar nicht erst vorgemerkt.
+"""
+import atexit
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from app.models import User
+from app.sqlite import writer
+
+
+class LastSeenTracker(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pending = {}
+        self._thread = None
+        self._stop = Event()
+        self._app = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, user, now=None):
+        """Merkt last_seen für user vor; True, wenn ein neuer Wert ansteht."""
+        now = now or datetime.utcnow()
+        config = current_app.config
+        granularity = timedelta(seconds=config['LAST_SEEN_GRANULARITY'])
+        with self._lock:
+            seen = self._pending.get(user.id) or user.last_seen
+            if seen is not None and now - seen < granularity:
+                return False
+            self._pending[user.id] = now
+            # der Flush-Thread und atexit laufen ohne App-Kontext
+            self._app = current_app._get_current_object()
+        if config['LAST_SEEN_FLUSH_INTERVAL'] <= 0:
+            self.flush()
+        else:
+            self._start()
+        return True
+
+    def flush(self):
+        """Schreibt alle vorgemerkten Werte in einer Transaktion."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        with self._app.app_context():
+            writer.run(self._write, [{'id': id, 'last_seen': seen}
+                                     for id, seen in pending.items()])
+        return len(pending)
+
+    @staticmethod
+    def _write(rows):
+        db.session.execute(update(User), rows)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='last-seen-flush',
+                                      daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._app.config['LAST_SEEN_FLUSH_INTERVAL']):
+            try:
+                self.flush()
+            except Exception:
+                self._app.logger.exception('last_seen flush failed')
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+tracker = LastSeenTracker()
+atexit.register(tracker.stop)
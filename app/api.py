@@ -1,10 +1,18 @@
 # app/api.py
-from app import app, db
+from app import bulk, db, replicas, suggest, tokens
+from app.conditional import conditional
 from app.errors import bad_request, error_response
-from app.models import User, Post
-from flask import jsonify, request, url_for, abort
+from app.export import gzipped, ndjson, parse_timestamp
+from app.models import User, Post, Timeline, avatar_url
+from app.replicas import replica
+from app.sqlite import writer
+from flask import Blueprint, current_app, jsonify, request, session, url_for, abort, stream_with_context
+from flask_login import current_user
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
 from datetime import datetime
+from sqlalchemy import inspect
+
+bp = Blueprint('api', __name__)
 
 basic_auth = HTTPBasicAuth()
 token_auth = HTTPTokenAuth()
@@ -20,17 +28,83 @@ def verify_password(username, password):
 def basic_auth_error(status):
     return error_response(status)
 
+# Authentifizierter User aus dem Token-Cache: die ID ist ohne Datenbankzugriff
+# bekannt, das User-Objekt wird erst geladen, wenn die View es braucht
+class TokenUser(object):
+    def __init__(self, id, token):
+        self.id = id
+        self.token = token
+        self._user = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+            if self._user is None:
+                # inzwischen gelöscht: wie ein ungültiger Token
+                tokens.cache.invalidate(self.token)
+                abort(token_auth.auth_error_callback(401))
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self.user, name)
+
 @token_auth.verify_token
 def verify_token(token):
-    return User.check_token(token) if token else None
+    if not token:
+        return None
+    user_id = tokens.cache.get(token)
+    if user_id is not None:
+        return TokenUser(user_id, token)
+    user = User.check_token(token)
+    if user is not None:
+        tokens.cache.put(token, user.id, user.token_expiration)
+    return user
 
 @token_auth.error_handler
 def token_auth_error(status):
     return error_response(status)
+
+# Für read-your-own-writes (app/replicas.py). Ohne DB-Zugriff, die Funktion
+# läuft bei jeder Query: nach dem Commit ist user.id abgelaufen, und
+# current_user würde den User erst laden
+@replicas.user_id_loader
+def replica_user_id():
+    user = token_auth.current_user()
+    if isinstance(user, TokenUser):
+        return user.id
+    if user is not None:
+        return inspect(user).identity[0]
+    user_id = session.get('_user_id')
+    return int(user_id) if user_id is not None else None
+
+# API-User über Token oder, für Seiten der Web-App, über die Login-Session
+def api_user():
+    user = token_auth.current_user()
+    if user is None and current_user.is_authenticated:
+        user = current_user
+    return user
+
+# limit/cursor der Collection-Endpunkte, limit ist nach oben begrenzt
+def collection_args():
+    limit = request.args.get('limit', current_app.config['API_PER_PAGE'], type=int)
+    limit = max(1, min(limit, current_app.config['API_MAX_PER_PAGE']))
+    return limit, request.args.get('cursor', None, type=str)
+
+# items-Liste der Batch-Endpunkte, None wenn sie fehlt oder zu lang ist
+def bulk_items():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if isinstance(items, list) and len(items) <= current_app.config['BULK_MAX_ITEMS']:
+        return items
+    return None
+
+def bulk_response(results):
+    return jsonify({'items': results, '_meta': bulk.summary(results)})
 ############################################################
 # API Auth handling
 ############################################################
-@app.route('/api/tokens', methods=['POST'])
+@bp.route('/api/tokens', methods=['POST'])
 @basic_auth.login_required
 def get_token():
     token = basic_auth.current_user().get_token()
@@ -38,50 +112,90 @@ def get_token():
     return jsonify({'token': token})
 
 # Token ungültig machen
-@app.route('/api/tokens', methods=['DELETE'])
+@bp.route('/api/tokens', methods=['DELETE'])
 @token_auth.login_required
 def revoke_token():
     token_auth.current_user().revoke_token()
     db.session.commit()
     return '', 204
 
+# Trefferquote des Token-Caches (nur admin)
+@bp.route('/api/tokens/cache', methods=['GET'])
+@replica
+@token_auth.login_required
+def get_token_cache_stats():
+    if token_auth.current_user().id != 1:
+        abort(403) # Abbruch, Response mit Status-Code 403
+    return jsonify(tokens.cache.stats())
+
 ############################################################
 ## GET FUNCTION ##
 ############################################################
-@app.route('/api/users', methods=['GET'])
+@bp.route('/api/users', methods=['GET'])
+@replica
 @token_auth.login_required
 def get_users():
-    data = User.to_collection()
+    data = User.to_collection(*collection_args())
     return jsonify(data)
 
-@app.route('/api/users/<int:id>', methods=['GET'])
+# Vorschläge beim Tippen aus dem Präfix-Index (app/suggest.py)
+@bp.route('/api/users/suggest', methods=['GET'])
+@replica
+@token_auth.login_required(optional=True)
+def suggest_users():
+    if api_user() is None:
+        return error_response(401)
+    prefix = request.args.get('prefix', '', type=str).strip()
+    limit = request.args.get('limit', current_app.config['SUGGEST_MAX_RESULTS'], type=int)
+    limit = max(1, min(limit, current_app.config['SUGGEST_MAX_RESULTS']))
+    items = suggest.suggest(prefix, limit) if prefix else []
+    return jsonify({'items': [{'id': id, 'username': username,
+                               'avatar': avatar_url(email, 32)}
+                              for id, username, email in items]})
+
+@bp.route('/api/users/<int:id>', methods=['GET'])
+@replica
 @token_auth.login_required
+@conditional(User.version)
 def get_user(id):
     data = User.query.get_or_404(id).to_dict()
     return jsonify(data)
 
-@app.route('/api/users/<int:id>/followers', methods=['GET'])
+@bp.route('/api/users/<int:id>/followers', methods=['GET'])
+@replica
 @token_auth.login_required
 def get_followers(id):
     user = User.query.get_or_404(id)
-    data = user.followers_to_collection()
+    data = user.followers_to_collection(*collection_args())
     return jsonify(data)
 
-@app.route('/api/users/<int:id>/followed', methods=['GET'])
+@bp.route('/api/users/<int:id>/followed', methods=['GET'])
+@replica
 @token_auth.login_required
 def get_followed(id):
     user = User.query.get_or_404(id)
-    data = user.followed_to_collection()
+    data = user.followed_to_collection(*collection_args())
     return jsonify(data)
 
-@app.route('/api/users/<int:id>/posts', methods=['GET'])
+# Vorberechnete "Who to follow"-Vorschläge (app/recommend.py)
+@bp.route('/api/users/<int:id>/suggestions', methods=['GET'])
+@replica
 @token_auth.login_required
+def get_suggestions(id):
+    user = User.query.get_or_404(id)
+    return jsonify({'items': [item.to_dict() for item in user.suggested()]})
+
+@bp.route('/api/users/<int:id>/posts', methods=['GET'])
+@replica
+@token_auth.login_required
+@conditional(lambda id: Post.version(id))
 def get_posts(id):
     user = User.query.get_or_404(id)
-    data = user.posts_to_collection()
+    data = user.posts_to_collection(*collection_args())
     return jsonify(data)
 
-@app.route('/api/users/<int:id>/posts/<int:postid>', methods=['GET'])
+@bp.route('/api/users/<int:id>/posts/<int:postid>', methods=['GET'])
+@replica
 @token_auth.login_required
 def get_userpostsbyid(id, postid):
     user = User.query.get_or_404(id)
@@ -89,17 +203,50 @@ def get_userpostsbyid(id, postid):
     return jsonify(data)
 
 
-@app.route('/api/posts', methods=['GET'])
+@bp.route('/api/posts', methods=['GET'])
+@replica
 @token_auth.login_required
+@conditional(Post.version)
 def get_allposts():
-    data = Post.to_collection()
+    data = Post.to_collection(*collection_args())
     return jsonify(data)
 
+# NDJSON-Export für die Analytics-Pipeline (app/export.py), gestreamt und auf
+# Wunsch (Accept-Encoding) mit gzip
+@bp.route('/api/export/<any(posts, users):kind>', methods=['GET'])
+@replica
+@token_auth.login_required
+def export(kind):
+    try:
+        since = parse_timestamp(request.args.get('since', None, type=str))
+    except ValueError:
+        return bad_request('since must be an ISO 8601 timestamp')
+    since_id = request.args.get('since_id', None, type=str)
+    if since_id is not None and not since_id.isdigit():
+        return bad_request('since_id must be an integer')
+    chunks = ndjson(kind, since, int(since_id) if since_id is not None else None)
+    headers = {}
+    if request.accept_encodings['gzip']:
+        chunks = gzipped(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    response = current_app.response_class(stream_with_context(chunks),
+                                          mimetype='application/x-ndjson',
+                                          headers=headers)
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Live-Timeline als Server-Sent Events (app/stream.py). Den Stream bedient der
+# ASGI-Server (app/asgi.py), ohne einen Worker pro Client zu belegen; die Route
+# gibt es hier nur für url_for und das Routing dort
+@bp.route('/api/stream/timeline', methods=['GET'])
+def stream_timeline():
+    return error_response(404, 'the timeline stream is served by the ASGI app')
+
 ############################################################
 ## POST FUNCTION ##
 ############################################################
 # Endpunkt für User-Registrierung
-@app.route('/api/users', methods=['POST'])
+@bp.route('/api/users', methods=['POST'])
 def create_user():
     data = request.get_json() or {}
     if not data:
@@ -121,11 +268,11 @@ def create_user():
     db.session.commit()
     response = jsonify(user.to_dict())
     response.status_code = 201
-    response.headers['Location'] = url_for('get_user', id=user.id)
+    response.headers['Location'] = url_for('api.get_user', id=user.id)
     return response
 
 # Endpunkt für Erzuegen eines Posts
-@app.route('/api/users/<int:id>/post', methods=['POST'])
+@bp.route('/api/users/<int:id>/post', methods=['POST'])
 @token_auth.login_required
 def create_post(id):
     # Nur der eigene user oder admin dürfen posts absetzten
@@ -139,18 +286,42 @@ def create_post(id):
         bodyOk = 'body' in data
         message = "must include body fields. (body: {})".format(bodyOk)
         return bad_request(message)
-    post = Post()
-    post.body = data['body']
-    post.user_id = user.id
-    db.session.add(post)
-    db.session.commit()
+    post = db.session.get(Post, writer.run(Post.publish, user.id, data['body']))
     return jsonify(post.to_dict())
 
+# Massenimport von Posts, {"items": [{"body": ..., "user_id": ..., "timestamp": ...}]}.
+# Nur der admin darf für andere User posten
+@bp.route('/api/posts:batch', methods=['POST'])
+@token_auth.login_required
+def create_posts():
+    items = bulk_items()
+    if items is None:
+        return bad_request('must include an items list with at most {} entries'
+                           .format(current_app.config['BULK_MAX_ITEMS']))
+    user_id = token_auth.current_user().id
+    return bulk_response(bulk.import_posts(items, author=user_id,
+                                           any_author=user_id == 1))
+
+# Mehreren Usern auf einmal folgen, {"items": [<user id>, ...]}
+@bp.route('/api/users/<int:id>/followed:batch', methods=['POST'])
+@token_auth.login_required
+def follow_users(id):
+    # Nur der eigene user oder admin
+    if token_auth.current_user().id not in (id, 1):
+        abort(403) # Abbruch, Response mit Status-Code 403
+    User.query.get_or_404(id)
+    items = bulk_items()
+    if items is None:
+        return bad_request('must include an items list with at most {} entries'
+                           .format(current_app.config['BULK_MAX_ITEMS']))
+    return bulk_response(bulk.import_follows(
+        [{'follower_id': id, 'followed_id': item} for item in items]))
+
 ############################################################
 ## PUT FUNCTION ##
 ############################################################
 # Endpunkt für User-änderungen
-@app.route('/api/users/<int:id>', methods=['PUT'])
+@bp.route('/api/users/<int:id>', methods=['PUT'])
 @token_auth.login_required
 def update_user(id):
     # Nur die Informationen des eigenen Users können geändert werden
@@ -170,7 +341,7 @@ def update_user(id):
 
 
 # Endpunkt für Post-änderungen
-@app.route('/api/users/<int:userid>/posts/<int:postid>', methods=['PUT'])
+@bp.route('/api/users/<int:userid>/posts/<int:postid>', methods=['PUT'])
 @token_auth.login_required
 def update_post(userid,postid):
     # Nur die Posts des eigenen Users können geändert werden
@@ -191,6 +362,7 @@ def update_post(userid,postid):
          abort(403) # Abbruch, Response mit Status-Code 403
     post.body = data['body']
     post.timestamp = datetime.utcnow()
+    Timeline.retime(post)
     db.session.commit()
     return jsonify(post.to_dict())
 
@@ -200,13 +372,13 @@ def update_post(userid,postid):
 ############################################################
 
 # Endpunkt für User-löschung
-@app.route('/api/users/<int:id>', methods=['DELETE'])
+@bp.route('/api/users/<int:id>', methods=['DELETE'])
 @token_auth.login_required
 def delete_user(id):
     # Nur der admin darf user löschen
     if token_auth.current_user().id != 1:
         abort(403) # Abbruch, Response mit Status-Code 403
     user = User.query.get_or_404(id)
-    db.session.delete(user)
+    user.remove()
     db.session.commit()
     return jsonify(user.to_dict())
\ No newline at end of file
@@ -0,0 +1,293 @@
+# app/asgi.py
+"""Asynchroner Lesepfad (ASGI) für die JSON-API.
+
+``AsyncApi(app)`` ist eine ASGI-Anwendung für die lesenden Endpunkte
+get_users, get_user, get_followers, get_followed, get_posts und
+get_allposts. Die Queries laufen über eine async Engine von SQLAlchemy auf
+denselben Models; während ein Request auf die Datenbank wartet, bedient der
+Worker andere. Start z.B. mit ``uvicorn asgi:application`` (asgi.py im
+Projektverzeichnis); alle anderen Pfade bleiben beim WSGI-Server, der
+Reverse-Proxy teilt GET /api/users... und /api/posts auf.
+
+Die Engine-URL ist ASYNC_DATABASE_URL oder SQLALCHEMY_DATABASE_URI mit
+asynchronem Treiber (aiosqlite, aiomysql, asyncpg; muss installiert sein).
+
+URLs, Authentifizierung und Antworten entsprechen app/api.py: Routing über
+die url_map der Flask-App, Bearer-Token über den Token-Cache (app/tokens.py)
+und sonst die Spalte user.token, Body über to_dict/jsonify und dieselbe
+Keyset-Pagination. Pro Request wird dafür ein Flask-Request-Kontext ohne
+Datenbanksession aufgebaut. Statt der Versionsmarker aus app/conditional.py
+bekommen die Antworten ein ETag über den Body.
+
+Außerdem bedient AsyncApi die Live-Timeline (app/stream.py) unter
+/api/stream/timeline: eine Coroutine pro Client statt eines Threads, die
+Datenbank braucht sie nur für den Aufbau. Angemeldet wird über Bearer-Token
+oder die Login-Session der Web-App (EventSource schickt das Cookie mit).
+"""
+import asyncio
+import io
+import sys
+from datetime import datetime
+from flask import jsonify, request, session as login_session, url_for
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+from app import stream, tokens
+from app.api import collection_args
+from app.errors import bad_request, error_response
+from app.models import User, Post, followers
+from app.pagination import InvalidCursor, KeysetPagination, page_dict
+from config import engine_options
+
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'mysql': 'aiomysql', 'postgresql': 'asyncpg'}
+
+
+def async_url(config):
+    if config.get('ASYNC_DATABASE_URL'):
+        return config['ASYNC_DATABASE_URL']
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    return url.set(drivername='{}+{}'.format(backend, ASYNC_DRIVERS[backend]))
+
+
+def _environ(scope):
+    # WSGI-Environ aus dem ASGI-Scope, genug für Routing, args und Header
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+async def _first(session, query):
+    return (await session.scalars(query.limit(1))).first()
+
+
+async def _collection(session, query, keys, endpoint, descending=True, **kwargs):
+    limit, cursor = collection_args()
+    page = KeysetPagination(query, keys, limit, cursor, descending, defer=True)
+    page.load((await session.scalars(page.query)).all())
+    return jsonify(page_dict(page, limit, cursor, endpoint, **kwargs))
+
+
+async def get_users(session):
+    return await _collection(session, select(User), (User.id,), 'api.get_users',
+                             descending=False)
+
+
+async def get_user(session, id):
+    user = await session.get(User, id)
+    if user is None:
+        return error_response(404)
+    return jsonify(user.to_dict())
+
+
+async def get_followers(session, id):
+    if await session.get(User, id) is None:
+        return error_response(404)
+    query = select(User).join(followers, followers.c.follower_id == User.id) \
+        .where(followers.c.followed_id == id)
+    return await _collection(session, query, (User.id,), 'api.get_followers',
+                             descending=False, id=id)
+
+
+async def get_followed(session, id):
+    if await session.get(User, id) is None:
+        return error_response(404)
+    query = select(User).join(followers, followers.c.followed_id == User.id) \
+        .where(followers.c.follower_id == id)
+    return await _collection(session, query, (User.id,), 'api.get_followed',
+                             descending=False, id=id)
+
+
+async def get_posts(session, id):
+    if await session.get(User, id) is None:
+        return error_response(404)
+    return await _collection(session, select(Post).where(Post.user_id == id),
+                             (Post.timestamp, Post.id), 'api.get_posts', id=id)
+
+
+async def get_allposts(session):
+    return await _collection(session, select(Post), (Post.timestamp, Post.id),
+                             'api.get_allposts')
+
+
+VIEWS = {'api.' + view.__name__: view for view in
+         (get_users, get_user, get_followers, get_followed, get_posts, get_allposts)}
+
+
+def stream_dict(event):
+    return {'id': event['id'], 'body': event['body'],
+            'timestamp': event['timestamp'].isoformat() + 'Z',
+            'author': url_for('api.get_user', id=event['user_id'], _external=True)}
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _respond(send, response, head=False):
+    await send({'type': 'http.response.start', 'status': response.status_code,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                            for k, v in response.headers.items()]})
+    await send({'type': 'http.response.body',
+                'body': response.get_data() if not head else b''})
+
+
+class AsyncApi(object):
+
+    def __init__(self, app):
+        self.app = app
+        url = async_url(app.config)
+        self.engine = create_async_engine(url, **engine_options(url))
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        with app.test_request_context():
+            self.stream_path = url_for('api.stream_timeline')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        environ = _environ(scope)
+        if scope['path'] == self.stream_path and scope['method'] == 'GET':
+            return await self.stream(environ, receive, send)
+        await _respond(send, await self.handle(environ), scope['method'] == 'HEAD')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def authenticate(self, session):
+        """user_id zum Bearer-Token wie api.verify_token, sonst None."""
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return None
+        user_id = tokens.cache.get(token)
+        if user_id is not None:
+            return user_id
+        user = await _first(session, select(User).where(User.token == token))
+        if user is None or user.token_expiration < datetime.utcnow():
+            return None
+        tokens.cache.put(token, user.id, user.token_expiration)
+        return user.id
+
+    async def handle(self, environ):
+        """Beantwortet einen Request; liefert ein Flask-Response-Objekt."""
+        with self.app.request_context(environ):
+            if request.routing_exception is not None:
+                exception = request.routing_exception
+                return error_response(exception.code) \
+                    if isinstance(exception, HTTPException) else error_response(404)
+            view = VIEWS.get(request.endpoint)
+            if view is None or request.method not in ('GET', 'HEAD'):
+                return error_response(404 if view is None else 405)
+            async with self.sessions() as session:
+                if await self.authenticate(session) is None:
+                    response = error_response(401)
+                    response.headers['WWW-Authenticate'] = \
+                        'Bearer realm="Authentication Required"'
+                    return response
+                try:
+                    response = await view(session, **request.view_args)
+                except InvalidCursor:
+                    return bad_request('invalid cursor')
+            if response.status_code == 200:
+                response.add_etag()
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                response.make_conditional(request)
+            return response
+
+    async def stream_user(self, session):
+        """user_id über Bearer-Token oder die Login-Session, sonst None."""
+        user_id = await self.authenticate(session)
+        if user_id is None and login_session.get('_user_id') is not None:
+            user = await session.get(User, int(login_session['_user_id']))
+            user_id = user.id if user is not None else None
+        return user_id
+
+    async def stream(self, environ, receive, send):
+        """Live-Timeline als SSE, bis SSE_MAX_AGE, Überlauf oder Disconnect."""
+        with self.app.request_context(environ):
+            config = self.app.config
+            async with self.sessions() as session:
+                user_id = await self.stream_user(session)
+                if user_id is None:
+                    return await _respond(send, error_response(401))
+                authors = [user_id] + list(await session.scalars(
+                    select(followers.c.followed_id)
+                    .where(followers.c.follower_id == user_id)))
+                # vor dem Backlog abonnieren, sonst fehlen Posts aus der Zwischenzeit
+                subscription = stream.broker.subscribe(user_id, authors,
+                                                       asyncio.get_running_loop())
+                if subscription is None:
+                    response = error_response(503, 'too many open streams')
+                    response.headers['Retry-After'] = '5'
+                    return await _respond(send, response)
+                try:
+                    last_id = request.headers.get('Last-Event-ID', None, type=int)
+                    if last_id is None:
+                        last_id = request.args.get('last_event_id', None, type=int)
+                    backlog = []
+                    if last_id is not None:
+                        rows = await session.execute(
+                            select(Post.id, Post.user_id, Post.timestamp, Post.body)
+                            .where(Post.user_id.in_(authors), Post.id > last_id)
+                            .order_by(Post.id.desc()).limit(config['SSE_REPLAY_LIMIT']))
+                        backlog = [row._asdict() for row in reversed(rows.all())]
+                except BaseException:
+                    stream.broker.unsubscribe(subscription)
+                    raise
+            # ab hier ohne Datenbankverbindung
+            tasks = ()
+            try:
+                await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+                tasks = (asyncio.ensure_future(
+                             self._send_events(send, subscription, backlog, config)),
+                         asyncio.ensure_future(_disconnected(receive)))
+                done, pending = await asyncio.wait(tasks,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                stream.broker.unsubscribe(subscription)
+
+    async def _send_events(self, send, subscription, backlog, config):
+        async for chunk in stream.events(subscription, backlog, stream_dict, config):
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'),
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
@@ -0,0 +1,226 @@
+# app/bulk.py
+"""Massenimport von Posts und Follow-Beziehungen.
+
+Die Einträge werden zuerst einzeln auf ihre Form geprüft. Danach läuft
+jeder Block von BULK_CHUNK_SIZE Einträgen als eigene Transaktion über
+app.sqlite.writer:
+
+- ein IN-Query prüft, ob die referenzierten User existieren;
+- ein weiterer findet vorhandene Posts bzw. Follows (Duplikate);
+- der Rest wird per executemany eingefügt;
+- Zähler, Suchindex und Timelines werden ebenfalls mengenbasiert
+  nachgeführt.
+
+Die ORM-Events für einzelne Objekte laufen dabei nicht.
+
+Ein Post gilt als Duplikat, wenn es (user_id, timestamp, body) schon gibt;
+ein wiederholter Import derselben Datei legt also nichts doppelt an.
+Einträge ohne timestamp bekommen den Zeitpunkt des Imports. Zeitstempel
+werden vor dem Einfügen so abgelegt, wie die Spalte sie speichert (naive
+UTC-Zeit, auf MySQL ohne Mikrosekunden); über genau diesen Schlüssel werden
+danach die IDs der neuen Posts gelesen.
+
+Das Ergebnis hat einen Eintrag pro Eingabe, in derselben Reihenfolge:
+``{'status': 'created', ...}``, ``{'status': 'duplicate', ...}`` oder
+``{'status': 'invalid', 'error': ...}``.
+"""
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam, select, update
+from app import db, graph, search, stream
+from app.export import parse_timestamp
+from app.models import User, Post, Timeline, followers
+from app.sqlite import writer
+
+STATUSES = ('created', 'duplicate', 'invalid')
+
+
+def summary(results):
+    counts = Counter(result['status'] for result in results)
+    return {status: counts[status] for status in STATUSES}
+
+
+def _invalid(error):
+    return {'status': 'invalid', 'error': error}
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _run_chunks(items, validate, insert):
+    # validate(item) liefert eine Zeile oder ein invalid-Ergebnis, insert(rows)
+    # ein Ergebnis pro Zeile
+    results = [None] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        row = validate(item)
+        if isinstance(row, dict) and row.get('status') == 'invalid':
+            results[i] = row
+        else:
+            pending.append((i, row))
+    size = current_app.config['BULK_CHUNK_SIZE']
+    for start in range(0, len(pending), size):
+        chunk = pending[start:start + size]
+        for (i, row), result in zip(chunk, writer.run(insert, [row for i, row in chunk])):
+            results[i] = result
+    return results
+
+
+def _existing_users(ids):
+    return set(db.session.scalars(select(User.id).where(User.id.in_(ids))))
+
+
+def _increment(connection, column, deltas):
+    if not deltas:
+        return
+    user = User.__table__
+    connection.execute(
+        update(user).where(user.c.id == bindparam('user_id'))
+        .values({column: user.c[column] + bindparam('delta')}),
+        [{'user_id': user_id, 'delta': delta} for user_id, delta in deltas.items()])
+
+
+############################################################
+# Posts
+############################################################
+def _post_key(row):
+    return row['user_id'], row['timestamp'], row['body']
+
+
+def _stored_timestamp(connection, timestamp):
+    # DATETIME ohne Nachkommastellen rundet auf MySQL die Mikrosekunden; der
+    # Schlüssel muss dem gespeicherten Wert entsprechen
+    if connection.dialect.name == 'mysql':
+        return timestamp.replace(microsecond=0)
+    return timestamp
+
+
+def _post_ids(rows):
+    """(user_id, timestamp, body) -> ID für die vorhandenen unter rows."""
+    keys = {_post_key(row) for row in rows}
+    found = db.session.execute(
+        select(Post.user_id, Post.timestamp, Post.body, Post.id)
+        .where(Post.user_id.in_({key[0] for key in keys}),
+               Post.timestamp.in_({key[1] for key in keys})))
+    return {(user_id, timestamp, body): id for user_id, timestamp, body, id in found
+            if (user_id, timestamp, body) in keys}
+
+
+def _insert_posts(rows):
+    connection = db.session.connection()
+    for row in rows:
+        row['timestamp'] = _stored_timestamp(connection, row['timestamp'])
+    users = _existing_users({row['user_id'] for row in rows})
+    existing = _post_ids(rows)
+    fresh = {}
+    for row in rows:
+        key = _post_key(row)
+        if row['user_id'] in users and key not in existing:
+            fresh.setdefault(key, row)
+    created = {}
+    if fresh:
+        connection.execute(Post.__table__.insert(), list(fresh.values()))
+        created = _post_ids(fresh.values())
+        search.add_many(connection, [(id, key[2]) for key, id in created.items()])
+        _increment(connection, 'post_count', Counter(key[0] for key in created))
+        Timeline.fan_out_many(list(created.values()))
+        for key, id in created.items():
+            stream.record(db.session, id, key[0], key[1], key[2])
+    results = []
+    for row in rows:
+        key = _post_key(row)
+        if row['user_id'] not in users:
+            results.append(_invalid('unknown user {}'.format(row['user_id'])))
+        elif key in created:
+            results.append({'status': 'created', 'id': created.pop(key)})
+            existing[key] = results[-1]['id']
+        else:
+            results.append({'status': 'duplicate', 'id': existing[key]})
+    return results
+
+
+def import_posts(items, author=None, any_author=True):
+    """Legt Posts an, je ein dict mit body und optional user_id, timestamp.
+
+    ``author`` ist der Autor für Einträge ohne user_id; ohne ``any_author``
+    sind keine anderen Autoren erlaubt (API für Nicht-Admins).
+    """
+    now = datetime.utcnow()
+    length = Post.body.type.length
+
+    def validate(item):
+        if not isinstance(item, dict):
+            return _invalid('expected an object')
+        body = item.get('body')
+        if not isinstance(body, str) or not body.strip() or len(body) > length:
+            return _invalid('body must be 1 to {} characters'.format(length))
+        user_id = item.get('user_id', author)
+        if not _is_id(user_id):
+            return _invalid('user_id must be an integer')
+        if not any_author and user_id != author:
+            return _invalid('not allowed to post as user {}'.format(user_id))
+        try:
+            timestamp = parse_timestamp(item.get('timestamp')) or now
+        except ValueError:
+            return _invalid('timestamp must be ISO 8601')
+        return {'user_id': user_id, 'timestamp': timestamp, 'body': body}
+
+    return _run_chunks(items, validate, _insert_posts)
+
+
+############################################################
+# Follows
+############################################################
+def _insert_follows(pairs):
+    connection = db.session.connection()
+    users = _existing_users({id for pair in pairs for id in pair})
+    existing = set(tuple(row) for row in db.session.execute(
+        select(followers.c.follower_id, followers.c.followed_id)
+        .where(followers.c.follower_id.in_({pair[0] for pair in pairs}),
+               followers.c.followed_id.in_({pair[1] for pair in pairs}))))
+    fresh = list(dict.fromkeys(
+        pair for pair in pairs
+        if pair[0] in users and pair[1] in users and pair not in existing))
+    if fresh:
+        # wie User.follow: Timeline nachfüllen, dann die Zähler, nach denen
+        # reclassify das celebrity-Flag der Gefolgten setzt
+        Timeline.backfill_many(fresh)
+        connection.execute(followers.insert(), [
+            {'follower_id': follower_id, 'followed_id': followed_id}
+            for follower_id, followed_id in fresh])
+        _increment(connection, 'followed_count', Counter(pair[0] for pair in fresh))
+        _increment(connection, 'follower_count', Counter(pair[1] for pair in fresh))
+        Timeline.reclassify({pair[1] for pair in fresh})
+        connection.execute(update(User.__table__)
+                           .where(User.__table__.c.id.in_({id for pair in fresh for id in pair}))
+                           .values(suggestions_stale=True))
+        for follower_id, followed_id in fresh:
+            graph.record(db.session, follower_id, followed_id)
+    results = []
+    for pair in pairs:
+        missing = [id for id in pair if id not in users]
+        if missing:
+            results.append(_invalid('unknown user {}'.format(missing[0])))
+        elif pair in existing:
+            results.append({'status': 'duplicate'})
+        else:
+            results.append({'status': 'created'})
+            existing.add(pair)
+    return results
+
+
+def import_follows(items):
+    """Legt Follows an, je ein dict mit follower_id und followed_id."""
+    def validate(item):
+        if not isinstance(item, dict):
+            return _invalid('expected an object')
+        pair = item.get('follower_id'), item.get('followed_id')
+        if not all(_is_id(id) for id in pair):
+            return _invalid('follower_id and followed_id must be integers')
+        if pair[0] == pair[1]:
+            return _invalid('cannot follow yourself')
+        return pair
+
+    return _run_chunks(items, validate, _insert_follows)
@@ -0,0 +1,251 @@
+import gzip
+import json
+import time
+from itertools import islice
+import click
+from flask import Blueprint, current_app
+from sqlalchemy import select, true
+from app import bulk, db, export, graph, recommend, search
+from app.email import outbox
+from app.models import User, Post, Timeline
+from app.sqlite import writer
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.group()
+def timeline():
+    """Home timeline maintenance commands."""
+    pass
+
+
+@timeline.command()
+@click.option('--username', default=None, help='Only rebuild this user.')
+def rebuild(username):
+    """Rebuild materialized home timelines from followers and posts."""
+    users = User.query.filter_by(username=username) if username else User.query
+    count = 0
+    for user in users:
+        Timeline.rebuild(user)
+        count += 1
+    db.session.commit()
+    click.echo('Rebuilt {} timeline(s).'.format(count))
+
+
+@timeline.command()
+def backfill():
+    """Fan out the posts of former celebrities to their followers."""
+    authors = db.session.scalars(
+        select(User.id).where(User.timeline_backfill == true())).all()
+    size = current_app.config['TIMELINE_BACKFILL_BLOCK_SIZE']
+    for author_id in authors:
+        after = 0
+        while after is not None:
+            after = writer.run(Timeline.backfill_block, author_id, after, size)
+    click.echo('Backfilled timelines for {} author(s).'.format(len(authors)))
+
+
+@bp.cli.group()
+def counters():
+    """Denormalized counter maintenance commands."""
+    pass
+
+
+@counters.command()
+def repair():
+    """Recompute post, follower and followed counts for all users."""
+    User.repair_counters()
+    db.session.commit()
+    click.echo('Counters repaired.')
+
+
+@bp.cli.group('graph')
+def graph_group():
+    """In-memory follow graph commands."""
+    pass
+
+
+@graph_group.command('stats')
+def graph_stats():
+    """Load the whole follow graph and report its memory use."""
+    start = time.perf_counter()
+    graph.follows.load_all()
+    elapsed = time.perf_counter() - start
+    click.echo('{:<24} {:.0f} ms'.format('load', elapsed * 1000))
+    for key, value in graph.follows.stats().items():
+        click.echo('{:<24} {}'.format(key, value))
+
+
+@graph_group.command('benchmark')
+@click.option('--repeat', default=10000, help='Lookups per path.')
+def graph_benchmark(repeat):
+    """Compare is_following from the graph against the database."""
+    import random
+    users = User.query.filter(User.followed_count > 0).limit(1000).all()
+    if not users:
+        raise click.ClickException('no follows in the database')
+    others = User.query.limit(1000).all()
+    pairs = [(random.choice(users), random.choice(others)) for i in range(repeat)]
+    graph.follows.load_all()
+
+    def run(label, fn):
+        start = time.perf_counter()
+        for follower, followed in pairs:
+            fn(follower, followed)
+        elapsed = (time.perf_counter() - start) / repeat * 1e6
+        click.echo('{:<8} {:8.2f} us/lookup'.format(label, elapsed))
+
+    run('db', lambda follower, followed: follower._follows(followed))
+    run('graph', graph.follows.is_following)
+
+
+@bp.cli.group()
+def suggestions():
+    """"Who to follow" suggestion commands."""
+    pass
+
+
+@suggestions.command('refresh')
+@click.option('--all', 'full', is_flag=True, help='Recompute every user, not only stale ones.')
+def refresh_suggestions(full):
+    """Recompute follow suggestions from the follower graph."""
+    start = time.perf_counter()
+    count = recommend.refresh(full)
+    click.echo('Refreshed suggestions for {} user(s) in {:.1f}s ({}).'.format(
+        count, time.perf_counter() - start,
+        'scipy' if recommend.sparse is not None else 'python'))
+
+
+@bp.cli.group('search')
+def search_group():
+    """Full-text search commands."""
+    pass
+
+
+@search_group.command()
+def reindex():
+    """Rebuild the post search index."""
+    search.reindex(db.session.connection())
+    db.session.commit()
+    click.echo('Indexed {} post(s).'.format(Post.query.count()))
+
+
+@search_group.command()
+@click.argument('expression')
+@click.option('--repeat', default=20, help='Runs per search path.')
+def benchmark(expression, repeat):
+    """Compare the search index against the old LIKE query."""
+    per_page = current_app.config['POSTS_PER_PAGE']
+    like = Post.query.filter(Post.body.like('%{}%'.format(expression))) \
+        .order_by(Post.timestamp.desc())
+
+    def run(label, fn):
+        fn()
+        start = time.perf_counter()
+        for i in range(repeat):
+            fn()
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+        click.echo('{:<8} {:8.2f} ms/query'.format(label, elapsed))
+
+    run('like', lambda: like.limit(per_page).all())
+    run('index', lambda: Post.search(expression, 1, per_page))
+
+
+@bp.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(export.KINDS)))
+@click.option('--since', default=None,
+              help='Only rows changed at or after this ISO 8601 timestamp.')
+@click.option('--since-id', type=int, default=None,
+              help='Id of the last exported row; with --since, continue after '
+                   'that row instead of repeating its timestamp.')
+@click.option('--output', '-o', type=click.File('wb'), default='-',
+              help='Output file, default stdout.')
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+def export_command(kind, since, since_id, output, compress):
+    """Export posts or users as newline-delimited JSON."""
+    try:
+        since = export.parse_timestamp(since)
+    except ValueError:
+        raise click.BadParameter('expected an ISO 8601 timestamp', param_hint='--since')
+    rows = 0
+
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            rows += chunk.count('\n')
+            yield chunk
+
+    chunks = counted(export.ndjson(kind, since, since_id))
+    if compress:
+        for data in export.gzipped(chunks):
+            output.write(data)
+    else:
+        for chunk in chunks:
+            output.write(chunk.encode('utf-8'))
+    click.echo('Exported {} {}.'.format(rows, kind), err=True)
+
+
+@bp.cli.command('import')
+@click.argument('kind', type=click.Choice(['follows', 'posts']))
+@click.argument('source', type=click.File('rb'), default='-')
+def import_command(kind, source):
+    """Import posts or follows from newline-delimited JSON (.gz is unpacked).
+
+    Posts need user_id and body, optionally timestamp (the format of
+    "flask export posts"); follows need follower_id and followed_id.
+    """
+    if source.name.endswith('.gz'):
+        source = gzip.GzipFile(fileobj=source)
+    load = bulk.import_posts if kind == 'posts' else bulk.import_follows
+    lines = ((number, line) for number, line in enumerate(source, 1) if line.strip())
+    totals = dict.fromkeys(bulk.STATUSES, 0)
+    start = time.perf_counter()
+    while True:
+        chunk = list(islice(lines, current_app.config['BULK_CHUNK_SIZE']))
+        if not chunk:
+            break
+        items = []
+        for number, line in chunk:
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        for (number, line), result in zip(chunk, load(items)):
+            totals[result['status']] += 1
+            if result['status'] == 'invalid':
+                click.echo('line {}: {}'.format(number, result['error']), err=True)
+    elapsed = time.perf_counter() - start
+    rows = sum(totals.values())
+    click.echo('{created} created, {duplicate} duplicate, {invalid} invalid'.format(**totals)
+               + ' ({:.0f} rows/s).'.format(rows / elapsed if elapsed else 0))
+
+
+@bp.cli.group('mail')
+def mail_group():
+    """Outgoing mail queue commands."""
+    pass
+
+
+@mail_group.command()
+def status():
+    """Show the mail queue depth."""
+    for key, value in outbox.stats().items():
+        click.echo('{:<24} {}'.format(key, value))
+
+
+@mail_group.command()
+def drain():
+    """Send all due messages and exit."""
+    click.echo('Sent {} message(s).'.format(outbox.drain()))
+
+
+@mail_group.command()
+def worker():
+    """Run the mail worker pool in the foreground."""
+    outbox.start()
+    click.echo('Mail workers running, press Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        outbox.stop()
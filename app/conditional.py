@@ -0,0 +1,67 @@
+# app/conditional.py
+"""Bedingte GETs mit ETag und Last-Modified.
+
+``@conditional(versions)`` ruft vor der View ``versions(**view_args)`` auf.
+Die Funktion liefert billige Versionsmarker (Zähler, höchste Post-ID,
+neuester Zeitstempel; alles Index- oder Primärschlüssel-Lookups) und
+optional einen Last-Modified-Zeitpunkt, oder None, wenn es die Ressource
+nicht gibt. Passt das daraus gebildete ETag zu If-None-Match (bzw.
+Last-Modified zu If-Modified-Since), gibt es sofort 304, ohne die Daten
+für den Body zu laden und ohne Serialisierung.
+
+HTML-Seiten (``html=True``) bekommen schwache ETags, die zusätzlich den
+angemeldeten User und das CSRF-Token der Session enthalten. Solange Flash-
+Nachrichten anstehen, wird immer gerendert.
+"""
+import hashlib
+from functools import wraps
+from time import time
+from flask import abort, current_app, make_response, request, session
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+
+def make_etag(markers):
+    return hashlib.sha1(repr(markers).encode('utf-8')).hexdigest()
+
+
+def _page_markers():
+    # Signierte CSRF-Tokens laufen nach WTF_CSRF_TIME_LIMIT ab; eine aus dem
+    # Cache bestätigte Seite soll kein abgelaufenes Token mehr enthalten
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    window = int(time() // (limit / 2)) if limit else 0
+    viewer = (current_user.id, current_user.profile_updated) \
+        if current_user.is_authenticated else None
+    return viewer, session.get('csrf_token'), window
+
+
+def conditional(versions, html=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if html and session.get('_flashes'):
+                return view(*args, **kwargs)
+            version = versions(**kwargs)
+            if version is None:
+                abort(404)
+            markers, last_modified = version
+            etag = make_etag((markers, _page_markers()) if html else markers)
+            if is_resource_modified(request.environ, etag=etag,
+                                    last_modified=last_modified):
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if html:
+                    # das erste Rendern legt das CSRF-Token der Session an
+                    etag = make_etag((markers, _page_markers()))
+            else:
+                response = current_app.response_class(status=304)
+            response.set_etag(etag, weak=html)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # darf gespeichert, muss aber jedes Mal revalidiert werden
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
@@ -1,25 +1,200 @@
-from threading import Thread
-from flask import render_template
-from flask_mail import Message
-from app import app, mail
+"""Ausgehende E-Mails über eine persistente Warteschlange.
 
+send_email() legt die Nachricht nur in der Tabelle outgoing_mail ab; der
+Webprozess startet keine Threads. Zugestellt wird von ``flask mail worker``,
+der als eigener Prozess neben dem Webserver läuft: ein fester Pool von
+MAIL_WORKERS Threads holt die Nachrichten stapelweise ab, verschickt jeden
+Stapel über eine gemeinsame SMTP-Verbindung und versucht Fehlschläge mit
+exponentiellem Backoff erneut. Da der Worker beim Start sofort abholt,
+werden nach einem Neustart auch wartende, zurückgestellte und verwaiste
+Nachrichten zugestellt. Alternativ leert ``flask mail drain`` (z.B. per
+Cron) die Warteschlange einmalig.
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+Zum Testen genügt ein lokaler Debugging-SMTP-Server, z.B.
+``python -m smtpd -n -c DebuggingServer localhost:8025`` mit MAIL_PORT=8025.
+"""
+import atexit
+import json
+import uuid
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from flask import current_app, render_template
+from flask_mail import Connection, Message
+from sqlalchemy import func, or_, select, update
+from app import db, mail
+
+
+class OutgoingMail(db.Model):
+    __tablename__ = 'outgoing_mail'
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255))
+    sender = db.Column(db.String(120))
+    recipients = db.Column(db.Text)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    # pending -> sending -> (gelöscht) bzw. failed nach MAIL_MAX_ATTEMPTS
+    status = db.Column(db.String(16), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt = db.Column(db.DateTime, default=datetime.utcnow)
+    claim = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(255))
+
+    __table_args__ = (
+        db.Index('ix_outgoing_mail_status_next_attempt', 'status', 'next_attempt'),
+    )
+
+    def to_message(self):
+        return Message(self.subject, sender=self.sender,
+                       recipients=json.loads(self.recipients),
+                       body=self.body, html=self.html)
+
+
+class MailQueue(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop = Event()
+        self._threads = []
+        self._app = None
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            self._app = current_app._get_current_object()
+            for i in range(self._app.config['MAIL_WORKERS']):
+                thread = Thread(target=self._run, name='mail-worker-{}'.format(i),
+                                daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout=5)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        app = self._app
+        while not self._stop.is_set():
+            try:
+                sent = self.drain(app)
+            except Exception:
+                app.logger.exception('mail worker failed')
+                sent = 0
+            if not sent:
+                self._wakeup.wait(app.config['MAIL_POLL_INTERVAL'])
+                self._wakeup.clear()
+
+    def _claim(self):
+        """Reserviert bis zu MAIL_BATCH_SIZE fällige Nachrichten für diesen Worker."""
+        now = datetime.utcnow()
+        due = or_(
+            (OutgoingMail.status == 'pending') & (OutgoingMail.next_attempt <= now),
+            # von einem abgestürzten Worker liegengelassen
+            (OutgoingMail.status == 'sending') & (OutgoingMail.claimed_at <
+                now - timedelta(seconds=current_app.config['MAIL_CLAIM_TIMEOUT'])))
+        ids = db.session.scalars(select(OutgoingMail.id).where(due)
+                                 .order_by(OutgoingMail.id)
+                                 .limit(current_app.config['MAIL_BATCH_SIZE'])).all()
+        if not ids:
+            db.session.rollback()
+            return []
+        claim = uuid.uuid4().hex
+        db.session.execute(update(OutgoingMail)
+                           .where(OutgoingMail.id.in_(ids), due)
+                           .values(status='sending', claim=claim, claimed_at=now)
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        return OutgoingMail.query.filter_by(claim=claim).all()
+
+    def _failed(self, message, error):
+        message.attempts += 1
+        message.last_error = str(error)[:255]
+        message.claim = None
+        if message.attempts >= current_app.config['MAIL_MAX_ATTEMPTS']:
+            message.status = 'failed'
+            current_app.logger.error('giving up on mail {}: {}'.format(message.id, error))
+        else:
+            message.status = 'pending'
+            message.next_attempt = datetime.utcnow() + timedelta(
+                seconds=current_app.config['MAIL_RETRY_BACKOFF'] * 2 ** (message.attempts - 1))
+
+    def drain(self, app=None):
+        """Verschickt fällige Nachrichten, solange welche da sind; liefert die Anzahl."""
+        app = app or current_app._get_current_object()
+        sent = 0
+        with app.app_context():
+            batch = self._claim()
+            if not batch:
+                return 0
+            # Flask-Mail erst hier initialisieren und die Konfiguration bei
+            # jedem Verbindungsaufbau neu lesen (Message liest den Default-Sender)
+            state = app.extensions['mail'] = mail.init_mail(app.config, app.debug,
+                                                            app.testing)
+            try:
+                with Connection(state) as connection:
+                    while batch:
+                        for message in batch:
+                            try:
+                                connection.send(message.to_message())
+                            except Exception as e:
+                                self._failed(message, e)
+                            else:
+                                db.session.delete(message)
+                                sent += 1
+                        db.session.commit()
+                        batch = self._claim()
+            except Exception as e:
+                # Verbindung fehlgeschlagen: restlichen Stapel neu einplanen
+                db.session.rollback()
+                for message in batch:
+                    if message in db.session and message.status == 'sending':
+                        self._failed(message, e)
+                db.session.commit()
+                app.logger.warning('mail delivery failed: {}'.format(e))
+        return sent
+
+    def stats(self):
+        with current_app._get_current_object().app_context():
+            counts = dict(db.session.execute(
+                select(OutgoingMail.status, func.count())
+                .group_by(OutgoingMail.status)).all())
+            oldest = db.session.scalar(select(func.min(OutgoingMail.created))
+                                       .where(OutgoingMail.status == 'pending'))
+        return {'pending': counts.get('pending', 0),
+                'sending': counts.get('sending', 0),
+                'failed': counts.get('failed', 0),
+                'oldest_pending_seconds': (datetime.utcnow() - oldest).total_seconds()
+                if oldest else 0}
+
+
+outbox = MailQueue()
+atexit.register(outbox.stop)
 
 
 def send_email(subject, sender, recipients, text_body, html_body):
-    msg = Message(subject, sender=sender, recipients=recipients)
-    msg.body = text_body
-    msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start()
+    db.session.add(OutgoingMail(subject=subject, sender=sender,
+                                recipients=json.dumps(recipients),
+                                body=text_body, html=html_body))
+    db.session.commit()
+    # weckt nur einen Pool im selben Prozess; gestartet wird er hier nicht
+    outbox.wake()
 
 
 def send_password_reset_email(user):
     token = user.get_reset_password_token()
     send_email('[Microblog] Reset Your Password',
-               sender=app.config['ADMINS'][0],
+               sender=current_app.config['ADMINS'][0],
                recipients=[user.email],
                text_body=render_template('email/reset_password.txt',
                                          user=user, token=token),
@@ -1,6 +1,12 @@
-from flask import render_template, request, jsonify
+from flask import Blueprint, make_response, render_template, request, jsonify
 from werkzeug.http import HTTP_STATUS_CODES
-from app import app,db
+from app import db
+from app.metrics import registry as metrics
+from app.pagination import InvalidCursor
+from app.passwords import HashingOverloaded
+from app.sqlite import WriteTimeout
+
+bp = Blueprint('errors', __name__)
 
 def error_response(status_code, message=None):
     payload = {'error': HTTP_STATUS_CODES.get(status_code, 'Unknown error')}
@@ -13,8 +19,40 @@ def error_response(status_code, message=None):
 def bad_request(message):
     return error_response(400, message)
 
-@app.errorhandler(403)
+@bp.app_errorhandler(InvalidCursor)
+def invalid_cursor(error):
+    metrics.inc('microblog_errors_total', handler='invalid_cursor', status='400')
+    return bad_request('invalid cursor')
+
+@bp.app_errorhandler(HashingOverloaded)
+def service_unavailable(error):
+    metrics.inc('microblog_errors_total', handler='service_unavailable', status='503')
+    db.session.rollback()
+    if request.accept_mimetypes.accept_json and \
+        not request.accept_mimetypes.accept_html:
+        response = error_response(503, 'server busy, please retry')
+    else:
+        response = make_response(render_template('errorpages/503.html'), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+@bp.app_errorhandler(WriteTimeout)
+def write_timeout(error):
+    metrics.inc('microblog_errors_total', handler='write_timeout', status='503')
+    db.session.rollback()
+    if request.accept_mimetypes.accept_json and \
+        not request.accept_mimetypes.accept_html:
+        response = error_response(503, 'write timed out, it may still be applied'
+                                  if error.applied is None else
+                                  'write timed out, please retry')
+    else:
+        response = make_response(render_template('errorpages/503.html'), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+@bp.app_errorhandler(403)
 def unauthorized(error):
+    metrics.inc('microblog_errors_total', handler='unauthorized', status='403')
     if request.accept_mimetypes.accept_json and \
         not request.accept_mimetypes.accept_html:
         response = jsonify( {'error': 'Forbidden'} )
@@ -23,8 +61,9 @@ def unauthorized(error):
     else:
         return render_template('errorpages/403.html'), 403
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
+    metrics.inc('microblog_errors_total', handler='not_found_error', status='404')
     if request.accept_mimetypes.accept_json and \
         not request.accept_mimetypes.accept_html:
         response = jsonify( {'error': 'Not Found'} )
@@ -33,8 +72,9 @@ def not_found_error(error):
     else:
         return render_template('errorpages/404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def not_found_error(error):
+    metrics.inc('microblog_errors_total', handler='internal_error', status='500')
     db.session.rollback()
     if request.accept_mimetypes.accept_json and \
         not request.accept_mimetypes.accept_html:
@@ -0,0 +1,97 @@
+# app/export.py
+"""Bulk-Export von Posts und Usern als NDJSON (eine JSON-Zeile pro Zeile).
+
+Die Zeilen kommen über ``yield_per`` in Blöcken von EXPORT_CHUNK_SIZE aus der
+Datenbank (serverseitiger Cursor, wo der Treiber einen hat) und werden Block
+für Block geschrieben; der Speicherbedarf hängt nicht von der Tabellengröße
+ab. Es werden nur Spalten gelesen, keine ORM-Objekte gebaut.
+
+Inkrementelle Exporte: Posts sind nach (timestamp, id) sortiert, User nach
+(profile_updated, id). ``since`` und ``since_id`` bilden einen Cursor; es
+kommen nur Zeilen, deren (Zeitstempel, id) danach liegt. Zeitstempel und id
+der letzten Zeile sind der Cursor des nächsten Laufs, so gehen auch Zeilen
+mit demselben Zeitstempel nicht verloren. Ohne ``since_id`` kommen alle
+Zeilen ab ``since`` einschließlich, also eventuell doppelt. Bearbeitete
+Posts bekommen einen neuen Zeitstempel und kommen dadurch erneut mit.
+"""
+import json
+import zlib
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import select
+from app import db
+from app.models import User, Post
+from app.pagination import _beyond
+
+
+def parse_timestamp(value):
+    """ISO-8601-Zeitpunkt als naive UTC-Zeit wie in der Datenbank, oder None.
+
+    Ohne Zeitzone (oder mit 'Z') gilt UTC, ein Offset wird umgerechnet;
+    wirft ValueError.
+    """
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(value)
+    timestamp = datetime.fromisoformat(value[:-1] if value.endswith('Z') else value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _isoformat(value):
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+def _after(query, keys, since, since_id):
+    if since is None:
+        return query
+    if since_id is None:
+        return query.where(keys[0] >= since)
+    return query.where(_beyond(keys, (since, since_id), descending=False))
+
+
+def _posts(since, since_id):
+    keys = (Post.timestamp, Post.id)
+    query = select(Post.id, Post.user_id, Post.timestamp, Post.body).order_by(*keys)
+    return _after(query, keys, since, since_id), lambda row: {'id': row.id, 'user_id': row.user_id,
+                               'timestamp': _isoformat(row.timestamp),
+                               'body': row.body}
+
+
+def _users(since, since_id):
+    keys = (User.profile_updated, User.id)
+    query = select(User.id, User.username, User.about_me, User.last_seen,
+                   User.profile_updated, User.post_count, User.follower_count,
+                   User.followed_count).order_by(*keys)
+    return _after(query, keys, since, since_id), lambda row: {'id': row.id, 'username': row.username,
+                               'about_me': row.about_me,
+                               'last_seen': _isoformat(row.last_seen),
+                               'profile_updated': _isoformat(row.profile_updated),
+                               'post_count': row.post_count,
+                               'follower_count': row.follower_count,
+                               'followed_count': row.followed_count}
+
+
+KINDS = {'posts': _posts, 'users': _users}
+
+
+def ndjson(kind, since=None, since_id=None):
+    """Erzeugt den Export als str-Blöcke, ein Block pro EXPORT_CHUNK_SIZE Zeilen."""
+    query, to_dict = KINDS[kind](since, since_id)
+    chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+    result = db.session.execute(query, execution_options={'yield_per': chunk_size})
+    for rows in result.partitions():
+        yield ''.join(json.dumps(to_dict(row), separators=(',', ':')) + '\n'
+                      for row in rows)
+
+
+def gzipped(chunks):
+    """Komprimiert einen Strom von str-Blöcken zu gzip, ohne ihn zu sammeln."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
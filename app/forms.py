@@ -1,8 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField,PasswordField,BooleanField,SubmitField,TextAreaField
+from wtforms import StringField,PasswordField,BooleanField,SubmitField,TextAreaField,IntegerField
+from wtforms.widgets import HiddenInput
 from wtforms.validators import ValidationError, DataRequired, Email, EqualTo, Length
+from app import db
 from app.models import User
-from wtforms_sqlalchemy.fields import QuerySelectField
 
 
 class LoginForm(FlaskForm):
@@ -73,6 +74,11 @@ class EmptyForm(FlaskForm):
     submit = SubmitField('Submit')
 
 class QuerySelectDemoForm(FlaskForm):
-    users = QuerySelectField(allow_blank = True, get_label = 'email', 
+    # Auswahl per /api/users/suggest, das Feld enthält nur die User-ID
+    users = IntegerField('Users', widget=HiddenInput(),
     validators = [DataRequired()])
-    submit = SubmitField('Submit')
\ No newline at end of file
+    submit = SubmitField('Submit')
+
+    def validate_users(self, users):
+        if db.session.get(User, users.data) is None:
+            raise ValidationError('No user found.')
\ No newline at end of file
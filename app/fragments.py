@@ -0,0 +1,89 @@
+# app/fragments.py
+"""Prozesslokaler Cache für gerenderte Template-Fragmente.
+
+Im Template::
+
+    {% call fragment('post', post.id, (post.timestamp, post.author.profile_updated)) %}
+        ...
+    {% endcall %}
+
+Einträge sind nach (kind, id) abgelegt und merken sich die Version, aus der
+sie gerendert wurden (hier Post.timestamp, den das Bearbeiten neu setzt, und
+User.profile_updated des Autors); passt sie nicht mehr, wird neu gerendert
+und der Eintrag ersetzt. So sehen auch andere Worker einen bearbeiteten Post
+sofort. Bearbeitete oder gelöschte Posts entfernt app/models.py außerdem aus
+dem Cache dieses Prozesses; gelöschte Posts werden ohnehin nicht mehr
+gerendert, FRAGMENT_CACHE_TTL begrenzt nur noch den Speicher für sie.
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from flask import Blueprint
+from markupsafe import Markup
+
+bp = Blueprint('fragments', __name__)
+
+
+class FragmentCache(object):
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def init_app(self, app):
+        self.maxsize = app.config['FRAGMENT_CACHE_SIZE']
+        self.ttl = app.config['FRAGMENT_CACHE_TTL']
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version=None):
+        """Liefert das Fragment zu key in dieser Version oder None."""
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, html):
+        with self._lock:
+            self._entries[key] = (version, html, monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize,
+                'hit_ratio': self.hits / lookups if lookups else None}
+
+
+cache = FragmentCache()
+
+
+@bp.app_template_global()
+def fragment(kind, id, version=None, caller=None):
+    html = cache.get((kind, id), version)
+    if html is None:
+        html = Markup(caller())
+        cache.put((kind, id), version, html)
+    return html
@@ -0,0 +1,203 @@
+# app/graph.py
+"""Follow-Graph im Speicher: sortierte Adjazenzlisten als array('I').
+
+Mit FOLLOW_GRAPH = 'lazy' wird die Liste eines Users beim ersten Zugriff mit
+einer Query über den Primärschlüssel bzw. ix_followers_followed_id_follower_id
+geladen, mit 'preload' beim ersten Zugriff alle auf einmal. is_following ist
+danach eine binäre Suche ohne Datenbank.
+
+Jede Liste merkt sich followed_count bzw. follower_count des Users, mit dem
+sie geladen wurde. Der User wird ohnehin geladen (current_user, Profil); passt
+sein Zähler nicht mehr, hat ein anderer Worker den Graph geändert und die
+Liste wird neu geladen. Follows aus diesem Prozess (User.follow/unfollow,
+app/bulk.py) werden nach dem Commit direkt in die Listen übernommen. Als
+Rückfallebene laufen Listen nach FOLLOW_GRAPH_TTL Sekunden ab.
+
+Pro Kante liegen zwei IDs zu je 4 Byte im Speicher (Followed- und
+Follower-Liste), dazu 64 Byte pro geladener Liste. Wird FOLLOW_GRAPH_MAX_BYTES
+überschritten, fallen die am längsten nicht benutzten Listen heraus.
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+from threading import Lock
+from time import monotonic
+from sqlalchemy import select
+from app import db
+
+EMPTY = array('I')
+DIRECTIONS = ('followed', 'follower')
+
+
+def _contains(ids, id):
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+def _intersect(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return array('I', (id for id in a if _contains(b, id)))
+
+
+class FollowGraph(object):
+
+    def __init__(self, mode='off', ttl=300, max_bytes=256 * 1024 * 1024):
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._preloaded = False
+        self._lock = Lock()
+        # (Richtung, user_id) -> (Version, array('I'), läuft ab)
+        self._entries = OrderedDict()
+
+    def init_app(self, app):
+        self.mode = app.config['FOLLOW_GRAPH']
+        self.ttl = app.config['FOLLOW_GRAPH_TTL']
+        self.max_bytes = app.config['FOLLOW_GRAPH_MAX_BYTES']
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put(self, key, version, ids):
+        """Legt eine Liste ab; False, wenn sie das Budget allein sprengt."""
+        size = sys.getsizeof(ids)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= sys.getsizeof(old[1])
+            self._entries[key] = (version, ids, monotonic() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                key, (version, ids, expires) = self._entries.popitem(last=False)
+                self.bytes -= sys.getsizeof(ids)
+        return True
+
+    def _load(self, direction, user_id):
+        table = db.metadata.tables['followers']
+        key, value = (table.c.follower_id, table.c.followed_id) \
+            if direction == 'followed' else (table.c.followed_id, table.c.follower_id)
+        return array('I', db.session.scalars(
+            select(value).where(key == user_id).order_by(value)))
+
+    def ids(self, direction, user):
+        """Sortierte IDs, denen user folgt ('followed') bzw. die ihm folgen."""
+        if self.mode == 'preload' and not self._preloaded:
+            self.load_all()
+        version = getattr(user, direction + '_count')
+        if not version:
+            return EMPTY
+        key = (direction, user.id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[2] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        ids = self._load(direction, user.id)
+        self._put(key, version, ids)
+        return ids
+
+    def load_all(self, chunk_size=10000):
+        """Lädt alle Listen in zwei Durchläufen über followers."""
+        self._preloaded = True
+        user = db.metadata.tables['user']
+        versions = {id: (followed, follower) for id, followed, follower in
+                    db.session.execute(select(user.c.id, user.c.followed_count,
+                                              user.c.follower_count))}
+        table = db.metadata.tables['followers']
+        for i, (key, value) in enumerate(((table.c.follower_id, table.c.followed_id),
+                                          (table.c.followed_id, table.c.follower_id))):
+            rows = db.session.execute(select(key, value).order_by(key, value),
+                                      execution_options={'yield_per': chunk_size})
+            for user_id, group in groupby(rows, key=itemgetter(0)):
+                ids = array('I', (row[1] for row in group))
+                version = versions.get(user_id, (None, None))[i]
+                if not self._put((DIRECTIONS[i], user_id), version, ids):
+                    return
+
+    def is_following(self, follower, followed):
+        return _contains(self.ids('followed', follower), followed.id)
+
+    def is_mutual(self, user, other):
+        return self.is_following(user, other) and self.is_following(other, user)
+
+    def mutual(self, user):
+        """IDs, denen user folgt und die ihm zurück folgen."""
+        return _intersect(self.ids('followed', user), self.ids('follower', user))
+
+    def apply(self, changes):
+        """Übernimmt (follower_id, followed_id, following) nach dem Commit."""
+        for follower_id, followed_id, following in changes:
+            self._update(('followed', follower_id), followed_id, following)
+            self._update(('follower', followed_id), follower_id, following)
+
+    def _update(self, key, id, following):
+        # Leser halten evtl. noch die alte Liste, daher Kopie statt insert/pop
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            version, ids, expires = entry
+            i = bisect_left(ids, id)
+            present = i < len(ids) and ids[i] == id
+            if following and not present:
+                new = ids[:i] + array('I', (id,)) + ids[i:]
+                version += 1
+            elif not following and present:
+                new = ids[:i] + ids[i + 1:]
+                version -= 1
+            else:
+                return
+            self._entries[key] = (version, new, expires)
+            self.bytes += sys.getsizeof(new) - sys.getsizeof(ids)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self._preloaded = False
+
+    def stats(self):
+        ids = sum(len(entry[1]) for entry in self._entries.values())
+        lookups = self.hits + self.misses
+        return {'mode': self.mode, 'lists': len(self._entries), 'ids': ids,
+                'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                # zwei IDs pro Kante, wenn beide Richtungen geladen sind
+                'bytes_per_million_edges': round(self.bytes / ids * 2e6) if ids else None,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None}
+
+
+follows = FollowGraph()
+
+
+def record(session, follower_id, followed_id, following=True):
+    """Merkt eine Follow-Änderung vor, übernommen beim Commit der Session."""
+    session.info.setdefault('follow_changes', []).append(
+        (follower_id, followed_id, following))
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def apply_follow_changes(session):
+    changes = session.info.pop('follow_changes', None)
+    if changes and follows.enabled:
+        follows.apply(changes)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_follow_changes(session):
+    session.info.pop('follow_changes', None)
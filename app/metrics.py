@@ -0,0 +1,270 @@
+# app/metrics.py
+"""Prometheus-Metriken unter /metrics.
+
+Jeder Prozess zählt Requests, Latenzen und Fehler im Speicher; der Lock wird
+nur für die Dict-Updates gehalten, nie für I/O. Ist METRICS_DIR gesetzt
+(mehrere gunicorn-Worker), schreibt jeder Prozess seinen Stand alle
+METRICS_FLUSH_INTERVAL Sekunden nach METRICS_DIR/<pid>.json, und /metrics
+summiert die Dateien aller Worker. Das Verzeichnis sollte beim Start des
+Masters geleert werden; Gauges toter Prozesse werden ignoriert.
+"""
+import atexit
+import json
+import os
+from bisect import bisect_left
+from threading import Event, Lock, Thread
+from time import perf_counter
+from flask import Blueprint, current_app, g, request
+from app import db, fragments, graph, stream, tokens
+from app.email import outbox
+
+bp = Blueprint('metrics', __name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'microblog_http_requests_total':
+        ('counter', 'HTTP requests by endpoint, method and status.'),
+    'microblog_http_request_duration_seconds':
+        ('histogram', 'HTTP request latency by endpoint and method.'),
+    'microblog_errors_total':
+        ('counter', 'Responses produced by the handlers in app/errors.py.'),
+    'microblog_token_cache_hits_total':
+        ('counter', 'API token cache hits.'),
+    'microblog_token_cache_misses_total':
+        ('counter', 'API token cache misses.'),
+    'microblog_token_cache_hit_ratio':
+        ('gauge', 'API token cache hit ratio across all workers.'),
+    'microblog_fragment_cache_hits_total':
+        ('counter', 'Template fragment cache hits.'),
+    'microblog_fragment_cache_misses_total':
+        ('counter', 'Template fragment cache misses.'),
+    'microblog_follow_graph_bytes':
+        ('gauge', 'Memory held by the in-memory follow graph per worker.'),
+    'microblog_sse_streams':
+        ('gauge', 'Open Server-Sent Events timeline streams per worker.'),
+    'microblog_db_pool_size':
+        ('gauge', 'Configured connection pool size per worker.'),
+    'microblog_db_pool_checked_out':
+        ('gauge', 'Connections currently checked out per worker.'),
+    'microblog_db_pool_overflow':
+        ('gauge', 'Overflow connections currently open per worker.'),
+    'microblog_mail_queue':
+        ('gauge', 'Outgoing mails by status.'),
+    'microblog_mail_queue_oldest_pending_seconds':
+        ('gauge', 'Age of the oldest pending outgoing mail.'),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._thread = None
+        self._stop = Event()
+        self._app = None
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        # nicht kumulierte Bucket-Zähler plus +Inf, Summe am Ende
+        index = bisect_left(BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """Stand dieses Prozesses als JSON-fähiges Dict."""
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, list(h)) for key, h in self._histograms.items()]
+        cache = tokens.cache.stats()
+        counters += [(('microblog_token_cache_hits_total', ()), cache['hits']),
+                     (('microblog_token_cache_misses_total', ()), cache['misses'])]
+        cache = fragments.cache.stats()
+        counters += [(('microblog_fragment_cache_hits_total', ()), cache['hits']),
+                     (('microblog_fragment_cache_misses_total', ()), cache['misses'])]
+        pid = str(os.getpid())
+        pool = db.engine.pool
+        gauges = []
+        for name, attr in (('microblog_db_pool_size', 'size'),
+                           ('microblog_db_pool_checked_out', 'checkedout'),
+                           ('microblog_db_pool_overflow', 'overflow')):
+            # SingletonThreadPool/StaticPool (SQLite in-memory) haben keine Zähler
+            if hasattr(pool, attr):
+                gauges.append(((name, (('pid', pid),)), getattr(pool, attr)()))
+        if graph.follows.enabled:
+            gauges.append((('microblog_follow_graph_bytes', (('pid', pid),)),
+                           graph.follows.bytes))
+        gauges.append((('microblog_sse_streams', (('pid', pid),)), stream.broker.streams))
+        return {'pid': os.getpid(),
+                'counters': [[n, list(l), v] for (n, l), v in counters],
+                'histograms': [[n, list(l), h] for (n, l), h in histograms],
+                'gauges': [[n, list(l), v] for (n, l), v in gauges]}
+
+    def write(self, directory):
+        data = self.snapshot()
+        path = os.path.join(directory, '{}.json'.format(data['pid']))
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def start(self):
+        if self._thread is not None or not current_app.config['METRICS_DIR']:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._app = current_app._get_current_object()
+                self._thread = Thread(target=self._run, name='metrics-flush',
+                                      daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        app = self._app
+        while not self._stop.wait(app.config['METRICS_FLUSH_INTERVAL']):
+            try:
+                with app.app_context():
+                    self.write(app.config['METRICS_DIR'])
+            except Exception:
+                app.logger.exception('metrics flush failed')
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            with self._app.app_context():
+                self.write(self._app.config['METRICS_DIR'])
+
+
+registry = MetricsRegistry()
+atexit.register(registry.stop)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Summiert die Stände aller Worker (oder nur dieses Prozesses)."""
+    directory = current_app.config['METRICS_DIR']
+    if not directory:
+        snapshots = [registry.snapshot()]
+    else:
+        registry.write(directory)
+        snapshots = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # gerade geschrieben oder kaputt
+    counters, histograms, gauges = {}, {}, {}
+    for data in snapshots:
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+        if data['pid'] == os.getpid() or _alive(data['pid']):
+            for name, labels, value in data['gauges']:
+                gauges[(name, tuple(map(tuple, labels)))] = value
+    return counters, histograms, gauges
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                         .replace('"', '\\"').replace('\n', '\\n'))
+                          for k, v in pairs) + '}'
+
+
+def render(counters, histograms, gauges):
+    samples = {}
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, []).append('{}{} {}'.format(
+            name, _labels(labels), value))
+    for (name, labels), values in sorted(histograms.items()):
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), values[:-1]):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                name, _labels(labels, [('le', bound)]), cumulative))
+        lines.append('{}_sum{} {}'.format(name, _labels(labels), values[-1]))
+        lines.append('{}_count{} {}'.format(name, _labels(labels), cumulative))
+    for (name, labels), value in gauges.items():
+        samples.setdefault(name, []).append('{}{} {}'.format(
+            name, _labels(labels), value))
+    output = []
+    for name in sorted(samples):
+        kind, text = METRICS.get(name, ('untyped', name))
+        output.append('# HELP {} {}'.format(name, text))
+        output.append('# TYPE {} {}'.format(name, kind))
+        output.extend(sorted(samples[name]) if kind != 'histogram'
+                      else samples[name])
+    return '\n'.join(output) + '\n'
+
+
+@bp.before_app_request
+def start_timer():
+    registry.start()
+    g.metrics_start = perf_counter()
+
+
+@bp.after_app_request
+def record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'none'
+        registry.inc('microblog_http_requests_total', endpoint=endpoint,
+                     method=request.method, status=str(response.status_code))
+        registry.observe('microblog_http_request_duration_seconds',
+                         perf_counter() - start, endpoint=endpoint,
+                         method=request.method)
+    return response
+
+
+@bp.route('/metrics')
+def metrics():
+    counters, histograms, gauges = collect()
+    hits = counters.get(('microblog_token_cache_hits_total', ()), 0)
+    misses = counters.get(('microblog_token_cache_misses_total', ()), 0)
+    if hits + misses:
+        gauges[('microblog_token_cache_hit_ratio', ())] = hits / (hits + misses)
+    mail = outbox.stats()
+    for status in ('pending', 'sending', 'failed'):
+        gauges[('microblog_mail_queue', (('status', status),))] = mail[status]
+    gauges[('microblog_mail_queue_oldest_pending_seconds', ())] = \
+        mail['oldest_pending_seconds']
+    return render(counters, histograms, gauges), 200, \
+        {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -1,10 +1,15 @@
 # app/models.py
 
 from datetime import datetime, timedelta
-from app import app, db, login
-from flask import url_for
+from app import db, login
+from app import fragments, graph, search, stream, tokens
+from app.passwords import hasher, needs_rehash
+from app.pagination import ListPagination, collection_dict
+from flask import current_app, url_for
+from sqlalchemy import bindparam, delete, exists, false, func, insert, inspect, literal, or_, select, true, union, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql import ClauseElement
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from hashlib import md5
 from time import time
 import base64
@@ -15,10 +20,28 @@ import os
 def load_user(id):
     return User.query.get(int(id))
 
+# Zähler atomar in SQL erhöhen (SET x = x + n), bei neuen Objekten in Python
+def increment(obj, attr, delta=1):
+    state = inspect(obj)
+    value = state.dict.get(attr)
+    if state.pending:
+        value = (value or 0) + delta
+    elif isinstance(value, ClauseElement):
+        value = value + delta
+    else:
+        value = getattr(state.class_, attr) + delta
+    setattr(state.obj(), attr, value)
+
+def avatar_url(email, size):
+    digest = md5(email.lower().encode('utf-8')).hexdigest()
+    return 'https://www.gravatar.com/avatar/{}?s={}'.format(digest, size)
+
 followers = db.Table(
     'followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    # Umgekehrte Richtung für Follower-Listen und den Timeline-Fan-out
+    db.Index('ix_followers_followed_id_follower_id', 'followed_id', 'follower_id')
 )
 
 class User(UserMixin, db.Model):
@@ -31,6 +54,9 @@ class User(UserMixin, db.Model):
         )
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    # Version der gecachten Fragmente (app/fragments.py), ändert sich nur mit
+    # username, email und about_me
+    profile_updated = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     followed = db.relationship(
         'User', secondary=followers,
         primaryjoin=(followers.c.follower_id == id),
@@ -43,31 +69,112 @@ class User(UserMixin, db.Model):
     token = db.Column(db.String(32), index=True, unique=True)
     # Das Ablaufdatum des Token in der Datenbank
     token_expiration = db.Column(db.DateTime)
+    # Denormalisierte Zähler, gepflegt von follow/unfollow und Post-Änderungen
+    post_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    follower_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # "Who to follow" (app/recommend.py): neu zu rechnen bzw. zuletzt gerechnet
+    suggestions_stale = db.Column(db.Boolean, index=True, default=True,
+                                  server_default=true(), nullable=False)
+    suggestions_updated = db.Column(db.DateTime)
+    # Posts werden nicht an die Follower verteilt, sondern beim Lesen
+    # gemischt (Timeline.reclassify)
+    celebrity = db.Column(db.Boolean, default=False, server_default=false(),
+                          nullable=False)
+    # Nicht mehr celebrity, die älteren Posts sind aber noch nicht an alle
+    # Follower verteilt ("flask timeline backfill"); bis dahin weiter gemischt
+    timeline_backfill = db.Column(db.Boolean, index=True, default=False,
+                                  server_default=false(), nullable=False)
 
     #Basic accounting functionality
     def set_password(self,password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
+    # Bei Erfolg mit veralteten Parametern neu hashen (Aufrufer committet)
     def check_password(self,password):
-        return check_password_hash(self.password_hash,password)
+        if not self.password_hash or not hasher.check(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return 'https://www.gravatar.com/avatar/{}?s={}'.format(digest, size)
+        return avatar_url(self.email, size)
 
     # Follower logic
     def follow(self,user):
-        if not self.is_following(user):
+        if not self._follows(user):
             self.followed.append(user)
+            Timeline.backfill(self, user)
+            increment(self, 'followed_count')
+            increment(user, 'follower_count')
+            Timeline.reclassify([user.id])
+            graph.record(db.session, self.id, user.id)
+            self.suggestions_stale = user.suggestions_stale = True
 
     def unfollow(self,user):
-        if self.is_following(user):
+        if self._follows(user):
             self.followed.remove(user)
+            Timeline.purge(self, user)
+            increment(self, 'followed_count', -1)
+            increment(user, 'follower_count', -1)
+            Timeline.reclassify([user.id])
+            graph.record(db.session, self.id, user.id, False)
+            self.suggestions_stale = user.suggestions_stale = True
+
+    def remove(self):
+        """Löscht den User samt seinen Kanten (Aufrufer committet).
+
+        Die Zähler der Gegenseite sinken mit je einem UPDATE, die Timeline-
+        Einträge von und für den User verschwinden, und der Follow-Graph
+        übernimmt die entfernten Kanten nach dem Commit.
+        """
+        followed_ids = db.session.scalars(
+            select(followers.c.followed_id).where(followers.c.follower_id == self.id)).all()
+        follower_ids = select(followers.c.follower_id).where(followers.c.followed_id == self.id)
+        if graph.follows.enabled:
+            for follower_id in db.session.scalars(follower_ids):
+                graph.record(db.session, follower_id, self.id, False)
+        for followed_id in followed_ids:
+            graph.record(db.session, self.id, followed_id, False)
+        db.session.execute(update(User).where(User.id.in_(follower_ids))
+                           .values(followed_count=User.followed_count - 1,
+                                   suggestions_stale=True))
+        db.session.execute(update(User).where(User.id.in_(followed_ids))
+                           .values(follower_count=User.follower_count - 1,
+                                   suggestions_stale=True))
+        db.session.execute(delete(Timeline).where(
+            or_(Timeline.user_id == self.id, Timeline.author_id == self.id)))
+        # vorab per DELETE, sonst lädt der Flush beide Listen als Objekte
+        db.session.execute(delete(followers).where(
+            or_(followers.c.follower_id == self.id, followers.c.followed_id == self.id)))
+        Timeline.reclassify(followed_ids)
+        db.session.delete(self)
+
+    @staticmethod
+    def set_following(follower_id, followed_id, following=True):
+        # Auftrag für app.sqlite.writer, arbeitet nur mit IDs
+        follower = db.session.get(User, follower_id)
+        followed = db.session.get(User, followed_id)
+        if following:
+            follower.follow(followed)
+        else:
+            follower.unfollow(followed)
 
+    # Für Anzeigen aus dem Follow-Graph im Speicher, falls aktiv (app/graph.py)
     def is_following(self,user):
-        return self.followed.filter(
-            followers.c.followed_id == user.id
-        ).count() > 0
+        if graph.follows.enabled:
+            return graph.follows.is_following(self, user)
+        return self._follows(user)
+
+    def _follows(self,user):
+        # Direkter Lookup über den Primärschlüssel, ohne Join auf user; follow
+        # und unfollow prüfen immer in der Datenbank (in ihrer Transaktion).
+        # Core-Selects lösen keinen Autoflush aus, daher explizit
+        db.session.flush()
+        return db.session.scalar(select(followers.c.follower_id).where(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id == user.id)) is not None
     
     def followed_posts(self):
         followed = Post.query.join(
@@ -75,18 +182,37 @@ class User(UserMixin, db.Model):
                 followers.c.follower_id == self.id)
         own = Post.query.filter_by(user_id=self.id)
         return followed.union(own).order_by(Post.timestamp.desc())
+
+    # Vorberechnete Vorschläge (app/recommend.py), ohne die inzwischen gefolgten
+    def suggested(self):
+        return User.query.join(Suggestion, Suggestion.suggested_id == User.id) \
+            .filter(Suggestion.user_id == self.id,
+                    ~exists().where(followers.c.follower_id == self.id,
+                                    followers.c.followed_id == Suggestion.suggested_id)) \
+            .order_by(Suggestion.rank)
+
+    # Materialisierte Home-Timeline (siehe Timeline)
+    def timeline(self):
+        return Timeline.posts_for(self)[0]
+
+    # IDs der Gefolgten, aus dem Follow-Graph im Speicher falls aktiv
+    def followed_ids(self):
+        if graph.follows.enabled:
+            return list(graph.follows.ids('followed', self))
+        return db.session.scalars(select(followers.c.followed_id).where(
+            followers.c.follower_id == self.id)).all()
     
     
     #Reset password via mail logic
     def get_reset_password_token(self, expires_in=600):
         return jwt.encode(
             {'reset_password': self.id, 'exp': time() + expires_in},
-            app.config['SECRET_KEY'], algorithm='HS256')
+            current_app.config['SECRET_KEY'], algorithm='HS256')
 
     @staticmethod
     def verify_reset_password_token(token):
         try:
-            id = jwt.decode(token, app.config['SECRET_KEY'],
+            id = jwt.decode(token, current_app.config['SECRET_KEY'],
                             algorithms=['HS256'])['reset_password']
         except:
             return
@@ -98,6 +224,7 @@ class User(UserMixin, db.Model):
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
             return self.token
+        tokens.record(db.session, self.token)
         self.token = base64.b64encode(os.urandom(24)).decode('utf-8')
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
@@ -107,6 +234,7 @@ class User(UserMixin, db.Model):
     def revoke_token(self):
         # Ablaufdatum auf aktuelle Zeit - 1 sek. setzen
         #self.token = "" => is key and must be unique
+        tokens.record(db.session, self.token)
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
 
     # Token prüfen
@@ -129,13 +257,13 @@ class User(UserMixin, db.Model):
         'username': self.username,
         'last_seen': self.last_seen.isoformat() + 'Z',
         'about_me': self.about_me,
-        'post_count': self.posts.count(),
-        'follower_count': self.followers.count(),
-        'followed_count': self.followed.count(),
+        'post_count': self.post_count,
+        'follower_count': self.follower_count,
+        'followed_count': self.followed_count,
         '_links': {
-        'self': url_for('get_user', id=self.id, _external=True),
-        'followers': url_for('get_followers', id=self.id, _external=True),
-        'followed': url_for('get_followed', id=self.id, _external=True),
+        'self': url_for('api.get_user', id=self.id, _external=True),
+        'followers': url_for('api.get_followers', id=self.id, _external=True),
+        'followed': url_for('api.get_followed', id=self.id, _external=True),
         'avatar': self.avatar(128)
         }
         }
@@ -144,20 +272,20 @@ class User(UserMixin, db.Model):
         return data
     
     # API Methods
-    def followers_to_collection(self):
-        data = {'items': [item.to_dict() for item in self.followers]}
-        return data
-    
-    def followed_to_collection(self):
-        data = {'items': [item.to_dict() for item in self.followed]}
-        return data
-    
-    def posts_to_collection(self):
-        data = {'items': [item.to_dict() for item in self.posts]}
-        return data
-    
+    def followers_to_collection(self, limit, cursor=None):
+        return collection_dict(self.followers, (User.id,), limit, cursor,
+                               'api.get_followers', descending=False, id=self.id)
+
+    def followed_to_collection(self, limit, cursor=None):
+        return collection_dict(self.followed, (User.id,), limit, cursor,
+                               'api.get_followed', descending=False, id=self.id)
+
+    def posts_to_collection(self, limit, cursor=None):
+        return collection_dict(self.posts, (Post.timestamp, Post.id), limit,
+                               cursor, 'api.get_posts', id=self.id)
+
     def posts_byid_to_collection(self, id):
-        data = {'items': [item.to_dict() for item in self.posts if item.id == id]}
+        data = {'items': [item.to_dict() for item in self.posts.filter_by(id=id)]}
         return data
     
     def from_dict(self, data, new_user=False):
@@ -168,10 +296,32 @@ class User(UserMixin, db.Model):
                 self.set_password(data['password'])
     
     @staticmethod
-    def to_collection():
-        users = User.query.all()
-        data = {'items': [item.to_dict() for item in users]}
-        return(data)
+    def to_collection(limit, cursor=None):
+        return collection_dict(User.query, (User.id,), limit, cursor,
+                               'api.get_users', descending=False)
+
+    # Versionsmarker für bedingte GETs (app/conditional.py): alles, was
+    # to_dict() und die Profilseite vom User zeigen
+    def markers(self):
+        return (self.profile_updated, self.last_seen, self.post_count,
+                self.follower_count, self.followed_count)
+
+    @staticmethod
+    def version(id):
+        user = db.session.get(User, id)
+        return (user.markers(), None) if user is not None else None
+
+    # Zähler in einem UPDATE aus followers und post neu berechnen
+    @staticmethod
+    def repair_counters():
+        db.session.execute(update(User).values(
+            post_count=select(func.count(Post.id))
+                .where(Post.user_id == User.id).scalar_subquery(),
+            follower_count=select(func.count()).select_from(followers)
+                .where(followers.c.followed_id == User.id).scalar_subquery(),
+            followed_count=select(func.count()).select_from(followers)
+                .where(followers.c.follower_id == User.id).scalar_subquery()
+        ))
 
     def __repr__(self):
         return '<User {}>'.format(self.username)
@@ -182,14 +332,28 @@ class Post(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
+    # Profil-Seite und Follower-Teil von followed_posts(): user_id = ? ORDER BY timestamp
+    __table_args__ = (
+        db.Index('ix_post_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    @staticmethod
+    def publish(user_id, body):
+        """Legt einen Post an und verteilt ihn; liefert die ID (für app.sqlite.writer)."""
+        post = Post(body=body, user_id=user_id)
+        db.session.add(post)
+        Timeline.fan_out(post)
+        stream.record(db.session, post.id, post.user_id, post.timestamp, post.body)
+        return post.id
+
     # API Methods
     def to_dict(self):
         data = {
         'id' : self.id,
-        'url': url_for('get_posts', id=self.id, _external=True),
+        'url': url_for('api.get_posts', id=self.id, _external=True),
         'body': self.body,
         'timestamp': self.timestamp,
-        'author': url_for('get_user', id=self.user_id, _external=True)
+        'author': url_for('api.get_user', id=self.user_id, _external=True)
         }
         return data
     
@@ -199,10 +363,336 @@ class Post(db.Model):
             "timestamp": self.timestamp}
     
     @staticmethod
-    def to_collection():
-        resources = Post.query.all()
-        data = {'items': [item.to_dict() for item in resources]}
-        return(data)
+    def to_collection(limit, cursor=None):
+        return collection_dict(Post.query, (Post.timestamp, Post.id), limit,
+                               cursor, 'api.get_allposts')
+
+    @staticmethod
+    def version(user_id=None):
+        """(Marker, Last-Modified) der Posts eines Users bzw. aller Posts.
+
+        Neue Posts erhöhen die höchste ID und den neuesten Zeitstempel,
+        bearbeitete bekommen einen neuen Zeitstempel (update_post). Jeder Wert
+        ist ein eigener Index-Lookup; max() über zwei Spalten in einem SELECT
+        würde SQLite zu einem Scan der Tabelle zwingen.
+        """
+        newest = select(func.max(Post.timestamp))
+        if user_id is None:
+            markers = (db.session.scalar(select(func.max(Post.id))),
+                       db.session.scalar(newest))
+        else:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            markers = (user.post_count,
+                       db.session.scalar(newest.where(Post.user_id == user_id)))
+        return markers, markers[1]
+
+    # Volltextsuche, sortiert nach Relevanz und Aktualität (siehe app/search.py)
+    @staticmethod
+    def search(expression, page, per_page):
+        ids, has_next = search.query_index(expression, page, per_page)
+        posts = {p.id: p for p in Post.query.options(selectinload(Post.author))
+                 .filter(Post.id.in_(ids))} if ids else {}
+        return ListPagination([posts[id] for id in ids if id in posts],
+                              page, has_next)
 
     def __repr__(self):
-        return '<Post {}>'.format(self.body)
\ No newline at end of file
+        return '<Post {}>'.format(self.body)
+
+
+class Timeline(db.Model):
+    """Materialisierte Home-Timeline, ein Eintrag pro (Leser, Post).
+
+    Neue Posts werden beim Schreiben an die Follower verteilt (fan-out on
+    write). Autoren mit user.celebrity werden nicht verteilt, ihre Posts
+    werden beim Lesen dazugemischt. Das Flag setzt reclassify, sobald ein
+    Autor mehr als TIMELINE_FANOUT_THRESHOLD Follower hat, und nimmt es erst
+    unter der Hälfte wieder zurück, damit ein Autor am Schwellwert nicht bei
+    jedem Follow umgeschichtet wird. Die älteren Posts eines ehemaligen
+    Celebrity verteilt nicht der Request, sondern der Batch-Job
+    "flask timeline backfill" in Blöcken von Followern (backfill_block).
+
+    Gelesen und paginiert wird nach (timestamp, post_id) der Timeline selbst,
+    über den Index ix_timeline_user_id_timestamp_post_id und ohne Sortieren.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    timestamp = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_timeline_user_id_timestamp_post_id', 'user_id', 'timestamp', 'post_id'),
+        db.Index('ix_timeline_user_id_author_id', 'user_id', 'author_id'),
+    )
+
+    @staticmethod
+    def _entries(reader_id):
+        # Spalten für INSERT ... SELECT in die Timeline des Lesers
+        return select(literal(reader_id), Post.id, Post.user_id, Post.timestamp)
+
+    @staticmethod
+    def _insert(rows):
+        return insert(Timeline).from_select(
+            ['user_id', 'post_id', 'author_id', 'timestamp'], rows)
+
+    @staticmethod
+    def is_celebrity(user):
+        return user.celebrity
+
+    @staticmethod
+    def followed_celebrities(user):
+        # Gefolgte Accounts mit user.celebrity oder noch nicht nachverteilten
+        # Posts, werden beim Lesen gemischt
+        return db.session.scalars(
+            select(User.id)
+            .join(followers, followers.c.followed_id == User.id)
+            .where(followers.c.follower_id == user.id,
+                   or_(User.celebrity == true(), User.timeline_backfill == true()))
+        ).all()
+
+    @staticmethod
+    def reclassify(author_ids):
+        """Setzt user.celebrity nach den aktuellen Followerzahlen neu.
+
+        Wer celebrity wird, verliert seine Einträge in den Timelines der
+        Follower (sie werden ab jetzt gemischt). Wer es nicht mehr ist, wird
+        ab jetzt verteilt; die älteren Posts holt backfill_block nach, bis
+        dahin markiert user.timeline_backfill den Autor zum Mischen.
+        """
+        threshold = current_app.config['TIMELINE_FANOUT_THRESHOLD']
+        # schreibt ausstehende Zähler-Updates (SET x = x + n)
+        db.session.flush()
+        rows = db.session.execute(
+            select(User.id, User.celebrity, User.follower_count)
+            .where(User.id.in_(author_ids))).all()
+        up = [row.id for row in rows if not row.celebrity and row.follower_count > threshold]
+        down = [row.id for row in rows if row.celebrity and row.follower_count <= threshold // 2]
+        if up:
+            db.session.execute(update(User).where(User.id.in_(up))
+                               .values(celebrity=True, timeline_backfill=False))
+            for author_id in up:
+                db.session.execute(delete(Timeline).where(
+                    Timeline.user_id.in_(select(followers.c.follower_id)
+                                         .where(followers.c.followed_id == author_id)),
+                    Timeline.author_id == author_id))
+        if down:
+            db.session.execute(update(User).where(User.id.in_(down))
+                               .values(celebrity=False, timeline_backfill=True))
+
+    @staticmethod
+    def backfill_block(author_id, after, size):
+        """Verteilt die Posts eines ehemaligen Celebrity an die nächsten size
+        Follower mit ID > after; eine Transaktion von "flask timeline backfill".
+
+        Liefert die letzte Follower-ID des Blocks oder None, wenn der Autor
+        fertig ist (dann ist user.timeline_backfill zurückgesetzt).
+        """
+        author = db.session.get(User, author_id)
+        if author is None or author.celebrity or not author.timeline_backfill:
+            return None
+        readers = db.session.scalars(
+            select(followers.c.follower_id)
+            .where(followers.c.followed_id == author_id, followers.c.follower_id > after)
+            .order_by(followers.c.follower_id).limit(size)).all()
+        if not readers:
+            author.timeline_backfill = False
+            return None
+        # neue Posts und neue Follower hat fan_out bzw. backfill schon versorgt
+        db.session.execute(Timeline._insert(
+            select(followers.c.follower_id, Post.id, Post.user_id, Post.timestamp)
+            .join(followers, followers.c.followed_id == Post.user_id)
+            .where(Post.user_id == author_id, followers.c.follower_id.in_(readers),
+                   ~exists().where(Timeline.user_id == followers.c.follower_id,
+                                   Timeline.post_id == Post.id))))
+        return readers[-1]
+
+    @staticmethod
+    def fan_out(post):
+        """Verteilt einen neuen Post an den Autor und seine Follower."""
+        # schreibt den Post und ausstehende Zähler-Updates
+        db.session.flush()
+        author = db.session.get(User, post.user_id)
+        own = Timeline._entries(author.id).where(Post.id == post.id)
+        db.session.execute(Timeline._insert(own))
+        if Timeline.is_celebrity(author):
+            return
+        rows = select(followers.c.follower_id, Post.id, Post.user_id, Post.timestamp) \
+            .join(followers, followers.c.followed_id == Post.user_id) \
+            .where(Post.id == post.id)
+        db.session.execute(Timeline._insert(rows))
+
+    @staticmethod
+    def fan_out_many(post_ids):
+        """Wie fan_out für viele neue Posts auf einmal (app/bulk.py)."""
+        connection = db.session.connection()
+        connection.execute(Timeline._insert(
+            select(Post.user_id, Post.id, Post.user_id, Post.timestamp)
+            .where(Post.id.in_(post_ids))))
+        rows = select(followers.c.follower_id, Post.id, Post.user_id, Post.timestamp) \
+            .join(followers, followers.c.followed_id == Post.user_id) \
+            .join(User, User.id == Post.user_id) \
+            .where(Post.id.in_(post_ids), User.celebrity == false())
+        connection.execute(Timeline._insert(rows))
+
+    @staticmethod
+    def backfill_many(pairs):
+        """Wie backfill für viele (Leser-ID, Autor-ID)-Paare, als executemany."""
+        rows = select(bindparam('reader_id', type_=db.Integer), Post.id,
+                      Post.user_id, Post.timestamp) \
+            .join(User, User.id == Post.user_id) \
+            .where(Post.user_id == bindparam('author_id'), User.celebrity == false())
+        db.session.connection().execute(Timeline._insert(rows), [
+            {'reader_id': reader_id, 'author_id': author_id}
+            for reader_id, author_id in pairs])
+
+    @staticmethod
+    def backfill(reader, author):
+        if Timeline.is_celebrity(author):
+            return
+        rows = Timeline._entries(reader.id).where(Post.user_id == author.id)
+        db.session.execute(Timeline._insert(rows))
+
+    @staticmethod
+    def purge(reader, author):
+        db.session.execute(delete(Timeline).where(
+            Timeline.user_id == reader.id, Timeline.author_id == author.id))
+
+    @staticmethod
+    def retime(post):
+        """Übernimmt den neuen Zeitstempel eines bearbeiteten Posts."""
+        readers = select(followers.c.follower_id) \
+            .where(followers.c.followed_id == post.user_id) \
+            .union_all(select(literal(post.user_id)))
+        db.session.execute(update(Timeline)
+                           .where(Timeline.user_id.in_(readers),
+                                  Timeline.post_id == post.id)
+                           .values(timestamp=post.timestamp))
+
+    @staticmethod
+    def rebuild(user):
+        """Baut die Timeline eines Users aus followers und post neu auf."""
+        db.session.execute(delete(Timeline).where(Timeline.user_id == user.id))
+        db.session.execute(Timeline._insert(
+            Timeline._entries(user.id).where(Post.user_id == user.id)))
+        for author in user.followed:
+            Timeline.backfill(user, author)
+
+    @staticmethod
+    def posts_for(user, bound=None):
+        """(Query, Sortierschlüssel) der Home-Timeline, neueste zuerst.
+
+        Die Schlüssel heißen wie die Post-Attribute (timestamp, id), damit
+        KeysetPagination den Cursor aus den Posts bilden kann. Ohne gefolgte
+        Celebrities ist das ein Range-Scan über den Timeline-Index; sonst
+        werden die Einträge mit deren Posts vereinigt und sortiert. Mit
+        ``bound`` (KeysetPagination.bound) liest jeder Teil nur die Seite ab
+        dem Cursor, die Timeline über ix_timeline_user_id_timestamp_post_id,
+        jede Celebrity über ix_post_user_id_timestamp; gemischt werden dann
+        höchstens (Celebrities + 1) * (per_page + 1) Zeilen.
+        """
+        entries = select(Timeline.timestamp.label('timestamp'),
+                         Timeline.post_id.label('id')) \
+            .where(Timeline.user_id == user.id)
+        celebrities = Timeline.followed_celebrities(user)
+        if celebrities and bound is None:
+            # UNION: Einträge aus der Zeit vor dem Wechsel nur einmal
+            entries = entries.union(select(Post.timestamp, Post.id)
+                                    .where(Post.user_id.in_(celebrities)))
+        elif celebrities:
+            parts = [(entries, (Timeline.timestamp, Timeline.post_id))] + [
+                (select(Post.timestamp, Post.id).where(Post.user_id == author_id),
+                 (Post.timestamp, Post.id)) for author_id in celebrities]
+            # LIMIT in den Teilen geht nur in Unterabfragen
+            parts = [bound(part, keys).subquery() for part, keys in parts]
+            entries = union(*[select(part.c.timestamp, part.c.id) for part in parts])
+        entries = entries.subquery('entries')
+        keys = (entries.c.timestamp, entries.c.id)
+        posts = Post.query.join(entries, entries.c.id == Post.id) \
+            .order_by(*[key.desc() for key in keys])
+        return posts, keys
+
+
+class Suggestion(db.Model):
+    """Vorberechnete "Who to follow"-Vorschläge, RECOMMEND_TOP_K pro User.
+
+    Geschrieben nur vom Batch-Job in app/recommend.py.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+
+# post_count der Autoren im selben Flush wie INSERT/DELETE der Posts pflegen
+@db.event.listens_for(db.session, 'before_flush')
+def count_posts(session, flush_context, instances):
+    for post in session.new:
+        if isinstance(post, Post):
+            author = post.author or session.get(User, post.user_id)
+            increment(author, 'post_count')
+    for post in session.deleted:
+        if isinstance(post, Post):
+            increment(session.get(User, post.user_id), 'post_count', -1)
+
+
+# Neue Fragment-Version bei sichtbaren Profiländerungen, nicht bei Zählern
+# oder last_seen
+PROFILE_FIELDS = ('username', 'email', 'about_me')
+
+@db.event.listens_for(db.session, 'before_flush')
+def touch_profiles(session, flush_context, instances):
+    for user in session.dirty:
+        if isinstance(user, User):
+            attrs = inspect(user).attrs
+            if any(attrs[name].history.has_changes() for name in PROFILE_FIELDS):
+                user.profile_updated = datetime.utcnow()
+                for kind in ('avatar', 'profile'):
+                    fragments.cache.invalidate((kind, user.id))
+
+
+# Tokens gelöschter User ungültig machen; den Cache leert tokens.committed
+@db.event.listens_for(db.session, 'before_flush')
+def revoke_deleted_tokens(session, flush_context, instances):
+    for user in session.deleted:
+        if isinstance(user, User):
+            tokens.record(session, user.token)
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_tokens(session):
+    tokens.committed(session)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def keep_tokens(session):
+    session.info.pop('revoked_tokens', None)
+
+
+# Suchindex im selben Flush wie die Post-Änderung nachführen
+@db.event.listens_for(Post, 'after_insert')
+def index_post(mapper, connection, post):
+    search.add_to_index(connection, post.id, post.body)
+
+@db.event.listens_for(Post, 'after_update')
+def reindex_post(mapper, connection, post):
+    if inspect(post).attrs.body.history.has_changes():
+        search.remove_from_index(connection, post.id)
+        search.add_to_index(connection, post.id, post.body)
+
+@db.event.listens_for(Post, 'after_delete')
+def unindex_post(mapper, connection, post):
+    search.remove_from_index(connection, post.id)
+
+@db.event.listens_for(Post, 'after_update')
+@db.event.listens_for(Post, 'after_delete')
+def evict_post_fragment(mapper, connection, post):
+    fragments.cache.invalidate(('post', post.id))
+
+@db.event.listens_for(Post.__table__, 'after_create')
+def create_search_index(target, connection, **kw):
+    if search.backend(connection) == 'fts5':
+        search.create_fts(connection)
+
+@db.event.listens_for(Post.__table__, 'before_drop')
+def drop_search_index(target, connection, **kw):
+    if search.backend(connection) == 'fts5':
+        search.drop_fts(connection)
@@ -0,0 +1,213 @@
+# app/pagination.py
+import base64
+import binascii
+import json
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import DateTime, Integer, String, and_, or_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, values):
+    payload = [direction] + [v.isoformat() if isinstance(v, datetime) else v
+                             for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_value(key, value):
+    # Jeder Teil muss zum Spaltentyp passen, sonst landen Listen o.ä. als
+    # Parameter im SQL
+    if isinstance(key.type, DateTime):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        return datetime.fromisoformat(value)
+    if isinstance(key.type, Integer):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise TypeError(value)
+    elif isinstance(key.type, String):
+        if not isinstance(value, str):
+            raise TypeError(value)
+    elif isinstance(value, (list, dict)):
+        raise TypeError(value)
+    return value
+
+
+def decode_cursor(cursor, keys):
+    """Liefert (direction, values) oder wirft InvalidCursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+        direction, values = payload[0], payload[1:]
+        if direction not in ('n', 'p') or len(values) != len(keys):
+            raise InvalidCursor(cursor)
+        return direction, [_decode_value(k, v) for k, v in zip(keys, values)]
+    except (binascii.Error, UnicodeDecodeError, TypeError, IndexError,
+            KeyError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def _beyond(keys, values, descending):
+    # Lexikographischer Vergleich (k1, k2, ...) < (v1, v2, ...) bzw. >.
+    # Das redundante k1 <= v1 erlaubt einen Range-Scan über den Index auf k1.
+    key, value = keys[0], values[0]
+    if len(keys) == 1:
+        return key < value if descending else key > value
+    strict = key < value if descending else key > value
+    loose = key <= value if descending else key >= value
+    return and_(loose, or_(strict, and_(key == value,
+                                        _beyond(keys[1:], values[1:], descending))))
+
+
+class KeysetPagination(object):
+    """Cursor-Pagination über eindeutige Sortierschlüssel (ohne OFFSET/COUNT).
+
+    ``keys`` sind die Spalten, nach denen die Liste sortiert ist, z.B.
+    ``(Post.timestamp, Post.id)``; der letzte Schlüssel muss eindeutig sein.
+    Mit ``defer=True`` wird ``self.query`` nur gebaut (Query oder Select);
+    der Aufrufer führt sie selbst aus und übergibt die Zeilen an ``load``
+    (app/asgi.py).
+
+    ``query`` kann auch eine Funktion ``query(bound) -> (query, keys)`` sein
+    (``keys`` dann None). Sie wendet ``bound`` auf jeden Teil einer
+    Vereinigung an, damit jeder Teil nur diese Seite über seinen eigenen
+    Index liest und erst die Teilergebnisse gemischt werden
+    (Timeline.posts_for).
+    """
+
+    def __init__(self, query, keys, per_page, cursor=None, descending=True,
+                 defer=False):
+        self.per_page = per_page
+        self.cursor = cursor
+        self.descending = descending
+        self._direction = None
+        if callable(query):
+            query, keys = query(self.bound)
+        self.keys = keys
+        self.query = self.bound(query, keys)
+        if not defer:
+            self.load(self.query.all())
+
+    def bound(self, query, keys):
+        """query nach keys sortiert, ab dem Cursor, höchstens eine Seite (+1)."""
+        direction, values = decode_cursor(self.cursor, keys) if self.cursor \
+            else (None, None)
+        self._direction = direction
+        ordering = self.descending != (direction == 'p')
+        query = query.order_by(None).order_by(
+            *[k.desc() if ordering else k.asc() for k in keys])
+        if values is not None:
+            query = query.filter(_beyond(keys, values, ordering))
+        return query.limit(self.per_page + 1)
+
+    def load(self, items):
+        more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if self._direction == 'p':
+            items.reverse()
+            self.has_prev, self.has_next = more, True
+        else:
+            self.has_prev, self.has_next = self._direction == 'n', more
+        self.items = items
+
+    def _cursor(self, direction, item):
+        return encode_cursor(direction, [getattr(item, k.key) for k in self.keys])
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return self._cursor('n', self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return self._cursor('p', self.items[0])
+
+    @property
+    def next_args(self):
+        return {'cursor': self.next_cursor}
+
+    @property
+    def prev_args(self):
+        return {'cursor': self.prev_cursor}
+
+
+class OffsetPagination(object):
+    """Alte ?page= Pagination, damit bestehende Links weiter funktionieren."""
+
+    def __init__(self, query, page, per_page):
+        self.pagination = query.paginate(page=page, per_page=per_page,
+                                         error_out=False)
+        self.items = self.pagination.items
+        self.has_next = self.pagination.has_next
+        self.has_prev = self.pagination.has_prev
+
+    @property
+    def next_args(self):
+        return {'page': self.pagination.next_num}
+
+    @property
+    def prev_args(self):
+        return {'page': self.pagination.prev_num}
+
+
+class ListPagination(object):
+    """Seitenweise Ergebnisse ohne Sortierschlüssel (z.B. Suchranking)."""
+
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+        self.has_prev = page > 1
+
+    @property
+    def next_args(self):
+        return {'page': self.page + 1}
+
+    @property
+    def prev_args(self):
+        return {'page': self.page - 1}
+
+
+def paginate(query, keys, per_page, descending=True):
+    """Paginiert eine Liste anhand von ?cursor= oder (legacy) ?page=."""
+    page = request.args.get('page', None, type=int)
+    if page is not None:
+        if callable(query):
+            query = query(None)[0]
+        return OffsetPagination(query, page, per_page)
+    try:
+        return KeysetPagination(query, keys, per_page,
+                                request.args.get('cursor', None, type=str),
+                                descending)
+    except InvalidCursor:
+        return KeysetPagination(query, keys, per_page, None, descending)
+
+
+def collection_dict(query, keys, limit, cursor, endpoint, descending=True,
+                    **kwargs):
+    """API-Collection mit höchstens ``limit`` Einträgen plus _meta und _links."""
+    page = KeysetPagination(query, keys, limit, cursor, descending)
+    return page_dict(page, limit, cursor, endpoint, **kwargs)
+
+
+def page_dict(page, limit, cursor, endpoint, **kwargs):
+    return {
+        'items': [item.to_dict() for item in page.items],
+        '_meta': {
+            'limit': limit,
+            'count': len(page.items),
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor
+        },
+        '_links': {
+            'self': url_for(endpoint, limit=limit, cursor=cursor, **kwargs),
+            'next': url_for(endpoint, limit=limit, cursor=page.next_cursor,
+                            **kwargs) if page.next_cursor else None,
+            'prev': url_for(endpoint, limit=limit, cursor=page.prev_cursor,
+                            **kwargs) if page.prev_cursor else None
+        }
+    }
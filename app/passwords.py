@@ -0,0 +1,106 @@
+# app/passwords.py
+"""Passwort-Hashing in einem begrenzten Prozess-Pool.
+
+Hashing ist CPU-gebunden; damit ein Login-Ansturm nicht alle Request-Threads
+blockiert, laufen generate/check in PASSWORD_HASH_WORKERS Prozessen. Sind
+bereits PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE Aufträge unterwegs,
+wird HashingOverloaded geworfen (wird in app/errors.py zu 503 mit
+Retry-After), ebenso wenn ein Auftrag länger als PASSWORD_HASH_TIMEOUT
+Sekunden dauert.
+Mit PASSWORD_HASH_WORKERS = 0 wird im aufrufenden Thread gehasht.
+
+Die Worker werden per forkserver/spawn gestartet und importieren dabei das
+Hauptmodul; eigene Skripte brauchen deshalb ``if __name__ == '__main__'``.
+"""
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, \
+    check_password_hash
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+class PasswordHasher(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pool = None
+        self._slots = None
+
+    def _start(self):
+        with self._lock:
+            if self._pool is None:
+                workers = current_app.config['PASSWORD_HASH_WORKERS']
+                method = 'forkserver' if 'forkserver' in \
+                    multiprocessing.get_all_start_methods() else 'spawn'
+                self._slots = BoundedSemaphore(
+                    workers + current_app.config['PASSWORD_HASH_MAX_QUEUE'])
+                self._pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(method))
+
+    def _run(self, fn, *args):
+        if current_app.config['PASSWORD_HASH_WORKERS'] <= 0:
+            return fn(*args)
+        if self._pool is None:
+            self._start()
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded()
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=current_app.config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError as e:
+            # der Auftrag belegt seinen Platz weiter, bis er fertig ist
+            future.cancel()
+            raise HashingOverloaded('timed out') from e
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password,
+                         current_app.config['PASSWORD_HASH_METHOD'],
+                         current_app.config['PASSWORD_SALT_LENGTH'])
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def _parameters(method):
+    # (Verfahren, Hash, Iterationen); 'pbkdf2:sha256' speichert werkzeug als
+    # 'pbkdf2:sha256:260000'
+    if method.startswith('pbkdf2:'):
+        parts = method.split(':')
+        return ('pbkdf2', parts[1] or 'sha256',
+                int(parts[2]) if len(parts) > 2 else DEFAULT_PBKDF2_ITERATIONS)
+    return (method, None, None)
+
+
+def needs_rehash(pwhash):
+    """True, wenn der Hash nicht mit den aktuellen Parametern erzeugt wurde."""
+    if not pwhash or pwhash.count('$') != 2:
+        return True
+    method, salt, _ = pwhash.split('$')
+    try:
+        parameters = _parameters(method)
+    except ValueError:
+        return True
+    return parameters != _parameters(current_app.config['PASSWORD_HASH_METHOD']) or \
+        len(salt) != current_app.config['PASSWORD_SALT_LENGTH']
+
+
+hasher = PasswordHasher()
+atexit.register(hasher.shutdown)
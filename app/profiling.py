@@ -0,0 +1,98 @@
+# app/profiling.py
+"""SQL-Statements, DB-Zeit und Template-Zeit pro Request.
+
+Die Engine-Events hängen an der Klasse Engine und gelten damit für alle
+Engines der App. Jede Response bekommt einen Server-Timing-Header
+(db, tpl, total); Requests über SLOW_REQUEST_MS oder SLOW_REQUEST_QUERIES
+werden mit ihren Statements über das Log der App protokolliert.
+"""
+from time import perf_counter
+from flask import Blueprint, before_render_template, current_app, g, \
+    has_request_context, request, template_rendered
+from sqlalchemy.engine import Engine
+from app import db
+
+bp = Blueprint('profiling', __name__)
+
+MAX_LOGGED_STATEMENTS = 100
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.statements = []
+        self._templates = []
+
+    def query(self, statement, duration):
+        self.queries += 1
+        self.db_time += duration
+        if len(self.statements) < MAX_LOGGED_STATEMENTS:
+            self.statements.append((duration, statement))
+
+    def server_timing(self, total):
+        return 'db;dur={:.1f};desc="{} queries", tpl;dur={:.1f}, ' \
+            'total;dur={:.1f}'.format(self.db_time * 1000, self.queries,
+                                      self.template_time * 1000, total * 1000)
+
+
+def current_stats():
+    if has_request_context():
+        return g.get('request_stats')
+
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = perf_counter()
+
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    duration = perf_counter() - conn.info.pop('query_start')
+    stats = current_stats()
+    if stats is not None:
+        stats.query(statement, duration)
+
+
+@before_render_template.connect
+def start_template(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None:
+        stats._templates.append(perf_counter())
+
+
+@template_rendered.connect
+def end_template(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None and stats._templates:
+        duration = perf_counter() - stats._templates.pop()
+        # verschachtelte render_template()-Aufrufe nur einmal zählen
+        if not stats._templates:
+            stats.template_time += duration
+
+
+@bp.before_app_request
+def start_request():
+    g.request_stats = RequestStats()
+
+
+@bp.after_app_request
+def end_request(response):
+    stats = current_stats()
+    if stats is None:
+        return response
+    total = perf_counter() - stats.start
+    response.headers['Server-Timing'] = stats.server_timing(total)
+    if total * 1000 > current_app.config['SLOW_REQUEST_MS'] or \
+            stats.queries > current_app.config['SLOW_REQUEST_QUERIES']:
+        current_app.logger.warning(
+            'slow request {} {}: {:.1f} ms, {} queries, {:.1f} ms db\n{}'.format(
+                request.method, request.full_path.rstrip('?'),
+                total * 1000, stats.queries, stats.db_time * 1000,
+                '\n'.join('  {:7.2f} ms  {}'.format(
+                    duration * 1000, ' '.join(statement.split()))
+                    for duration, statement in stats.statements)))
+    return response
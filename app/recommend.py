@@ -0,0 +1,164 @@
+# app/recommend.py
+""""Who to follow": Vorschläge aus dem Follower-Graphen, als Batch-Job.
+
+Der Score eines Kandidaten c für den User u setzt sich zusammen aus:
+
+- Freunden von Freunden: wie viele der Accounts, denen u folgt, c folgen
+  (A·A, Gewicht RECOMMEND_FOF_WEIGHT);
+- Co-Followern: wie viele der Follower von u ebenfalls c folgen
+  (Aᵀ·A, Gewicht RECOMMEND_COFOLLOW_WEIGHT).
+
+u selbst und Accounts, denen u schon folgt, fallen weg. Die besten
+RECOMMEND_TOP_K Kandidaten landen in der Tabelle suggestion. Requests lesen
+nur diese (User.suggested), ohne den Graphen zu durchlaufen.
+
+``refresh()`` rechnet nur User mit user.suggestions_stale neu; follow,
+unfollow und der Massenimport setzen das Flag für beide Seiten.
+``refresh(full=True)`` rechnet alle. Follows von u ändern auch die
+Freunde-von-Freunden-Scores seiner Follower; das holt erst der nächste
+volle Lauf nach.
+
+Ist scipy installiert, werden die Scores blockweise (RECOMMEND_BLOCK_SIZE
+User) als Sparse-Matrix-Produkte gerechnet, sonst über Adjazenzlisten in
+reinem Python.
+"""
+import heapq
+from array import array
+from collections import defaultdict
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+from app import db
+from app.models import User, Suggestion, followers
+from app.sqlite import writer
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+def _neighbours(key, value, ids=None, chunk_size=500):
+    """user_id -> sortierte array('I') der Nachbarn, für ids oder alle User."""
+    query = select(key, value).order_by(key, value)
+    if ids is None:
+        results = [db.session.execute(query)]
+    else:
+        ids = sorted(ids)
+        results = [db.session.execute(query.where(key.in_(ids[i:i + chunk_size])))
+                   for i in range(0, len(ids), chunk_size)]
+    neighbours = {}
+    for rows in results:
+        for user_id, group in groupby(rows, key=itemgetter(0)):
+            neighbours[user_id] = array('I', (row[1] for row in group))
+    return neighbours
+
+
+class PythonScorer(object):
+    """Scores über Adjazenzlisten; lädt nur, was die User eines Blocks brauchen."""
+
+    def __init__(self, weights, full):
+        self.fof, self.cofollow = weights
+        self.followed = _neighbours(followers.c.follower_id,
+                                    followers.c.followed_id) if full else {}
+        self.followers = _neighbours(followers.c.followed_id,
+                                     followers.c.follower_id) if full else {}
+        self.full = full
+
+    def _prefetch(self, user_ids):
+        self.followed = _neighbours(followers.c.follower_id, followers.c.followed_id,
+                                    user_ids)
+        self.followers = _neighbours(followers.c.followed_id, followers.c.follower_id,
+                                     user_ids)
+        wanted = {id for ids in self.followed.values() for id in ids} | \
+            {id for ids in self.followers.values() for id in ids}
+        self.followed.update(_neighbours(followers.c.follower_id, followers.c.followed_id,
+                                         wanted - self.followed.keys()))
+
+    def scores(self, user_ids):
+        if not self.full:
+            self._prefetch(user_ids)
+        for user_id in user_ids:
+            scores = defaultdict(float)
+            for friend in self.followed.get(user_id, ()):
+                for candidate in self.followed.get(friend, ()):
+                    scores[candidate] += self.fof
+            for follower in self.followers.get(user_id, ()):
+                for candidate in self.followed.get(follower, ()):
+                    scores[candidate] += self.cofollow
+            yield user_id, scores, self.followed.get(user_id, ())
+
+
+class SparseScorer(object):
+    """Scores als Zeilen von fof·A·A + cofollow·Aᵀ·A (scipy.sparse)."""
+
+    def __init__(self, weights, full):
+        self.fof, self.cofollow = weights
+        edges = db.session.execute(select(followers.c.follower_id,
+                                          followers.c.followed_id)).all()
+        size = (db.session.scalar(select(func.max(User.id))) or 0) + 1
+        source = np.fromiter((e[0] for e in edges), dtype=np.int64, count=len(edges))
+        target = np.fromiter((e[1] for e in edges), dtype=np.int64, count=len(edges))
+        self.a = sparse.csr_matrix((np.ones(len(edges), dtype=np.float32),
+                                    (source, target)), shape=(size, size))
+        self.at = self.a.T.tocsr()
+
+    def scores(self, user_ids):
+        rows = np.array(user_ids, dtype=np.int64)
+        block = (self.fof * (self.a[rows] @ self.a) +
+                 self.cofollow * (self.at[rows] @ self.a)).tocsr()
+        for i, user_id in enumerate(user_ids):
+            start, end = block.indptr[i], block.indptr[i + 1]
+            followed = self.a.indices[self.a.indptr[user_id]:self.a.indptr[user_id + 1]]
+            yield user_id, dict(zip(block.indices[start:end].tolist(),
+                                    block.data[start:end].tolist())), \
+                np.sort(followed).tolist()
+
+
+def top(user_id, scores, followed, k):
+    """Die k besten Kandidaten als (score, id), bei Gleichstand kleinere ID."""
+    followed = set(followed)
+    candidates = ((score, id) for id, score in scores.items()
+                  if id != user_id and id not in followed)
+    return heapq.nlargest(k, candidates, key=lambda c: (c[0], -c[1]))
+
+
+def _claim(user_ids):
+    # vor dem Rechnen, damit ein Follow währenddessen das Flag wieder setzt
+    db.session.execute(update(User).where(User.id.in_(user_ids))
+                       .values(suggestions_stale=False))
+
+
+def _store(user_ids, rows):
+    db.session.execute(delete(Suggestion).where(Suggestion.user_id.in_(user_ids)))
+    if rows:
+        db.session.connection().execute(Suggestion.__table__.insert(), rows)
+    db.session.execute(update(User).where(User.id.in_(user_ids))
+                       .values(suggestions_updated=datetime.utcnow()))
+
+
+def refresh(full=False):
+    """Rechnet die Vorschläge neu (nur veraltete oder alle); liefert die Anzahl User."""
+    config = current_app.config
+    query = select(User.id).order_by(User.id)
+    if not full:
+        query = query.where(User.suggestions_stale == True)
+    user_ids = db.session.scalars(query).all()
+    if not user_ids:
+        return 0
+    weights = config['RECOMMEND_FOF_WEIGHT'], config['RECOMMEND_COFOLLOW_WEIGHT']
+    scorer = (SparseScorer if sparse is not None else PythonScorer)(weights, full)
+    size, k = config['RECOMMEND_BLOCK_SIZE'], config['RECOMMEND_TOP_K']
+    for start in range(0, len(user_ids), size):
+        block = user_ids[start:start + size]
+        writer.run(_claim, block)
+        rows = []
+        for user_id, scores, followed in scorer.scores(block):
+            rows.extend({'user_id': user_id, 'rank': rank, 'suggested_id': id,
+                         'score': score}
+                        for rank, (score, id) in enumerate(top(user_id, scores, followed, k)))
+        writer.run(_store, block, rows)
+    return len(user_ids)
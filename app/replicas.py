@@ -0,0 +1,138 @@
+# app/replicas.py
+"""Lesezugriffe auf Read-Replicas verteilen.
+
+Views mit ``@replica`` lesen bei GET/HEAD von einer der Replicas aus
+DATABASE_REPLICA_URLS (als SQLALCHEMY_BINDS ``replica0``, ``replica1``, ...).
+Alles andere geht an die Primärdatenbank: Flushes, INSERT/UPDATE/DELETE und
+jeder weitere Zugriff im selben Request nach einem Schreibvorgang.
+
+Nach einem Commit liest der angemeldete User (Token oder Login-Session) für
+REPLICA_STICKY_SECONDS vom Primary (read your own writes). Der Eintrag
+hängt an der User-ID, nicht an einem Cookie, und liegt wie der Token-Cache
+im Prozess: ein anderer Worker kennt ihn nicht. Welcher User angemeldet ist,
+sagt die mit ``user_id_loader`` registrierte Funktion (app/api.py); geprüft
+wird bei jeder Query, weil der Token erst in der View geprüft wird.
+
+Das Modul importiert nichts aus ``app``, weil RoutingSession schon beim
+Anlegen von ``db`` gebraucht wird; die Request-Hooks kommen über init_app().
+"""
+import random
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+
+def replica(view):
+    """Markiert eine View als nur lesend (darf von einer Replica lesen)."""
+    view.use_replica = True
+    return view
+
+
+class PrimaryPins(object):
+    """user_id -> Zeitpunkt, bis zu dem der User vom Primary liest."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def pin(self, user_id, until):
+        with self._lock:
+            self._entries[user_id] = until
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pinned(self, user_id):
+        until = self._entries.get(user_id)
+        if until is None:
+            return False
+        if until > time():
+            return True
+        with self._lock:
+            self._entries.pop(user_id, None)
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+pins = PrimaryPins()
+_user_id = None
+
+
+def user_id_loader(fn):
+    """Registriert die Funktion, die die ID des angemeldeten Users liefert."""
+    global _user_id
+    _user_id = fn
+    return fn
+
+
+def current_user_id():
+    return _user_id() if _user_id is not None else None
+
+
+def mark_written(session):
+    """Restlicher Request und (nach dem Commit) der Client lesen vom Primary."""
+    session.info['wrote'] = True
+    if has_request_context():
+        g.committed = True
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not self.info.get('wrote') \
+                and not isinstance(clause, UpdateBase) \
+                and has_request_context() and g.get('replica') \
+                and not pins.pinned(current_user_id()):
+            return self._db.engines[g.replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def mark_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or \
+            orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def mark_commit(session):
+    if session.info.get('wrote'):
+        mark_written(session)
+
+
+def _choose_replica(app):
+    keys = app.config['REPLICA_BIND_KEYS']
+    if not keys or request.method not in ('GET', 'HEAD'):
+        return None
+    view = app.view_functions.get(request.endpoint)
+    if not getattr(view, 'use_replica', False):
+        return None
+    return random.choice(keys)
+
+
+def init_app(app, db):
+    @app.before_request
+    def route_reads():
+        db.session.info.pop('wrote', None)
+        g.replica = _choose_replica(app)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.pop('committed', False) and app.config['REPLICA_BIND_KEYS']:
+            user_id = current_user_id()
+            if user_id is not None:
+                pins.pin(user_id, time() + app.config['REPLICA_STICKY_SECONDS'])
+        return response
@@ -1,149 +1,164 @@
 # app/routes.py
-from flask import flash, jsonify, redirect, render_template, url_for, request
+from flask import Blueprint, current_app, flash, jsonify, redirect, render_template, url_for, request
 from flask_login import login_user, current_user, logout_user, login_required
-from app import app, db
-from app.models import User, Post
+from app import db
+from app.activity import tracker as last_seen
+from app.conditional import conditional
+from app.models import User, Post, Timeline
 from app.forms import LoginForm, RegisterForm, ResetPasswordForm,ResetPasswordRequestForm, EditProfileForm,DeleteProfileForm, EmptyForm, PostForm
 from app.forms import QuerySelectDemoForm
 from app.email import send_password_reset_email
+from app.pagination import paginate
+from app.replicas import replica
+from app.sqlite import writer
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
 from werkzeug.urls import url_parse
-from datetime import datetime
 
+bp = Blueprint('main', __name__)
 
 
-@app.before_request
+
+@bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        last_seen.touch(current_user)
 
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/index', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/index', methods=['GET', 'POST'])
 @login_required
 def index():
     form = PostForm()
     if form.validate_on_submit():
-        post = Post(body=form.post.data, author=current_user)
-        db.session.add(post)
-        db.session.commit()
+        writer.run(Post.publish, current_user.id, form.post.data)
         flash('Your post is now live!', 'success')
-        return redirect(url_for('index'))
-    page = request.args.get('page', 1, type=int)
-    posts = current_user.followed_posts().paginate(
-        page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('index', page=posts.next_num) \
+        return redirect(url_for('main.index'))
+    # Cursor und LIMIT in jedem Teil der Timeline (Timeline.posts_for); die
+    # Autoren der Seite in einer Query laden statt einzeln beim Rendern
+    def timeline(bound):
+        query, keys = Timeline.posts_for(current_user, bound)
+        return query.options(selectinload(Post.author)), keys
+    posts = paginate(timeline, None, current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.index', **posts.next_args) \
         if posts.has_next else None
-    prev_url = url_for('index', page=posts.prev_num) \
+    prev_url = url_for('main.index', **posts.prev_args) \
         if posts.has_prev else None
+    # neue Posts live ankündigen, nur auf der ersten Seite (app/stream.py)
+    stream_url = url_for('api.stream_timeline') \
+        if current_app.config['SSE_ENABLED'] and not posts.has_prev else None
     return render_template('index.html', title='Home', form=form,
                            posts=posts.items, next_url=next_url,
-                           prev_url=prev_url)
+                           prev_url=prev_url, stream_url=stream_url)
 
-@app.route('/explore')
+# Versionsmarker der Seiten für bedingte GETs (app/conditional.py). Explore
+# zeigt Avatare und Namen beliebiger Autoren, daher das neueste Profil
+def explore_version():
+    posts, last_modified = Post.version()
+    return (posts, db.session.scalar(select(func.max(User.profile_updated)))), None
+
+def user_version(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        return None
+    posts, last_modified = Post.version(user.id)
+    return (user.markers(), posts, current_user.is_following(user),
+            user.suggestions_updated), None
+
+@bp.route('/explore')
+@replica
 @login_required
+@conditional(explore_version, html=True)
 def explore():
-    page = request.args.get('page', 1, type=int)
     query = request.args.get('search', None, type=str)
-    search = "%{}%".format(query)
     if query:
         if len(query) < 3:
             flash('please provide more than 3 search characters', 'info')
-            return redirect(url_for('explore'))
+            return redirect(url_for('main.explore'))
         else:
-            posts = Post.query.filter(Post.body.like(search)).order_by(Post.timestamp.desc()).paginate(
-                page=page, 
-                per_page=app.config['POSTS_PER_PAGE'], 
-                error_out=False
-            )
+            page = request.args.get('page', 1, type=int)
+            posts = Post.search(query, page, current_app.config['POSTS_PER_PAGE'])
     else:
-        posts = Post.query.order_by(Post.timestamp.desc()).paginate(
-            page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('explore', page=posts.next_num) \
+        posts = paginate(Post.query.options(selectinload(Post.author))
+                         .order_by(Post.timestamp.desc()),
+                         (Post.timestamp, Post.id), current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.explore', search=query, **posts.next_args) \
         if posts.has_next else None
-    prev_url = url_for('explore', page=posts.prev_num) \
+    prev_url = url_for('main.explore', search=query, **posts.prev_args) \
         if posts.has_prev else None
     return render_template('index.html', title='Explore', posts=posts.items,
                            next_url=next_url, prev_url=prev_url)
 
-@app.route('/user/<username>')
+@bp.route('/user/<username>')
+@replica
 @login_required
+@conditional(user_version, html=True)
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    posts = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page, per_page=app.config['POSTS_PER_PAGE'], error_out=False)
-    next_url = url_for('user', username=user.username, page=posts.next_num) \
+    posts = paginate(user.posts.order_by(Post.timestamp.desc()),
+                     (Post.timestamp, Post.id), current_app.config['POSTS_PER_PAGE'])
+    next_url = url_for('main.user', username=user.username, **posts.next_args) \
         if posts.has_next else None
-    prev_url = url_for('user', username=user.username, page=posts.prev_num) \
+    prev_url = url_for('main.user', username=user.username, **posts.prev_args) \
         if posts.has_prev else None
     form = EmptyForm()
+    suggestions = user.suggested().all() if user == current_user else []
     return render_template('user.html', user=user, posts=posts.items,
-                           next_url=next_url, prev_url=prev_url, form=form)
-    form = EmptyForm()
-    return render_template('user.html', 
-                           title='User posts', 
-                           user=user,
-                           posts=posts,
-                           form=form)
+                           next_url=next_url, prev_url=prev_url, form=form,
+                           suggestions=suggestions)
 
-@app.route('/users')
+@bp.route('/users')
+@replica
 @login_required
 def users():
-    page = request.args.get('page', 1, type=int)
     query = request.args.get('search', None, type=str)
     search = "%{}%".format(query)
     if query:
         if len(query) < 3:
             flash('please provide more than 3 search characters', 'info')
-            return redirect(url_for('users'))
+            return redirect(url_for('main.users'))
         else:
-            users = User.query.filter(User.username.like(search)).order_by(User.id.asc()).paginate(
-                page=page, 
-                per_page=app.config['USERS_PER_PAGE'], 
-                error_out=False
-            )
+            users = User.query.filter(User.username.like(search)).order_by(User.id.asc())
     else:
-        users = User.query.order_by(User.id.asc()).paginate(
-            page=page, 
-            per_page=app.config['USERS_PER_PAGE'], 
-            error_out=False
-        )
-    next_url = url_for('users', page=users.next_num) \
+        users = User.query.order_by(User.id.asc())
+    users = paginate(users, (User.id,), current_app.config['USERS_PER_PAGE'],
+                     descending=False)
+    next_url = url_for('main.users', search=query, **users.next_args) \
         if users.has_next else None
-    prev_url = url_for('users', page=users.prev_num) \
+    prev_url = url_for('main.users', search=query, **users.prev_args) \
         if users.has_prev else None
     return render_template('users.html', title='Users', users=users.items,
                            next_url=next_url, prev_url=prev_url)
 
 
-@app.route('/login', methods=['GET','POST'])
+@bp.route('/login', methods=['GET','POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user is None or not user.check_password(form.password.data):
             flash('Invalid username or password')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         login_user(user,remember=form.remember_me.data)
+        db.session.commit() # ggf. neu gehashtes Passwort speichern
         next_page = request.args.get('next') # Rückkehr-Pfad
         if not next_page or url_parse(next_page).netloc != '':
-            next_page = url_for('index')
+            next_page = url_for('main.index')
         return redirect(next_page)
     return render_template('login.html', 
                            title="Sign In", 
                            form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/register', methods=['GET','POST'])
+@bp.route('/register', methods=['GET','POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = RegisterForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
@@ -151,10 +166,10 @@ def register():
         db.session.add(user)
         db.session.commit()
         flash('Congratulations, you are now a registered user!', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html', title='Register', form=form)
 
-@app.route('/profile/edit', methods=['GET','POST'])
+@bp.route('/profile/edit', methods=['GET','POST'])
 @login_required
 def edit_profile():
     if current_user.id != 1:
@@ -164,17 +179,17 @@ def edit_profile():
             current_user.about_me = form.about_me.data
             db.session.commit()
             flash('Your profile has been updated!', 'success')
-            return redirect(url_for('user', username=current_user.username))
+            return redirect(url_for('main.user', username=current_user.username))
         elif request.method == 'GET':
             form.username.data = current_user.username
             form.about_me.data = current_user.about_me
         return render_template('edit_profile.html', title='Edit profile', form=form)
     else:
         flash('The admin profile may not be edited!', 'info')
-        return redirect(url_for('user', username=current_user.username))
+        return redirect(url_for('main.user', username=current_user.username))
 
-@app.route('/profile/delete/', methods=['GET','POST'])
-@app.route('/profile/delete/<username>', methods=['GET','POST'])
+@bp.route('/profile/delete/', methods=['GET','POST'])
+@bp.route('/profile/delete/<username>', methods=['GET','POST'])
 @login_required
 def delete_profile(username):
     if current_user.id != 1:
@@ -186,14 +201,14 @@ def delete_profile(username):
         user = User.query.filter_by(username=form.username.data).first()
         db.session.commit()
         flash('Profile has been deleted!', 'success')
-        return redirect(url_for('user', username=current_user.username))
+        return redirect(url_for('main.user', username=current_user.username))
     elif request.method == 'GET':
         form.username.data = username
     return render_template('delete_profile.html', title='Delete profile', form=form)
  
 
    
-@app.route('/follow/<username>', methods=['POST'])
+@bp.route('/follow/<username>', methods=['POST'])
 @login_required
 def follow(username):
     form = EmptyForm()
@@ -201,19 +216,18 @@ def follow(username):
         user = User.query.filter_by(username=username).first()
         if user is None:
             flash('User {} not found.'.format(username))
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         if user == current_user:
             flash('You cannot follow yourself!')
-            return redirect(url_for('user', username=username))
-        current_user.follow(user)
-        db.session.commit()
+            return redirect(url_for('main.user', username=username))
+        writer.run(User.set_following, current_user.id, user.id)
         flash('You are now following {}!'.format(username), 'success')
-        return redirect(url_for('user', username=username))
+        return redirect(url_for('main.user', username=username))
     else:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
 
-@app.route('/unfollow/<username>', methods=['POST'])
+@bp.route('/unfollow/<username>', methods=['POST'])
 @login_required
 def unfollow(username):
     form = EmptyForm()
@@ -221,51 +235,50 @@ def unfollow(username):
         user = User.query.filter_by(username=username).first()
         if user is None:
             flash('User {} not found.'.format(username))
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         if user == current_user:
             flash('You cannot unfollow yourself!')
-            return redirect(url_for('user', username=username))
-        current_user.unfollow(user)
-        db.session.commit()
+            return redirect(url_for('main.user', username=username))
+        writer.run(User.set_following, current_user.id, user.id, False)
         flash('You are no longer following {}.'.format(username), 'info')
-        return redirect(url_for('user', username=username))
+        return redirect(url_for('main.user', username=username))
     else:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
-@app.route('/resetpassword', methods=['GET','POST'])
+@bp.route('/resetpassword', methods=['GET','POST'])
 def reset_password_request():
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = ResetPasswordRequestForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
         if user:
             send_password_reset_email(user)
         flash('Check your email for the instructuins on resetting you password.', 'info')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     return render_template('reset_password_request.html', title='Reset password', form=form)
 
-@app.route('/reset_password/<token>', methods=['GET', 'POST'])
+@bp.route('/reset_password/<token>', methods=['GET', 'POST'])
 def reset_password(token):
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     user = User.verify_reset_password_token(token)
     if not user:
         flash('Reset link expired or invalid.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
         user.set_password(form.password.data)
         db.session.commit()
         flash('Your password has been reset.')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_password.html', form=form)
 
 #################################
 # Custom testing routes
 #################################
 
-@app.route('/resetpassword', methods=['GET','POST'])
+@bp.route('/resetpassword', methods=['GET','POST'])
 @login_required
 def resetpassword():
     if current_user.id == 1:
@@ -278,7 +291,7 @@ def resetpassword():
             user.set_password(form.password.data)
             db.session.commit()
             flash('Password reset!', 'success')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         elif request.method == 'GET' and request.args.get('email', None, type=str) is not None:
             form.email.data = request.args.get('email', None, type=str)
             return render_template('reset.html', title='Reset password', form=form)
@@ -286,7 +299,7 @@ def resetpassword():
     else:
         return "Admin required", 403
 
-@app.route('/user_info', methods=['GET','POST'])
+@bp.route('/user_info', methods=['GET','POST'])
 #@login_required
 def user_info():
     if current_user.is_authenticated:
@@ -299,12 +312,12 @@ def user_info():
 
 
 
-@app.route('/query_select_demo', methods=['GET','POST'])
+@bp.route('/query_select_demo', methods=['GET','POST'])
+@login_required
 def query_select_demo():
     form = QuerySelectDemoForm()
-    form.users.query = db.session.query(User)
     if form.validate_on_submit() == True :
-        user_id = int(form.users.data.id)
+        user_id = int(form.users.data)
         return '<html><h3>Auswahl: User {}</h3></html>'.format(user_id)
     else:
         return render_template('query_select_demo.html', title='Select DB', form=form)
\ No newline at end of file
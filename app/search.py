@@ -0,0 +1,167 @@
+# app/search.py
+"""Volltextsuche für Posts.
+
+Unter SQLite wird eine FTS5-Tabelle (post_fts) verwendet, auf anderen
+Datenbanken ein eigener invertierter Index in der Tabelle search_term.
+Beide werden über die Mapper-Events in app/models.py synchron gehalten.
+"""
+import re
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, case, extract, func, or_, select, text
+from app import db
+
+search_term = db.Table(
+    'search_term',
+    db.Column('term', db.String(64), primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True,
+              index=True),
+    db.Column('weight', db.Integer, nullable=False)
+)
+
+_fts_ready = set()
+
+
+def tokenize(body):
+    return [t[:64] for t in re.findall(r'\w+', (body or '').lower())]
+
+
+def backend(connection):
+    name = current_app.config['SEARCH_BACKEND']
+    if name == 'auto':
+        return 'fts5' if connection.dialect.name == 'sqlite' else 'index'
+    return name
+
+
+def create_fts(connection):
+    connection.execute(text(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5('
+        "body, tokenize='unicode61 remove_diacritics 2')"))
+    _fts_ready.add(connection.engine.url)
+
+
+def drop_fts(connection):
+    connection.execute(text('DROP TABLE IF EXISTS post_fts'))
+    _fts_ready.discard(connection.engine.url)
+
+
+def add_to_index(connection, post_id, body):
+    add_many(connection, [(post_id, body)])
+
+
+def add_many(connection, posts):
+    """Nimmt (post_id, body)-Paare in einem executemany in den Index auf."""
+    if not posts:
+        return
+    if backend(connection) == 'fts5':
+        if connection.engine.url not in _fts_ready:
+            create_fts(connection)
+        connection.execute(text(
+            'INSERT INTO post_fts(rowid, body) VALUES (:id, :body)'),
+            [{'id': post_id, 'body': body or ''} for post_id, body in posts])
+        return
+    rows = []
+    for post_id, body in posts:
+        terms = {}
+        for term in tokenize(body):
+            terms[term] = terms.get(term, 0) + 1
+        rows.extend({'term': t, 'post_id': post_id, 'weight': w}
+                    for t, w in terms.items())
+    if rows:
+        connection.execute(search_term.insert(), rows)
+
+
+def remove_from_index(connection, post_id):
+    if backend(connection) == 'fts5':
+        if connection.engine.url not in _fts_ready:
+            create_fts(connection)
+        connection.execute(text('DELETE FROM post_fts WHERE rowid = :id'),
+                           {'id': post_id})
+    else:
+        connection.execute(search_term.delete().where(
+            search_term.c.post_id == post_id))
+
+
+def reindex(connection, batch_size=1000):
+    """Baut den Suchindex aus der post-Tabelle neu auf."""
+    if backend(connection) == 'fts5':
+        drop_fts(connection)
+        create_fts(connection)
+        connection.execute(text(
+            'INSERT INTO post_fts(rowid, body) SELECT id, body FROM post'))
+        return
+    connection.execute(search_term.delete())
+    rows = connection.execute(text('SELECT id, body FROM post')) \
+        .yield_per(batch_size)
+    for chunk in rows.partitions():
+        for row in chunk:
+            add_to_index(connection, row.id, row.body)
+
+
+def _match_expression(tokens):
+    # Jeder Begriff als String, der letzte als Präfix (Suche beim Tippen)
+    return ' '.join('"{}"'.format(t) for t in tokens[:-1]) + \
+        ' "{}"*'.format(tokens[-1])
+
+
+def query_index(expression, page, per_page):
+    """Liefert (post_ids, has_next), sortiert nach Relevanz und Aktualität."""
+    tokens = tokenize(expression)
+    if not tokens:
+        return [], False
+    connection = db.session.connection()
+    half_life = current_app.config['SEARCH_RECENCY_DAYS']
+    if backend(connection) == 'fts5':
+        if connection.engine.url not in _fts_ready:
+            create_fts(connection)
+        # bm25() ist negativ, ältere Posts werden Richtung 0 gedämpft
+        ids = connection.execute(text(
+            'SELECT post.id FROM post_fts JOIN post ON post.id = post_fts.rowid '
+            'WHERE post_fts MATCH :match ORDER BY bm25(post_fts) / '
+            "(1.0 + (julianday('now') - julianday(post.timestamp)) / :half_life), "
+            'post.id DESC LIMIT :limit OFFSET :offset'),
+            {'match': _match_expression(tokens), 'half_life': half_life,
+             'limit': per_page + 1, 'offset': (page - 1) * per_page}).scalars().all()
+    else:
+        ids = _query_term_index(connection, tokens, half_life, page, per_page)
+    return ids[:per_page], len(ids) > per_page
+
+
+def _age_days(connection, timestamp, now):
+    # Alter in Tagen; Datumsarithmetik ist je nach Datenbank anders
+    name = connection.dialect.name
+    if name == 'sqlite':
+        return func.julianday(now) - func.julianday(timestamp)
+    if name == 'mysql':
+        return func.timestampdiff(text('SECOND'), timestamp, now) / 86400.0
+    return extract('epoch', now - timestamp) / 86400.0
+
+
+def _query_term_index(connection, tokens, half_life, page, per_page):
+    # Alle Begriffe müssen vorkommen, der letzte als Präfix; Score tf-idf,
+    # gedämpft nach Alter. Gerechnet, sortiert und geschnitten wird in SQL,
+    # nur die IDs der Seite (+1) kommen zurück
+    exact, prefix = set(tokens[:-1]), tokens[-1]
+    term = search_term.c.term
+    is_prefix = term.startswith(prefix, autoescape=True)
+    term_filter = or_(term.in_(exact), is_prefix)
+    # max(id) statt count(*) als Schätzung der Dokumentanzahl für idf
+    total = connection.execute(text('SELECT max(id) FROM post')).scalar() or 1
+    df = select(term, func.count().label('df')).where(term_filter) \
+        .group_by(term).subquery('df')
+    post = db.metadata.tables['post']
+    idf = func.ln(1.0 + float(total) / df.c.df)
+    age = func.coalesce(_age_days(connection, func.max(post.c.timestamp),
+                                  datetime.utcnow()), 0)
+    score = func.sum(search_term.c.weight * idf) / (1.0 + age / half_life)
+    found = [func.max(case((term == t, 1), else_=0)) == 1 for t in exact]
+    found.append(func.max(case((is_prefix, 1), else_=0)) == 1)
+    return connection.execute(
+        select(search_term.c.post_id)
+        .join(df, df.c.term == term)
+        .join(post, post.c.id == search_term.c.post_id)
+        .where(term_filter)
+        .group_by(search_term.c.post_id)
+        .having(and_(*found))
+        .order_by(score.desc(), search_term.c.post_id.desc())
+        .limit(per_page + 1).offset((page - 1) * per_page)).scalars().all()
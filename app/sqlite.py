@@ -0,0 +1,164 @@
+# app/sqlite.py
+"""SQLite-Produktionsmodus.
+
+Mit SQLITE_PRODUCTION bekommt jede neue SQLite-Verbindung WAL-Journal,
+synchronous=NORMAL, mmap, einen größeren Page-Cache und busy_timeout, damit
+mehrere gunicorn-Worker nicht sofort an "database is locked" scheitern.
+
+Mit SQLITE_WRITE_QUEUE laufen kleine Schreibvorgänge (Posts, Follows,
+last_seen) über einen einzigen Writer-Thread pro Prozess, der bis zu
+SQLITE_WRITE_BATCH Aufträge in einem Commit zusammenfasst. Aufträge sind
+Funktionen, die mit ``db.session`` arbeiten und nur IDs als Argumente
+bekommen (die Session des Writers ist nicht die des Requests). Wartet ein
+Request länger als SQLITE_WRITE_TIMEOUT, wird WriteTimeout geworfen (in
+app/errors.py 503); lief der Auftrag da schon, kann er noch committen.
+"""
+import atexit
+import sqlite3
+from concurrent.futures import Future, TimeoutError
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from flask import current_app
+from sqlalchemy.engine import Engine
+from app import db, replicas
+
+# Konfiguration für den connect-Listener, gesetzt von init_app: Verbindungen
+# entstehen auch außerhalb eines App-Kontexts
+_config = None
+
+
+def init_app(app):
+    global _config
+    _config = app.config
+
+
+@db.event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    config = _config
+    if config is None or not isinstance(dbapi_connection, sqlite3.Connection) or \
+            not config['SQLITE_PRODUCTION']:
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout={:d}'.format(config['SQLITE_BUSY_TIMEOUT']))
+    cursor.execute('PRAGMA cache_size={:d}'.format(config['SQLITE_CACHE_SIZE']))
+    cursor.execute('PRAGMA mmap_size={:d}'.format(config['SQLITE_MMAP_SIZE']))
+    cursor.close()
+
+
+class WriteTimeout(Exception):
+    """Der Writer hat nicht rechtzeitig geantwortet.
+
+    ``applied`` ist None, wenn der Auftrag schon lief und noch committen kann,
+    sonst False (er wurde aus der Queue genommen).
+    """
+
+    def __init__(self, applied):
+        super().__init__('write may still apply' if applied is None else 'write not applied')
+        self.applied = applied
+
+
+class WriteQueue(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._queue = Queue()
+        self._thread = None
+        self._app = None
+        self.commits = 0
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._start()
+        self._queue.put((future, fn, args))
+        return future
+
+    def run(self, fn, *args):
+        """Führt fn(*args) aus und committet; über die Queue, falls aktiv."""
+        if not current_app.config['SQLITE_WRITE_QUEUE']:
+            result = fn(*args)
+            db.session.commit()
+            return result
+        # offene Schreibsperren der Request-Session freigeben, sonst wartet
+        # der Writer auf uns und wir auf ihn
+        db.session.commit()
+        future = self.submit(fn, *args)
+        try:
+            result = future.result(current_app.config['SQLITE_WRITE_TIMEOUT'])
+        except TimeoutError:
+            raise WriteTimeout(False if future.cancel() else None) from None
+        db.session.expire_all()
+        replicas.mark_written(db.session)
+        return result
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._app = current_app._get_current_object()
+                self._thread = Thread(target=self._run, name='sqlite-writer',
+                                      daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        app = self._app
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            # kurz auf weitere Aufträge warten, die in denselben Commit passen
+            deadline = monotonic() + app.config['SQLITE_WRITE_WAIT_MS'] / 1000.0
+            while len(batch) < app.config['SQLITE_WRITE_BATCH']:
+                try:
+                    job = self._queue.get(timeout=max(0, deadline - monotonic()))
+                except Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)
+                    break
+                batch.append(job)
+            with app.app_context():
+                try:
+                    self._commit(batch)
+                finally:
+                    db.session.remove()
+
+    def _commit(self, batch):
+        batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+        results = []
+        try:
+            for future, fn, args in batch:
+                results.append(fn(*args))
+                db.session.flush()
+            db.session.commit()
+            self.commits += 1
+        except Exception:
+            db.session.rollback()
+        else:
+            for (future, fn, args), result in zip(batch, results):
+                future.set_result(result)
+            return
+        # Ein fehlerhafter Auftrag soll die anderen nicht mitreißen
+        for future, fn, args in batch:
+            try:
+                result = fn(*args)
+                db.session.commit()
+                self.commits += 1
+            except Exception as e:
+                db.session.rollback()
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+writer = WriteQueue()
+atexit.register(writer.stop)
@@ -0,0 +1,228 @@
+# app/stream.py
+"""Live-Timeline per Server-Sent Events (/api/stream/timeline).
+
+Den Stream bedient der ASGI-Server (app/asgi.py, ``uvicorn asgi:application``)
+mit einer Coroutine pro Client; ein offener Tab belegt also keinen Thread
+und keinen Worker. Die WSGI-App antwortet auf den Pfad mit 404, der
+Reverse-Proxy leitet ihn wie die lesenden API-Pfade an den ASGI-Server.
+Die Home-Timeline öffnet den Stream nur mit SSE_ENABLED.
+
+Post.publish und der Massenimport merken neue Posts in der Session vor
+(record); nach dem Commit gehen sie als Ereignis an den Broker. Der verteilt
+sie an die Abos, deren User dem Autor folgt oder der Autor selbst ist.
+
+SSE_BROKER wählt, woher die Ereignisse kommen:
+
+- 'database': ein Thread pro Prozess fragt alle SSE_POLL_INTERVAL Sekunden
+  die Posts mit höherer ID ab, egal welcher Worker sie geschrieben hat. Er
+  steht für einen gemeinsamen Broker (Redis o.ä.); die Commits dieses
+  Prozesses werden dann nicht zusätzlich verteilt. Nötig, sobald die Posts
+  in den WSGI-Workern entstehen und der Stream im ASGI-Prozess läuft.
+- 'memory': direkt aus den Commits dieses Prozesses (ein Prozess für alles,
+  z.B. in den Tests).
+
+Ein Abo ist eine begrenzte deque mit einem asyncio.Event der Event-Loop des
+Streams; der Broker weckt sie aus seinem Thread mit call_soon_threadsafe.
+Der Stream wartet darauf mit SSE_HEARTBEAT Sekunden Timeout und hält dabei
+keine Datenbankverbindung. Mehr als SSE_MAX_STREAMS offene Streams pro
+Prozess werden mit 503 abgewiesen, nach SSE_MAX_AGE Sekunden endet ein
+Stream und der Client verbindet neu (dabei wird auch die Liste der Gefolgten
+neu geladen).
+
+Die Event-ID ist die Post-ID. Mit Last-Event-ID liefert der Stream zuerst die
+verpassten Posts aus der Timeline, höchstens die neuesten SSE_REPLAY_LIMIT.
+Läuft die Queue eines Abos über (Client liest zu langsam), endet der Stream;
+der Client holt den Rest beim Neuverbinden über Last-Event-ID.
+"""
+import asyncio
+import atexit
+import json
+from collections import defaultdict, deque
+from threading import Event, Lock, Thread
+from time import monotonic
+from flask import current_app
+from sqlalchemy import func, select
+from app import db
+
+
+class Subscription(object):
+
+    def __init__(self, user_id, authors, maxlen, loop):
+        self.user_id = user_id
+        self.authors = frozenset(authors)
+        self.maxlen = maxlen
+        self.overflow = False
+        self._events = deque()
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def put(self, event):
+        """Aus beliebigem Thread; weckt den Stream in seiner Event-Loop."""
+        if len(self._events) >= self.maxlen:
+            self.overflow = True
+        else:
+            self._events.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # Event-Loop schon beendet, der Stream ist zu
+            pass
+
+    async def get(self, timeout):
+        """Wartet höchstens timeout Sekunden; liefert die angefallenen Ereignisse."""
+        if not self._events:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        # erst zurücksetzen, dann leeren: ein put dazwischen weckt erneut
+        self._ready.clear()
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        return events
+
+
+class Broker(object):
+
+    def __init__(self, mode='memory'):
+        self.mode = mode
+        self.published = 0
+        self._lock = Lock()
+        # Autor-ID -> Abos
+        self._subscribers = defaultdict(set)
+        self._streams = 0
+        self._thread = None
+        self._stop = Event()
+        self._app = None
+
+    def init_app(self, app):
+        self.mode = app.config['SSE_BROKER']
+
+    @property
+    def streams(self):
+        return self._streams
+
+    def subscribe(self, user_id, authors, loop):
+        """Neues Abo für die Posts von authors, geweckt in loop; None, wenn
+        SSE_MAX_STREAMS erreicht ist."""
+        config = current_app.config
+        if self.mode == 'database':
+            self._start()
+        subscription = Subscription(user_id, authors, config['SSE_QUEUE_SIZE'], loop)
+        with self._lock:
+            if self._streams >= config['SSE_MAX_STREAMS']:
+                return None
+            self._streams += 1
+            for author in subscription.authors:
+                self._subscribers[author].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._streams -= 1
+            for author in subscription.authors:
+                subscribers = self._subscribers.get(author)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[author]
+
+    def publish(self, events):
+        """Verteilt Ereignisse (dicts mit id, user_id, timestamp, body)."""
+        for event in events:
+            with self._lock:
+                subscribers = list(self._subscribers.get(event['user_id'], ()))
+            for subscription in subscribers:
+                subscription.put(event)
+            self.published += 1
+
+    def committed(self, events):
+        if self.mode == 'memory':
+            self.publish(events)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._app = current_app._get_current_object()
+                # Startpunkt vor dem ersten Abo, sonst fehlen Posts bis zur
+                # ersten Abfrage
+                post = db.metadata.tables['post']
+                last_id = db.session.scalar(select(func.max(post.c.id))) or 0
+                self._thread = Thread(target=self._run, args=(last_id,),
+                                      name='sse-poller', daemon=True)
+                self._thread.start()
+
+    def _run(self, last_id):
+        app = self._app
+        post = db.metadata.tables['post']
+        while not self._stop.wait(app.config['SSE_POLL_INTERVAL']):
+            with app.app_context():
+                try:
+                    rows = db.session.execute(
+                        select(post.c.id, post.c.user_id, post.c.timestamp, post.c.body)
+                        .where(post.c.id > last_id).order_by(post.c.id)).all()
+                except Exception:
+                    app.logger.exception('sse poller failed')
+                    continue
+                finally:
+                    db.session.remove()
+            if rows:
+                last_id = rows[-1].id
+                self.publish([row._asdict() for row in rows])
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+broker = Broker()
+atexit.register(broker.stop)
+
+
+def record(session, id, user_id, timestamp, body):
+    """Merkt einen neuen Post vor, verteilt beim Commit der Session."""
+    session.info.setdefault('new_posts', []).append(
+        {'id': id, 'user_id': user_id, 'timestamp': timestamp, 'body': body})
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def publish_new_posts(session):
+    events = session.info.pop('new_posts', None)
+    if events:
+        broker.committed(events)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_new_posts(session):
+    session.info.pop('new_posts', None)
+
+
+def format_event(event, to_dict):
+    return 'id: {}\nevent: post\ndata: {}\n\n'.format(
+        event['id'], json.dumps(to_dict(event), separators=(',', ':')))
+
+
+async def events(subscription, backlog, to_dict, config):
+    """SSE-Text: erst backlog, dann live bis SSE_MAX_AGE oder Überlauf.
+
+    Das Abo beendet der Aufrufer, auch wenn der Client vorher geht.
+    """
+    yield 'retry: {:d}\n\n'.format(config['SSE_RETRY_MS'])
+    last_id = 0
+    for event in backlog:
+        last_id = event['id']
+        yield format_event(event, to_dict)
+    deadline = monotonic() + config['SSE_MAX_AGE']
+    while not subscription.overflow and monotonic() < deadline:
+        # vor dem Backlog abonniert: Doppelte überspringen
+        chunk = ''.join(format_event(event, to_dict)
+                        for event in await subscription.get(config['SSE_HEARTBEAT'])
+                        if event['id'] > last_id)
+        # Kommentarzeile als Heartbeat, damit tote Verbindungen auffallen
+        yield chunk or ': keepalive\n\n'
@@ -0,0 +1,184 @@
+# app/suggest.py
+"""Präfix-Index über Usernamen für die User-Suche beim Tippen.
+
+Der Index lebt im Prozess als sortiertes Array (Schlüssel, user_id) und wird
+nach jedem Commit mit den geänderten Usern nachgeführt. E-Mail-Adressen sind
+nicht suchbar (sonst ließe sich prüfen, ob eine Adresse registriert ist); sie
+liegen nur für den Avatar im Index.
+
+Änderungen aus anderen Worker-Prozessen werden spätestens nach
+SUGGEST_INDEX_TTL Sekunden sichtbar: dann lädt ein Hintergrund-Thread den
+Index neu, die Requests suchen so lange im alten. Nur das erste Laden
+passiert im Request, einmal pro Prozess.
+"""
+from array import array
+from bisect import bisect_left
+from threading import Lock, Thread
+from time import monotonic
+from flask import current_app
+from sqlalchemy import inspect, select
+from app import db
+from app.models import User
+
+
+class PrefixIndex(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._keys = []
+        self._ids = array('I')
+        self._entries = {}
+        # Änderungen während reload, werden danach erneut angewendet
+        self._pending = None
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, rows):
+        entries = {id: (username, email) for id, username, email in rows}
+        pairs = sorted((key, id) for id, fields in entries.items()
+                       for key in self._index_keys(fields))
+        with self._lock:
+            self._entries = entries
+            self._keys = [key for key, id in pairs]
+            self._ids = array('I', [id for key, id in pairs])
+            self.loaded_at = monotonic()
+
+    def reload(self, fetch):
+        """Lädt aus fetch() neu; Commits während der Abfrage gehen nicht verloren."""
+        with self._lock:
+            self._pending = {}
+        try:
+            rows = fetch()
+        finally:
+            with self._lock:
+                pending, self._pending = self._pending, None
+        self.load(rows)
+        for id, fields in pending.items():
+            if fields is None:
+                self.remove(id)
+            else:
+                self.add(id, *fields)
+
+    @staticmethod
+    def _index_keys(fields):
+        username, email = fields
+        return {username.lower()} if username else set()
+
+    def add(self, id, username, email):
+        with self._lock:
+            if self._pending is not None:
+                self._pending[id] = (username, email)
+            self._remove(id)
+            self._entries[id] = (username, email)
+            for key in self._index_keys((username, email)):
+                pos = bisect_left(self._keys, key)
+                while pos < len(self._keys) and self._keys[pos] == key \
+                        and self._ids[pos] < id:
+                    pos += 1
+                self._keys.insert(pos, key)
+                self._ids.insert(pos, id)
+
+    def remove(self, id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending[id] = None
+            self._remove(id)
+
+    def _remove(self, id):
+        fields = self._entries.pop(id, None)
+        if fields is None:
+            return
+        for key in self._index_keys(fields):
+            pos = bisect_left(self._keys, key)
+            while pos < len(self._keys) and self._keys[pos] == key:
+                if self._ids[pos] == id:
+                    del self._keys[pos]
+                    del self._ids[pos]
+                    break
+                pos += 1
+
+    def search(self, prefix, limit):
+        """Liefert [(id, username, email)] für Schlüssel, die mit prefix beginnen."""
+        prefix = prefix.lower()
+        results, seen = [], set()
+        with self._lock:
+            pos = bisect_left(self._keys, prefix)
+            while pos < len(self._keys) and len(results) < limit \
+                    and self._keys[pos].startswith(prefix):
+                id = self._ids[pos]
+                if id not in seen:
+                    seen.add(id)
+                    results.append((id,) + self._entries[id])
+                pos += 1
+        return results
+
+
+index = PrefixIndex()
+# gehalten, solange der Index (neu) geladen wird
+_loading = Lock()
+
+
+def _rows():
+    return db.session.execute(select(User.id, User.username, User.email)).all()
+
+
+def _refresh(app):
+    try:
+        with app.app_context():
+            try:
+                index.reload(_rows)
+            finally:
+                db.session.remove()
+    except Exception:
+        app.logger.exception('suggest index refresh failed')
+    finally:
+        _loading.release()
+
+
+def suggest(prefix, limit):
+    if index.loaded_at is None:
+        with _loading:
+            if index.loaded_at is None:
+                index.load(_rows())
+    elif monotonic() - index.loaded_at > current_app.config['SUGGEST_INDEX_TTL'] \
+            and _loading.acquire(blocking=False):
+        Thread(target=_refresh, args=(current_app._get_current_object(),),
+               name='suggest-refresh', daemon=True).start()
+    return index.search(prefix, limit)
+
+
+# Geänderte User nach dem Flush merken und erst nach dem Commit übernehmen
+@db.event.listens_for(db.session, 'after_flush')
+def collect_user_changes(session, flush_context):
+    changes = session.info.setdefault('suggest', {})
+    for user in session.new:
+        if isinstance(user, User):
+            changes[user.id] = (user.username, user.email)
+    for user in session.dirty:
+        if isinstance(user, User):
+            attrs = inspect(user).attrs
+            if attrs.username.history.has_changes() or \
+                    attrs.email.history.has_changes():
+                changes[user.id] = (user.username, user.email)
+    for user in session.deleted:
+        if isinstance(user, User):
+            changes[user.id] = None
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def apply_user_changes(session):
+    changes = session.info.pop('suggest', None)
+    if not changes or index.loaded_at is None:
+        return
+    for id, fields in changes.items():
+        if fields is None:
+            index.remove(id)
+        else:
+            index.add(id, *fields)
+
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def discard_user_changes(session, previous_transaction):
+    session.info.pop('suggest', None)
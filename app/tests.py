@@ -1,11 +1,39 @@
 #!/usr/bin/env python
+import asyncio
+import importlib.util
 import os
-os.environ['DATABASE_URL'] = 'sqlite://'
-
 from datetime import datetime, timedelta
+import gzip
+import json
+import socketserver
+import tempfile
+import threading
 import unittest
-from app import app, db
-from app.models import User, Post
+import time
+from flask import render_template, url_for
+from sqlalchemy import create_engine, func, select
+from app import bulk, create_app, db, fragments, graph, recommend, replicas, stream, suggest, tokens
+from app.activity import LastSeenTracker
+from app.email import OutgoingMail, outbox, send_email
+from app.export import ndjson, parse_timestamp
+from app.metrics import collect, registry
+from app.sqlite import writer
+from app.passwords import HashingOverloaded, PasswordHasher, hasher, needs_rehash
+from werkzeug.security import generate_password_hash
+from app.models import User, Post, Timeline, followers
+from app.pagination import KeysetPagination, InvalidCursor, decode_cursor, encode_cursor
+from benchmarks.harness import percentile
+from benchmarks.seed import seed
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+
+app = create_app(TestConfig)
 
 
 class UserModelCase(unittest.TestCase):
@@ -26,6 +54,54 @@ class UserModelCase(unittest.TestCase):
         self.assertFalse(u.check_password('dog'))
         self.assertTrue(u.check_password('cat'))
 
+    def test_password_rehash(self):
+        u = User(username='susan')
+        u.password_hash = generate_password_hash('cat', 'pbkdf2:sha256:1000')
+        self.assertTrue(needs_rehash(u.password_hash))
+        self.assertFalse(u.check_password('dog'))
+        self.assertEqual(u.password_hash.split('$')[0], 'pbkdf2:sha256:1000')
+        self.assertTrue(u.check_password('cat'))
+        self.assertFalse(needs_rehash(u.password_hash))
+        self.assertTrue(u.check_password('cat'))
+
+    def test_password_rehash_default_iterations(self):
+        method = app.config['PASSWORD_HASH_METHOD']
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+        try:
+            u = User(username='susan')
+            u.set_password('cat')
+            self.assertFalse(needs_rehash(u.password_hash))
+            pwhash = u.password_hash
+            self.assertTrue(u.check_password('cat'))
+            self.assertEqual(u.password_hash, pwhash)
+            self.assertTrue(needs_rehash(generate_password_hash('cat', 'pbkdf2:sha512', 16)))
+        finally:
+            app.config['PASSWORD_HASH_METHOD'] = method
+
+    def test_password_hashing_sheds_load(self):
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        queue = app.config['PASSWORD_HASH_MAX_QUEUE']
+        timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+        app.config['PASSWORD_HASH_MAX_QUEUE'] = 0
+        pool = PasswordHasher()
+        try:
+            self.assertTrue(pool.check(pool.hash('cat'), 'cat'))
+            # the only slot is taken: the next request is rejected at once
+            pool._slots.acquire()
+            with self.assertRaises(HashingOverloaded):
+                pool.hash('cat')
+            pool._slots.release()
+            # a job that takes too long ends like an overload, not with a 500
+            app.config['PASSWORD_HASH_TIMEOUT'] = 0
+            with self.assertRaises(HashingOverloaded):
+                pool.hash('cat')
+        finally:
+            app.config['PASSWORD_HASH_TIMEOUT'] = timeout
+            pool.shutdown()
+            app.config['PASSWORD_HASH_WORKERS'] = workers
+            app.config['PASSWORD_HASH_MAX_QUEUE'] = queue
+
     def test_avatar(self):
         u = User(username='john', email='john@example.com')
         self.assertEqual(u.avatar(128), ('https://www.gravatar.com/avatar/'
@@ -55,6 +131,54 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(u1.followed.count(), 0)
         self.assertEqual(u2.followers.count(), 0)
 
+    def test_counters(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.add_all([Post(body='one', author=u1), Post(body='two', author=u1)])
+        db.session.commit()
+        self.assertEqual(u1.post_count, 2)
+        self.assertEqual(u2.post_count, 0)
+
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual((u1.followed_count, u1.follower_count), (1, 0))
+        self.assertEqual((u2.followed_count, u2.follower_count), (0, 1))
+
+        db.session.delete(u1.posts.first())
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.post_count, 1)
+        self.assertEqual(u1.followed_count, 0)
+        self.assertEqual(u2.follower_count, 0)
+
+        u1.follow(u2)
+        u1.post_count = 42
+        u2.follower_count = 0
+        db.session.commit()
+        User.repair_counters()
+        db.session.commit()
+        self.assertEqual(u1.to_dict()['post_count'], 1)
+        self.assertEqual(u2.to_dict()['follower_count'], 1)
+
+    def test_last_seen_write_behind(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        tracker = LastSeenTracker()
+        now = datetime.utcnow() + timedelta(hours=1)
+        self.assertTrue(tracker.touch(u1, now))
+        # within the granularity nothing new is queued
+        self.assertFalse(tracker.touch(u1, now + timedelta(seconds=1)))
+        self.assertTrue(tracker.touch(u2, now))
+        self.assertEqual(len(tracker), 2)
+        self.assertEqual(tracker.flush(), 2)
+        db.session.expire_all()
+        self.assertEqual(u1.last_seen, now)
+        self.assertEqual(u2.last_seen, now)
+        self.assertEqual(tracker.flush(), 0)
+
     def test_follow_posts(self):
         # create four users
         u1 = User(username='john', email='john@example.com')
@@ -93,6 +217,1792 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def test_timeline_fan_out(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u2)
+        u3.follow(u2)
+        db.session.commit()
+
+        now = datetime.utcnow()
+        p1 = Post(body="post from susan", author=u2,
+                  timestamp=now + timedelta(seconds=1))
+        p2 = Post(body="post from john", author=u1,
+                  timestamp=now + timedelta(seconds=2))
+        db.session.add_all([p1, p2])
+        Timeline.fan_out(p1)
+        Timeline.fan_out(p2)
+        db.session.commit()
+        self.assertEqual(u1.timeline().all(), [p2, p1])
+        self.assertEqual(u2.timeline().all(), [p1])
+        self.assertEqual(u3.timeline().all(), [p1])
+
+        # unfollow purges, follow backfills
+        u3.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u3.timeline().all(), [])
+        u3.follow(u1)
+        db.session.commit()
+        self.assertEqual(u3.timeline().all(), [p2])
+
+        # bearbeitete Posts (update_post) rücken in allen Timelines nach oben
+        p1.timestamp = now + timedelta(seconds=3)
+        Timeline.retime(p1)
+        db.session.commit()
+        self.assertEqual(u1.timeline().all(), [p1, p2])
+        self.assertEqual(Timeline.query.filter_by(post_id=p1.id, user_id=u1.id)
+                         .first().timestamp, p1.timestamp)
+
+    def test_timeline_celebrity_read_merge(self):
+        threshold = app.config['TIMELINE_FANOUT_THRESHOLD']
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 1
+        try:
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            u3 = User(username='mary', email='mary@example.com')
+            db.session.add_all([u1, u2, u3])
+            u1.follow(u3)
+            u2.follow(u3)
+            db.session.commit()
+
+            p = Post(body="post from mary", author=u3)
+            db.session.add(p)
+            Timeline.fan_out(p)
+            db.session.commit()
+            # mary has two followers and is not fanned out on write
+            self.assertEqual(Timeline.query.filter_by(post_id=p.id).count(), 1)
+            self.assertEqual(u1.timeline().all(), [p])
+            self.assertEqual(u2.timeline().all(), [p])
+            self.assertEqual(u3.timeline().all(), [p])
+        finally:
+            app.config['TIMELINE_FANOUT_THRESHOLD'] = threshold
+            app.config['TIMELINE_BACKFILL_BLOCK_SIZE'] = TestConfig.TIMELINE_BACKFILL_BLOCK_SIZE
+
+    def test_timeline_celebrity_threshold_crossing(self):
+        threshold = app.config['TIMELINE_FANOUT_THRESHOLD']
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 2
+        try:
+            users = [User(username='user{}'.format(i), email='{}@example.com'.format(i))
+                     for i in range(5)]
+            db.session.add_all(users)
+            db.session.commit()
+            author = users[0]
+            early = Post(body='before', author=author)
+            db.session.add(early)
+            Timeline.fan_out(early)
+            users[1].follow(author)
+            users[2].follow(author)
+            db.session.commit()
+            self.assertFalse(author.celebrity)
+            self.assertEqual(users[1].timeline().all(), [early])
+
+            # drei Follower: ab jetzt gemischt, die Einträge verschwinden
+            users[3].follow(author)
+            db.session.commit()
+            self.assertTrue(author.celebrity)
+            self.assertEqual(Timeline.query.filter_by(author_id=author.id).count(), 1)
+            late = Post(body='after', author=author,
+                        timestamp=datetime.utcnow() + timedelta(seconds=1))
+            db.session.add(late)
+            Timeline.fan_out(late)
+            db.session.commit()
+            for user in users[1:4]:
+                self.assertEqual(user.timeline().all(), [late, early])
+
+            # Hysterese: bei zwei Followern bleibt das Flag
+            users[3].unfollow(author)
+            db.session.commit()
+            self.assertTrue(author.celebrity)
+            self.assertEqual(users[2].timeline().all(), [late, early])
+
+            # unter der Hälfte: ab jetzt verteilt, ältere Posts bis zum
+            # Batch-Job weiter gemischt
+            users[2].unfollow(author)
+            db.session.commit()
+            self.assertFalse(author.celebrity)
+            self.assertTrue(author.timeline_backfill)
+            # nur die Einträge in der eigenen Timeline
+            self.assertEqual(Timeline.query.filter_by(author_id=author.id).count(), 2)
+            newer = Post(body='newer', author=author,
+                         timestamp=datetime.utcnow() + timedelta(seconds=2))
+            db.session.add(newer)
+            Timeline.fan_out(newer)
+            db.session.commit()
+            self.assertEqual(users[1].timeline().all(), [newer, late, early])
+            self.assertEqual(users[2].timeline().all(), [])
+            self.assertEqual(users[3].timeline().all(), [])
+            users[4].follow(author)
+            db.session.commit()
+            self.assertEqual(users[4].timeline().all(), [newer, late, early])
+
+            app.config['TIMELINE_BACKFILL_BLOCK_SIZE'] = 1
+            result = app.test_cli_runner().invoke(args=['timeline', 'backfill'])
+            self.assertIn('1 author(s)', result.output)
+            db.session.expire_all()
+            self.assertFalse(author.celebrity or author.timeline_backfill)
+            for user in (users[1], users[4]):
+                self.assertEqual(
+                    db.session.scalars(select(Timeline.post_id)
+                                       .where(Timeline.user_id == user.id)
+                                       .order_by(Timeline.post_id)).all(),
+                    [early.id, late.id, newer.id])
+                self.assertEqual(user.timeline().all(), [newer, late, early])
+        finally:
+            app.config['TIMELINE_FANOUT_THRESHOLD'] = threshold
+
+    def test_timeline_pages_with_celebrity(self):
+        reader = User(username='reader', email='reader@example.com')
+        friend = User(username='friend', email='friend@example.com')
+        star = User(username='star', email='star@example.com')
+        db.session.add_all([reader, friend, star])
+        reader.follow(friend)
+        reader.follow(star)
+        # follow stuft nach der Followerzahl ein, hier von Hand
+        star.celebrity = True
+        db.session.commit()
+        now = datetime.utcnow()
+        # gleiche Zeitstempel über beide Teile hinweg
+        for i in range(7):
+            for author in (reader, friend, star):
+                post = Post(body='{} {}'.format(author.username, i), author=author,
+                            timestamp=now + timedelta(minutes=i // 2))
+                db.session.add(post)
+                Timeline.fan_out(post)
+        db.session.commit()
+        expected = reader.timeline().all()
+        self.assertEqual(len(expected), 21)
+        query = lambda bound: Timeline.posts_for(reader, bound)
+        pages = [KeysetPagination(query, None, 4)]
+        while pages[-1].has_next:
+            pages.append(KeysetPagination(query, None, 4, pages[-1].next_cursor))
+        self.assertEqual([p for page in pages for p in page.items], expected)
+        back = KeysetPagination(query, None, 4, pages[-1].prev_cursor)
+        self.assertEqual(back.items, pages[-2].items)
+
+
+class PaginationCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_keyset_walk(self):
+        u = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        # two posts per timestamp, the id breaks the tie
+        posts = [Post(body='post {}'.format(i), author=u,
+                      timestamp=now + timedelta(seconds=i // 2))
+                 for i in range(7)]
+        db.session.add_all(posts)
+        db.session.commit()
+        expected = sorted(posts, key=lambda p: (p.timestamp, p.id), reverse=True)
+        keys = (Post.timestamp, Post.id)
+
+        seen = []
+        page = KeysetPagination(Post.query, keys, 3)
+        self.assertFalse(page.has_prev)
+        pages = [page]
+        while True:
+            seen.extend(page.items)
+            if not page.has_next:
+                break
+            page = KeysetPagination(Post.query, keys, 3, page.next_cursor)
+            pages.append(page)
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(p.items) for p in pages], [3, 3, 1])
+
+        back = KeysetPagination(Post.query, keys, 3, pages[-1].prev_cursor)
+        self.assertEqual(back.items, pages[1].items)
+        self.assertTrue(back.has_prev)
+        back = KeysetPagination(Post.query, keys, 3, back.prev_cursor)
+        self.assertEqual(back.items, pages[0].items)
+        self.assertFalse(back.has_prev)
+
+    def test_keyset_ascending_and_invalid_cursor(self):
+        db.session.add_all([User(username='u{}'.format(i),
+                                 email='u{}@example.com'.format(i))
+                            for i in range(5)])
+        db.session.commit()
+        page = KeysetPagination(User.query, (User.id,), 2, descending=False)
+        page = KeysetPagination(User.query, (User.id,), 2, page.next_cursor,
+                                descending=False)
+        self.assertEqual([u.username for u in page.items], ['u2', 'u3'])
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not-a-cursor', (User.id,))
+
+    def test_cursor_types(self):
+        keys = (Post.timestamp, Post.id)
+        now = datetime.utcnow()
+        self.assertEqual(decode_cursor(encode_cursor('n', [now, 3]), keys), ('n', [now, 3]))
+        for values in ([now, [1, 2]], [now, 'abc'], [now, True], [now, 1.5],
+                       [[1], 3], [17, 3], [now.isoformat(), {}]):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(encode_cursor('n', values), keys)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('WyJuIixbMSwyXV0', (User.id,))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor('n', ['abc']), (User.id,))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor('n', [{}]), (User.username,))
+
+
+class SearchCase(unittest.TestCase):
+    backend = 'fts5'
+
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.saved_backend = app.config['SEARCH_BACKEND']
+        app.config['SEARCH_BACKEND'] = self.backend
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        app.config['SEARCH_BACKEND'] = self.saved_backend
+
+    def test_search_sync_and_ranking(self):
+        u = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        old = Post(body='flask tips', author=u, timestamp=now - timedelta(days=365))
+        new = Post(body='more flask tips', author=u, timestamp=now)
+        other = Post(body='nothing to see', author=u, timestamp=now)
+        db.session.add_all([old, new, other])
+        db.session.commit()
+        self.assertEqual(Post.search('flask tips', 1, 10).items, [new, old])
+        # prefix match on the last term
+        self.assertEqual(Post.search('fla', 1, 10).items, [new, old])
+
+        other.body = 'flask is here'
+        db.session.commit()
+        self.assertEqual(Post.search('here', 1, 10).items, [other])
+        self.assertEqual(Post.search('nothing', 1, 10).items, [])
+
+        db.session.delete(new)
+        db.session.commit()
+        self.assertEqual(Post.search('tips', 1, 10).items, [old])
+
+        page = Post.search('flask', 1, 1)
+        self.assertTrue(page.has_next)
+        self.assertEqual(len(Post.search('flask', 2, 1).items), 1)
+
+
+class IndexSearchCase(SearchCase):
+    backend = 'index'
+
+    def test_ranking_in_sql(self):
+        u = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        # mehrfacher Begriff zählt mehr (tf), ältere weniger, bei Gleichstand
+        # die höhere ID zuerst; "only" und "filler" fehlt der Präfix t
+        posts = [Post(body='flask tips', author=u, timestamp=now),
+                 Post(body='flask flask tips', author=u, timestamp=now),
+                 Post(body='flask rare tips', author=u, timestamp=now),
+                 Post(body='flask rare tips', author=u, timestamp=now - timedelta(days=60)),
+                 Post(body='flask only', author=u, timestamp=now)]
+        posts += [Post(body='filler flask {}'.format(i), author=u, timestamp=now)
+                  for i in range(5)]
+        db.session.add_all(posts)
+        db.session.commit()
+        fetched = []
+
+        @db.event.listens_for(db.engine, 'after_cursor_execute')
+        def count_rows(conn, cursor, statement, parameters, context, executemany):
+            if 'search_term' in statement and 'GROUP BY search_term.post_id' in statement:
+                fetched.append(statement)
+        try:
+            pages = [Post.search('flask t', page, 2) for page in (1, 2, 3)]
+        finally:
+            db.event.remove(db.engine, 'after_cursor_execute', count_rows)
+        self.assertEqual([p.body for page in pages for p in page.items],
+                         ['flask flask tips', 'flask rare tips', 'flask tips',
+                          'flask rare tips'])
+        self.assertEqual(pages[1].items[1], posts[3])
+        self.assertEqual([page.has_next for page in pages], [True, False, False])
+        # eine Query pro Seite, mit LIMIT statt aller Treffer
+        self.assertEqual(len(fetched), 3)
+        self.assertTrue(all('LIMIT' in statement for statement in fetched))
+
+
+class BenchmarkSeedCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_seed(self):
+        summary = seed(users=50, posts=300, follows=5)
+        self.assertEqual(User.query.count(), 50)
+        self.assertEqual(Post.query.count(), 300)
+        # Zähler und Timelines sind konsistent mit den Bulk-Inserts
+        u = max(User.query.all(), key=lambda u: u.follower_count)
+        self.assertEqual(u.follower_count, u.followers.count())
+        self.assertGreater(u.follower_count, summary['follows'] / 50)
+        reader = u.followers.first()
+        self.assertEqual(reader.timeline().count(), reader.followed_posts().count())
+        self.assertTrue(Post.search('flask', 1, 10).items)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+class ReplicaCase(unittest.TestCase):
+    # Zwei SQLite-Dateien als Primärdatenbank und Replica
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.dir = tempfile.mkdtemp()
+        self.primary = db.engines[None]
+        self.engines = [create_engine('sqlite:///' + os.path.join(self.dir, name))
+                        for name in ('primary.db', 'replica.db')]
+        db.engines[None], db.engines['replica0'] = self.engines
+        app.config['REPLICA_BIND_KEYS'] = ['replica0']
+        for engine in self.engines:
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(User.__table__.insert(), [
+                    {'id': 1, 'username': 'john', 'email': 'john@example.com',
+                     'token': 'replica-token', 'token_expiration':
+                     datetime.utcnow() + timedelta(hours=1)}])
+        with self.engines[1].begin() as connection:
+            connection.execute(User.__table__.insert(), [
+                {'id': 100, 'username': 'replicated', 'email': 'r@example.com'}])
+        tokens.cache.clear()
+        replicas.pins.clear()
+        self.client = app.test_client()
+        self.headers = {'Authorization': 'Bearer replica-token'}
+
+    def tearDown(self):
+        db.session.remove()
+        db.engines[None] = self.primary
+        del db.engines['replica0']
+        app.config['REPLICA_BIND_KEYS'] = []
+        for engine in self.engines:
+            engine.dispose()
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def usernames(self):
+        data = self.client.get('/api/users', headers=self.headers).get_json()
+        return [item['username'] for item in data['items']]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.usernames(), ['john', 'replicated'])
+
+    def test_writes_stick_to_primary(self):
+        response = self.client.post('/api/users', json={
+            'username': 'susan', 'email': 'susan@example.com', 'password': 'cat'})
+        self.assertEqual(response.status_code, 201)
+        with self.engines[0].connect() as connection:
+            self.assertEqual(connection.execute(select(User.username).where(
+                User.username == 'susan')).scalar(), 'susan')
+        # anonym geschrieben: kein Eintrag, kein Cookie
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(self.usernames(), ['john', 'replicated'])
+
+        # read your own writes: john liest eine Weile vom Primary, auch mit
+        # einem neuen Client ohne Cookies
+        response = self.client.put('/api/users/1', json={'about_me': 'hello'},
+                                   headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.client = app.test_client()
+        self.assertEqual(self.usernames(), ['john', 'susan'])
+        replicas.pins.clear()
+        self.assertEqual(self.usernames(), ['john', 'replicated'])
+
+
+class SqliteProductionCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.dir = tempfile.mkdtemp()
+        self.saved = {key: app.config[key] for key in (
+            'SQLITE_PRODUCTION', 'SQLITE_WRITE_QUEUE', 'SQLITE_WRITE_WAIT_MS')}
+        app.config.update(SQLITE_PRODUCTION=True, SQLITE_WRITE_QUEUE=True,
+                          SQLITE_WRITE_WAIT_MS=50)
+        self.primary = db.engines[None]
+        self.engine = create_engine('sqlite:///' + os.path.join(self.dir, 'app.db'))
+        db.engines[None] = self.engine
+        db.create_all()
+        self.user = User(username='john', email='john@example.com')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        writer.stop()
+        db.session.remove()
+        db.engines[None] = self.primary
+        app.config.update(self.saved)
+        self.engine.dispose()
+        for name in os.listdir(self.dir):
+            os.unlink(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def test_pragmas(self):
+        connection = db.session.connection()
+        self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+        self.assertEqual(connection.exec_driver_sql('PRAGMA synchronous').scalar(), 1)
+        self.assertEqual(connection.exec_driver_sql('PRAGMA busy_timeout').scalar(),
+                         app.config['SQLITE_BUSY_TIMEOUT'])
+
+    def test_write_queue_groups_commits(self):
+        commits = writer.commits
+        futures = [writer.submit(Post.publish, self.user.id, 'post {}'.format(i))
+                   for i in range(10)]
+        self.assertEqual(len({f.result(5) for f in futures}), 10)
+        self.assertLessEqual(writer.commits - commits, 2)
+        db.session.expire_all()
+        self.assertEqual(Post.query.count(), 10)
+        self.assertEqual(self.user.post_count, 10)
+
+    def test_failed_job_does_not_abort_batch(self):
+        def broken(user_id):
+            Post.publish(user_id, 'lost')
+            raise ValueError('broken job')
+        futures = [writer.submit(Post.publish, self.user.id, 'first'),
+                   writer.submit(broken, self.user.id),
+                   writer.submit(Post.publish, self.user.id, 'second')]
+        self.assertRaises(ValueError, futures[1].result, 5)
+        futures[0].result(5)
+        futures[2].result(5)
+        db.session.expire_all()
+        self.assertEqual(sorted(p.body for p in Post.query), ['first', 'second'])
+        self.assertEqual(self.user.post_count, 2)
+
+    def test_pragmas_without_app_context(self):
+        self.engine.dispose()
+        self.app_context.pop()
+        try:
+            with self.engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+        finally:
+            self.app_context.push()
+
+    def test_write_timeout(self):
+        from threading import Event
+        from app.sqlite import WriteTimeout
+        release = Event()
+
+        def slow(user_id):
+            release.wait(5)
+            return Post.publish(user_id, 'slow')
+        timeout = app.config['SQLITE_WRITE_TIMEOUT']
+        app.config['SQLITE_WRITE_TIMEOUT'] = 0.2
+        try:
+            # läuft schon: kann noch committen
+            with self.assertRaises(WriteTimeout) as running:
+                writer.run(slow, self.user.id)
+            self.assertIsNone(running.exception.applied)
+            # wartet noch in der Queue: wird verworfen
+            with self.assertRaises(WriteTimeout) as queued:
+                writer.run(Post.publish, self.user.id, 'dropped')
+            self.assertIs(queued.exception.applied, False)
+            release.set()
+            writer.submit(Post.publish, self.user.id, 'after').result(5)
+        finally:
+            app.config['SQLITE_WRITE_TIMEOUT'] = timeout
+        db.session.expire_all()
+        self.assertEqual(sorted(p.body for p in Post.query), ['after', 'slow'])
+
+    def test_run_through_queue(self):
+        post_id = writer.run(Post.publish, self.user.id, 'hello')
+        self.assertEqual(db.session.get(Post, post_id).body, 'hello')
+        self.assertEqual(self.user.timeline().count(), 1)
+
+
+class QueryPlanCase(unittest.TestCase):
+    # Index-Regressionen der Feed-Queries über EXPLAIN QUERY PLAN erkennen
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.u1 = User(username='john', email='john@example.com')
+        self.u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def plan(self, query):
+        statement = getattr(query, 'statement', query)
+        compiled = statement.compile(dialect=db.engine.dialect)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + str(compiled), params)
+        return '\n'.join(row[3] for row in rows)
+
+    def assertNoScan(self, plan, *tables):
+        for table in tables:
+            self.assertNotIn('SCAN {}'.format(table), plan)
+
+    def test_is_following(self):
+        plan = self.plan(select(followers.c.follower_id).where(
+            followers.c.follower_id == self.u1.id,
+            followers.c.followed_id == self.u2.id))
+        self.assertIn('USING COVERING INDEX sqlite_autoindex_followers_1', plan)
+
+    def test_follower_list(self):
+        plan = self.plan(self.u1.followers)
+        self.assertIn('ix_followers_followed_id_follower_id (followed_id=?)', plan)
+        self.assertNoScan(plan, 'followers', 'user')
+        plan = self.plan(self.u1.followed)
+        self.assertIn('sqlite_autoindex_followers_1 (follower_id=?)', plan)
+        self.assertNoScan(plan, 'followers', 'user')
+
+    def test_user_posts(self):
+        plan = self.plan(self.u1.posts.order_by(Post.timestamp.desc(),
+                                                Post.id.desc()))
+        self.assertIn('ix_post_user_id_timestamp (user_id=?)', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_followed_posts(self):
+        plan = self.plan(self.u1.followed_posts())
+        self.assertEqual(plan.count('ix_post_user_id_timestamp (user_id=?)'), 2)
+        self.assertNoScan(plan, 'followers', 'post')
+
+    def test_timeline(self):
+        # wie die Home-Seite: erste und folgende Seite
+        query, keys = Timeline.posts_for(self.u1)
+        now = datetime.utcnow()
+        for values in (None, [now, 1]):
+            cursor = encode_cursor('n', values) if values else None
+            plan = self.plan(KeysetPagination(query, keys, 10, cursor, defer=True).query)
+            self.assertIn('ix_timeline_user_id_timestamp_post_id (user_id=?', plan)
+            self.assertNoScan(plan, 'timeline', 'post')
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_timeline_with_celebrity(self):
+        # jeder Teil liest nur eine Seite über seinen Index, sortiert wird
+        # nur die Vereinigung der Teilseiten
+        u3 = User(username='mary', email='mary@example.com')
+        db.session.add(u3)
+        self.u1.follow(self.u2)
+        self.u1.follow(u3)
+        # follow stuft nach der Followerzahl ein, hier von Hand
+        u3.celebrity = True
+        db.session.commit()
+        query = lambda bound: Timeline.posts_for(self.u1, bound)
+        now = datetime.utcnow()
+        for values in (None, [now, 1]):
+            cursor = encode_cursor('n', values) if values else None
+            page = KeysetPagination(query, None, 10, cursor, defer=True).query
+            # LIMIT in beiden Teilen und außen
+            self.assertEqual(str(page.statement).count('LIMIT'), 3)
+            plan = self.plan(page)
+            self.assertIn('ix_timeline_user_id_timestamp_post_id (user_id=?', plan)
+            self.assertIn('ix_post_user_id_timestamp (user_id=?', plan)
+            self.assertNoScan(plan, 'timeline', 'post')
+
+    def test_explore(self):
+        plan = self.plan(Post.query.order_by(Post.timestamp.desc(), Post.id.desc()))
+        self.assertIn('ix_post_timestamp', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_version_markers(self):
+        # Marker der bedingten GETs (app/conditional.py) ohne Tabellen-Scan
+        for query in (select(func.max(Post.timestamp)),
+                      select(func.max(Post.timestamp)).where(Post.user_id == self.u1.id),
+                      select(func.max(User.profile_updated))):
+            self.assertNoScan(self.plan(query), 'post', 'user')
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    # Minimaler SMTP-Server, der Nachrichten nur mitschreibt
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost debugging server')
+        while True:
+            line = self.rfile.readline().decode('utf-8', 'replace').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                break
+            elif command in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                data = []
+                while True:
+                    row = self.rfile.readline().decode('utf-8', 'replace')
+                    if row.rstrip('\r\n') == '.':
+                        break
+                    data.append(row)
+                self.server.messages.append(''.join(data))
+                self.reply('250 queued')
+            else:
+                self.reply('250 ok')
+
+
+class MailQueueCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.server = socketserver.ThreadingTCPServer(('localhost', 0),
+                                                      DebuggingSMTPHandler)
+        self.server.daemon_threads = True
+        self.server.messages = []
+        self.server.connections = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved = {key: app.config.get(key) for key in (
+            'MAIL_PORT', 'MAIL_SERVER', 'MAIL_WORKERS', 'MAIL_SUPPRESS_SEND')}
+        app.config.update(MAIL_SERVER='localhost',
+                          MAIL_PORT=self.server.server_address[1],
+                          MAIL_WORKERS=0, MAIL_SUPPRESS_SEND=False)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        app.config.update(self.saved)
+        db.session.remove()
+        db.drop_all()
+
+    def queue(self, count):
+        for i in range(count):
+            send_email('mail {}'.format(i), 'admin@example.com',
+                       ['user{}@example.com'.format(i)], 'text', '<p>html</p>')
+
+    def test_queue_batches_on_one_connection(self):
+        self.queue(3)
+        self.assertEqual(outbox.stats()['pending'], 3)
+        self.assertEqual(outbox.drain(), 3)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(OutgoingMail.query.count(), 0)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        self.queue(2)
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertEqual(outbox.drain(), 0)
+        messages = OutgoingMail.query.all()
+        self.assertEqual([m.status for m in messages], ['pending', 'pending'])
+        self.assertEqual([m.attempts for m in messages], [1, 1])
+        self.assertTrue(all(m.next_attempt > datetime.utcnow() for m in messages))
+        # not due yet
+        self.assertEqual(outbox.drain(), 0)
+        self.assertEqual(outbox.stats()['pending'], 2)
+
+    def test_request_path_starts_no_workers(self):
+        app.config['MAIL_WORKERS'] = 2
+        self.queue(2)
+        self.assertEqual(outbox._threads, [])
+        self.assertEqual(outbox.stats()['pending'], 2)
+        # ein später gestarteter `flask mail worker` holt die liegengebliebenen ab
+        outbox.start()
+        try:
+            for _ in range(50):
+                if len(self.server.messages) == 2:
+                    break
+                time.sleep(0.1)
+        finally:
+            outbox.stop()
+        self.assertEqual(len(self.server.messages), 2)
+
+
+class AppFactoryCase(unittest.TestCase):
+    def test_create_app(self):
+        other = create_app(TestConfig)
+        self.assertIsNot(other, app)
+        self.assertIn('main.index', other.view_functions)
+        self.assertIn('api.get_user', other.view_functions)
+        # Migrate nur für CLI-Kommandos, Mail erst beim ersten Versand
+        self.assertNotIn('migrate', other.extensions)
+        self.assertNotIn('mail', other.extensions)
+        with other.test_request_context():
+            self.assertEqual(url_for('main.explore'), '/explore')
+            self.assertEqual(url_for('api.get_user', id=1), '/api/users/1')
+
+
+class FragmentCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        fragments.cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def render(self, post):
+        with app.test_request_context():
+            return render_template('_posts.html', post=post)
+
+    def test_post_rows(self):
+        u = User(username='john', email='john@example.com')
+        p = Post(body='hello', author=u)
+        db.session.add_all([u, p])
+        db.session.commit()
+        self.assertIn('hello', self.render(p))
+        hits = fragments.cache.hits
+        self.assertIn('hello', self.render(p))
+        self.assertEqual(fragments.cache.hits - hits, 1)
+
+        # bearbeiteter Post wird verworfen
+        p.body = 'edited'
+        db.session.commit()
+        self.assertIsNone(fragments.cache.get(('post', p.id),
+                                              (p.timestamp, u.profile_updated)))
+        self.assertIn('edited', self.render(p))
+
+        # in einem anderen Worker bearbeitet: der Cache hier wird nicht
+        # geleert, aber der neue Zeitstempel ändert die Version
+        db.session.execute(db.update(Post).where(Post.id == p.id).values(
+            body='elsewhere', timestamp=datetime.utcnow() + timedelta(seconds=1)))
+        db.session.commit()
+        self.assertIn('elsewhere', self.render(p))
+
+        # last_seen ändert die Version nicht, der Username schon
+        version = u.profile_updated
+        u.last_seen = datetime.utcnow() + timedelta(hours=1)
+        db.session.commit()
+        self.assertEqual(u.profile_updated, version)
+        u.username = 'johnny'
+        db.session.commit()
+        self.assertNotEqual(u.profile_updated, version)
+        self.assertIn('johnny', self.render(p))
+
+    def test_authors_loaded_once_per_page(self):
+        users = [User(username='user{}'.format(i), email='u{}@example.com'.format(i))
+                 for i in range(4)]
+        db.session.add_all(users)
+        db.session.add_all([Post(body='post {}'.format(i), author=users[i % 4])
+                            for i in range(8)])
+        db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(users[0].id)
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        db.session.remove()
+        db.event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            for i in range(2):
+                del statements[:]
+                self.assertEqual(client.get('/explore').status_code, 200)
+                # eine Query für alle Autoren der Seite, keine Einzel-Loads
+                users = [s for s in statements
+                         if 'FROM user' in s and 'max(' not in s]
+                self.assertEqual(len([s for s in users if 'user.id IN' in s]), 1)
+                self.assertLessEqual(len(users), 2)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record)
+
+
+class ConditionalGetCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = app.test_client()
+        self.john = User(username='john', email='john@example.com')
+        self.susan = User(username='susan', email='susan@example.com')
+        db.session.add_all([self.john, self.susan])
+        db.session.commit()
+        token = self.john.get_token()
+        db.session.commit()
+        self.headers = {'Authorization': 'Bearer ' + token}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def revalidate(self, url, etag, **headers):
+        return self.client.get(url, headers=dict(self.headers, **headers,
+                                                 **{'If-None-Match': etag}))
+
+    def test_api_resources(self):
+        db.session.add(Post(body='hello', author=self.susan))
+        db.session.commit()
+        for url in ('/api/users/{}'.format(self.susan.id),
+                    '/api/users/{}/posts'.format(self.susan.id), '/api/posts'):
+            response = self.client.get(url, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            self.assertFalse(etag.startswith('W/'))
+            response = self.revalidate(url, etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], etag)
+
+        # neuer Post ändert Posts und Zähler des Users
+        url = '/api/users/{}/posts'.format(self.susan.id)
+        etag = self.client.get(url, headers=self.headers).headers['ETag']
+        last_modified = self.client.get(url, headers=self.headers).headers['Last-Modified']
+        response = self.client.get(url, headers=dict(
+            self.headers, **{'If-Modified-Since': last_modified}))
+        self.assertEqual(response.status_code, 304)
+        Post.publish(self.susan.id, 'again')
+        db.session.commit()
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['items']), 2)
+
+        url = '/api/users/{}'.format(self.susan.id)
+        etag = self.client.get(url, headers=self.headers).headers['ETag']
+        self.john.follow(self.susan)
+        db.session.commit()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/users/999', headers=self.headers)
+                         .status_code, 404)
+
+    def test_html_pages(self):
+        with self.client.session_transaction() as session:
+            session['_user_id'] = str(self.john.id)
+        for url in ('/user/susan', '/explore'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            self.assertTrue(etag.startswith('W/'))
+            self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        # Folgen ändert den Button auf der Profilseite
+        etag = self.client.get('/user/susan').headers['ETag']
+        self.john.follow(self.susan)
+        db.session.commit()
+        self.assertEqual(self.revalidate('/user/susan', etag).status_code, 200)
+
+        # anstehende Flash-Nachrichten werden immer ausgeliefert
+        etag = self.client.get('/explore').headers['ETag']
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('info', 'hello')]
+        response = self.revalidate('/explore', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'hello', response.data)
+
+
+class FollowGraphCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        graph.follows.clear()
+        graph.follows.mode = 'lazy'
+        self.users = [User(username='u{}'.format(i), email='u{}@example.com'.format(i))
+                      for i in range(4)]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def tearDown(self):
+        graph.follows.mode = TestConfig.FOLLOW_GRAPH
+        graph.follows.clear()
+        db.session.remove()
+        db.drop_all()
+
+    def test_lookups_follow_changes(self):
+        u0, u1, u2, u3 = self.users
+        u0.follow(u1)
+        u0.follow(u2)
+        u1.follow(u0)
+        db.session.commit()
+        self.assertTrue(u0.is_following(u1))
+        self.assertFalse(u1.is_following(u2))
+        self.assertTrue(graph.follows.is_mutual(u0, u1))
+        self.assertEqual(list(graph.follows.mutual(u0)), [u1.id])
+        self.assertEqual(list(graph.follows.ids('follower', u0)), [u1.id])
+        misses = graph.follows.misses
+
+        # Änderungen aus diesem Prozess werden nach dem Commit übernommen
+        u0.unfollow(u2)
+        u0.follow(u3)
+        db.session.commit()
+        self.assertFalse(u0.is_following(u2))
+        self.assertTrue(u0.is_following(u3))
+        self.assertEqual(graph.follows.misses, misses)
+        u0.follow(u2)
+        db.session.rollback()
+        self.assertFalse(u0.is_following(u2))
+
+        # fremde Änderung (anderer Worker): der Zähler verrät die alte Liste
+        db.session.execute(followers.insert().values(follower_id=u0.id,
+                                                     followed_id=u2.id))
+        User.repair_counters()
+        db.session.commit()
+        self.assertTrue(u0.is_following(u2))
+
+    def test_preload_and_budget(self):
+        u0, u1, u2, u3 = self.users
+        bulk.import_follows([{'follower_id': a.id, 'followed_id': b.id}
+                             for a in self.users for b in self.users if a is not b])
+        graph.follows.mode = 'preload'
+        misses = graph.follows.misses
+        self.assertTrue(u3.is_following(u0))
+        self.assertEqual(graph.follows.misses, misses)
+        stats = graph.follows.stats()
+        self.assertEqual(stats['lists'], 8)
+        self.assertEqual(stats['ids'], 24)
+        graph.follows.clear()
+        graph.follows.max_bytes = stats['bytes'] // 2
+        graph.follows.load_all()
+        self.assertLessEqual(graph.follows.bytes, graph.follows.max_bytes)
+        self.assertEqual(len(graph.follows), 4)
+        self.assertTrue(u3.is_following(u0))
+        graph.follows.max_bytes = TestConfig.FOLLOW_GRAPH_MAX_BYTES
+
+
+class RecommendCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.users = [User(username='u{}'.format(i), email='u{}@example.com'.format(i))
+                      for i in range(6)]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def names(self, user):
+        return [u.username for u in user.suggested()]
+
+    def test_refresh(self):
+        u0, u1, u2, u3, u4, u5 = self.users
+        u1.follow(u2)
+        u2.follow(u3)
+        u2.follow(u4)
+        u5.follow(u1)
+        u5.follow(u4)
+        u5.follow(u0)
+        db.session.commit()
+        self.assertEqual(recommend.refresh(), 6)
+        # u4: Freund eines Freundes (1.0) und Co-Follow über u5 (0.5)
+        self.assertEqual(self.names(u1), ['u4', 'u3', 'u0'])
+        self.assertEqual(self.names(u5), ['u2'])
+        self.assertIsNotNone(u1.suggestions_updated)
+
+        # gefolgte fallen sofort weg, neu gerechnet werden nur die beiden
+        u1.follow(u4)
+        db.session.commit()
+        self.assertEqual(self.names(u1), ['u3', 'u0'])
+        self.assertEqual(recommend.refresh(), 2)
+        self.assertEqual(self.names(u1), ['u3', 'u0'])
+        self.assertEqual(recommend.refresh(), 0)
+        incremental = [self.names(u) for u in self.users]
+        self.assertEqual(recommend.refresh(full=True), 6)
+        self.assertEqual([self.names(u) for u in self.users], incremental)
+
+        token = u1.get_token()
+        db.session.commit()
+        response = self.client_get('/api/users/{}/suggestions'.format(u1.id),
+                                   headers={'Authorization': 'Bearer ' + token})
+        self.assertEqual([item['username'] for item in response.get_json()['items']],
+                         ['u3', 'u0'])
+
+    def client_get(self, url, **kwargs):
+        return app.test_client().get(url, **kwargs)
+
+    def test_profile_page(self):
+        u0, u1, u2 = self.users[:3]
+        u0.follow(u1)
+        u1.follow(u2)
+        db.session.commit()
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u0.id)
+        self.assertNotIn(b'Who to follow', client.get('/user/u0').data)
+        recommend.refresh()
+        response = client.get('/user/u0')
+        self.assertIn(b'Who to follow', response.data)
+        self.assertIn(b'>u2</a>', response.data)
+        self.assertNotIn(b'Who to follow', client.get('/user/u1').data)
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiosqlite'), 'needs aiosqlite')
+class StreamCase(unittest.TestCase):
+    def setUp(self):
+        from app.asgi import AsyncApi
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+        class StreamConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.path
+            SSE_BROKER = 'memory'
+            SSE_HEARTBEAT = 0.05
+
+        self.app = create_app(StreamConfig)
+        self.api = AsyncApi(self.app)
+        with self.app.app_context():
+            db.create_all()
+            users = [User(username='u{}'.format(i), email='u{}@example.com'.format(i))
+                     for i in range(3)]
+            db.session.add_all(users)
+            users[0].follow(users[1])
+            db.session.commit()
+            self.token = users[0].get_token()
+            db.session.commit()
+            self.ids = [user.id for user in users]
+
+    def tearDown(self):
+        stream.broker.stop()
+        stream.broker.mode = TestConfig.SSE_BROKER
+        asyncio.run(self.api.engine.dispose())
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        os.unlink(self.path)
+
+    def publish(self, author, body):
+        with self.app.app_context():
+            id = Post.publish(author, body)
+            db.session.commit()
+            return id
+
+    async def open(self, headers=None):
+        """Startet einen Stream; liefert (Status, Body-Queue, Disconnect)."""
+        headers = dict(headers or {'Authorization': 'Bearer ' + self.token})
+        headers['Host'] = self.app.config['SERVER_NAME']
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream/timeline',
+                 'query_string': b'', 'headers': [(k.lower().encode(), v.encode())
+                                                  for k, v in headers.items()]}
+        started = asyncio.get_running_loop().create_future()
+        body = asyncio.Queue()
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                started.set_result(message)
+            else:
+                await body.put(message['body'] if message.get('more_body') else None)
+
+        self.task = asyncio.ensure_future(self.api(scope, receive, send))
+        start = await started
+        return start['status'], dict(start['headers']), body, disconnect
+
+    @staticmethod
+    def parse(data):
+        events = []
+        for block in data.decode().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.splitlines()
+                          if ': ' in line and not line.startswith(':'))
+            if 'data' in fields:
+                events.append((int(fields['id']), json.loads(fields['data'])['body']))
+        return events
+
+    @staticmethod
+    async def read_all(body):
+        data = b''
+        while True:
+            chunk = await body.get()
+            if chunk is None:
+                return data
+            data += chunk
+
+    def test_live_events(self):
+        u0, u1, u2 = self.ids
+
+        async def run():
+            status, headers, body, disconnect = await self.open()
+            self.assertEqual(headers[b'content-type'], b'text/event-stream; charset=utf-8')
+            self.assertTrue((await body.get()).startswith(b'retry: '))
+            self.assertEqual(stream.broker.streams, 1)
+            # Commits in einem anderen Thread wecken die Coroutine
+            loop = asyncio.get_running_loop()
+            ids = [await loop.run_in_executor(None, self.publish, author, body)
+                   for author, body in ((u1, 'from u1'), (u2, 'from u2'), (u0, 'from u0'))]
+            events = []
+            while len(events) < 2:
+                events += self.parse(await asyncio.wait_for(body.get(), 5))
+            self.assertEqual(events, [(ids[0], 'from u1'), (ids[2], 'from u0')])
+            self.assertEqual(await body.get(), b': keepalive\n\n')
+            disconnect.set()
+            await asyncio.wait_for(self.task, 5)
+            self.assertEqual(stream.broker.streams, 0)
+
+        asyncio.run(run())
+
+    def test_resume_with_last_event_id(self):
+        u0, u1, u2 = self.ids
+        ids = [self.publish(author, 'post {}'.format(i))
+               for i, author in enumerate((u1, u2, u1, u0))]
+        self.app.config['SSE_MAX_AGE'] = 0
+
+        async def run():
+            status, headers, body, disconnect = await self.open({
+                'Authorization': 'Bearer ' + self.token, 'Last-Event-ID': str(ids[0])})
+            self.assertEqual(self.parse(await self.read_all(body)),
+                             [(ids[2], 'post 2'), (ids[3], 'post 3')])
+            await self.task
+            self.assertEqual(stream.broker.streams, 0)
+
+        asyncio.run(run())
+
+    def test_login_session(self):
+        cookie = self.app.session_interface.get_signing_serializer(self.app) \
+            .dumps({'_user_id': str(self.ids[0])})
+        self.app.config['SSE_MAX_AGE'] = 0
+
+        async def run():
+            status, headers, body, disconnect = await self.open({'Cookie': 'session=' + cookie})
+            await self.read_all(body)
+            return status
+
+        self.assertEqual(asyncio.run(run()), 200)
+
+    def test_rejected_streams(self):
+        async def status(headers):
+            status, headers, body, disconnect = await self.open(headers)
+            await self.task
+            return status, headers
+
+        self.assertEqual(asyncio.run(status({'Authorization': 'Bearer bad'}))[0], 401)
+        self.app.config['SSE_MAX_STREAMS'] = 0
+        code, headers = asyncio.run(status(None))
+        self.assertEqual(code, 503)
+        self.assertIn(b'retry-after', headers)
+        self.assertEqual(stream.broker.streams, 0)
+
+    def test_database_broker(self):
+        u0, u1, u2 = self.ids
+        stream.broker.mode = 'database'
+        self.app.config['SSE_POLL_INTERVAL'] = 0.01
+
+        async def run():
+            with self.app.app_context():
+                subscription = stream.broker.subscribe(u0, [u0, u1],
+                                                       asyncio.get_running_loop())
+                try:
+                    # Post eines anderen Workers: nur in der Datenbank
+                    db.session.execute(Post.__table__.insert().values(user_id=u1,
+                                                                      body='elsewhere'))
+                    db.session.commit()
+                    return await subscription.get(5)
+                finally:
+                    stream.broker.unsubscribe(subscription)
+
+        self.assertEqual([event['body'] for event in asyncio.run(run())], ['elsewhere'])
+
+    def test_home_timeline_only(self):
+        client = self.app.test_client()
+        # ohne ASGI-Server gibt es den Stream nicht
+        response = client.get('/api/stream/timeline',
+                              headers={'Authorization': 'Bearer ' + self.token})
+        self.assertEqual(response.status_code, 404)
+        with client.session_transaction() as session:
+            session['_user_id'] = str(self.ids[0])
+        self.assertNotIn(b'EventSource', client.get('/index').data)
+        self.app.config['SSE_ENABLED'] = True
+        self.assertIn(b'EventSource', client.get('/index').data)
+        self.assertNotIn(b'EventSource', client.get('/explore').data)
+
+
+@unittest.skipUnless(importlib.util.find_spec('aiosqlite'), 'needs aiosqlite')
+class AsyncApiCase(unittest.TestCase):
+    def setUp(self):
+        from app.asgi import AsyncApi
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+        class AsyncConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.path
+
+        self.app = create_app(AsyncConfig)
+        self.api = AsyncApi(self.app)
+        with self.app.app_context():
+            db.create_all()
+            users = [User(username='u{}'.format(i), email='u{}@example.com'.format(i))
+                     for i in range(4)]
+            db.session.add_all(users)
+            for user in users[1:]:
+                users[0].follow(user)
+                user.follow(users[0])
+            db.session.commit()
+            for i in range(7):
+                Post.publish(users[i % 4].id, 'post {}'.format(i))
+            db.session.commit()
+            self.token = users[0].get_token()
+            db.session.commit()
+
+    def tearDown(self):
+        asyncio.run(self.api.engine.dispose())
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        os.unlink(self.path)
+
+    def call(self, path, query='', token=None):
+        headers = [(b'host', self.app.config['SERVER_NAME'].encode())]
+        if token is not None:
+            headers.append((b'authorization', 'Bearer {}'.format(token).encode()))
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': query.encode(), 'headers': headers}
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.api(scope, None, send))
+        return messages[0]['status'], json.loads(messages[1]['body'] or 'null')
+
+    def test_same_responses_as_wsgi(self):
+        client = self.app.test_client()
+        headers = {'Authorization': 'Bearer ' + self.token, 'Accept': 'application/json'}
+        for path, query in (('/api/users', 'limit=2'), ('/api/users/1', ''),
+                            ('/api/users/1/followers', 'limit=2'),
+                            ('/api/users/2/followed', ''),
+                            ('/api/users/1/posts', 'limit=1'),
+                            ('/api/posts', 'limit=3'), ('/api/users/99', '')):
+            expected = client.get(path + '?' + query, headers=headers)
+            self.assertEqual(self.call(path, query, self.token),
+                             (expected.status_code, expected.get_json()), path)
+            # nächste Seite über den Cursor der ersten
+            cursor = (expected.get_json() or {}).get('_meta', {}).get('next_cursor')
+            if cursor:
+                query = 'limit=2&cursor=' + cursor
+                self.assertEqual(self.call(path, query, self.token)[1],
+                                 client.get(path + '?' + query, headers=headers).get_json())
+
+    def test_authentication(self):
+        self.assertEqual(self.call('/api/users')[0], 401)
+        self.assertEqual(self.call('/api/users', token='bad')[0], 401)
+        tokens.cache.clear()
+        self.assertEqual(self.call('/api/users/1', token=self.token)[0], 200)
+        self.assertEqual(self.call('/api/users', 'cursor=bad', self.token)[0], 400)
+        self.assertEqual(self.call('/api/tokens', token=self.token)[0], 405)
+
+
+class BulkImportCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = app.test_client()
+        self.users = [User(username=name, email=name + '@example.com')
+                      for name in ('admin', 'john', 'susan', 'mary')]
+        db.session.add_all(self.users)
+        db.session.commit()
+        self.ids = [u.id for u in self.users]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def headers(self, user):
+        token = user.get_token()
+        db.session.commit()
+        return {'Authorization': 'Bearer ' + token}
+
+    def assertConsistent(self):
+        # Zähler und Timelines wie nach einzelnen Writes
+        counters = [(u.post_count, u.follower_count, u.followed_count)
+                    for u in User.query.order_by(User.id)]
+        timelines = sorted(db.session.execute(select(Timeline.user_id, Timeline.post_id)).all())
+        User.repair_counters()
+        for user in User.query:
+            Timeline.rebuild(user)
+        db.session.commit()
+        self.assertEqual(counters, [(u.post_count, u.follower_count, u.followed_count)
+                                    for u in User.query.order_by(User.id)])
+        self.assertEqual(timelines, sorted(db.session.execute(
+            select(Timeline.user_id, Timeline.post_id)).all()))
+
+    def test_posts_batch(self):
+        admin, john, susan, mary = self.ids
+        self.users[2].follow(self.users[1])
+        db.session.commit()
+        app.config['BULK_CHUNK_SIZE'] = 2
+        try:
+            items = [{'body': 'hello', 'user_id': john, 'timestamp': '2024-01-01T10:00:00Z'},
+                     {'body': 'world', 'user_id': mary},
+                     {'body': 'hello', 'user_id': john, 'timestamp': '2024-01-01T10:00:00Z'},
+                     {'body': '', 'user_id': john},
+                     {'body': 'ghost', 'user_id': 999},
+                     'garbage']
+            response = self.client.post('/api/posts:batch', json={'items': items},
+                                        headers=self.headers(self.users[0]))
+            data = response.get_json()
+            self.assertEqual([r['status'] for r in data['items']],
+                             ['created', 'created', 'duplicate', 'invalid',
+                              'invalid', 'invalid'])
+            self.assertEqual(data['items'][2]['id'], data['items'][0]['id'])
+            self.assertEqual(data['_meta'], {'created': 2, 'duplicate': 1, 'invalid': 3})
+
+            # wiederholter Import legt nichts doppelt an
+            data = self.client.post('/api/posts:batch', json={'items': items[:1]},
+                                    headers=self.headers(self.users[0])).get_json()
+            self.assertEqual(data['items'][0]['status'], 'duplicate')
+        finally:
+            app.config['BULK_CHUNK_SIZE'] = TestConfig.BULK_CHUNK_SIZE
+
+        self.assertEqual(db.session.get(User, john).post_count, 1)
+        self.assertEqual([p.body for p in Post.search('hello', 1, 10).items], ['hello'])
+        self.assertEqual([p.body for p in self.users[2].timeline()], ['hello'])
+        self.assertConsistent()
+
+        # Nicht-Admins posten nur für sich selbst
+        data = self.client.post('/api/posts:batch', json={'items': [
+            {'body': 'mine'}, {'body': 'theirs', 'user_id': susan}]},
+            headers=self.headers(self.users[1])).get_json()
+        self.assertEqual([r['status'] for r in data['items']], ['created', 'invalid'])
+        response = self.client.post('/api/posts:batch', json=[{'body': 'x'}],
+                                    headers=self.headers(self.users[1]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_posts_batch_timezones(self):
+        admin, john, susan, mary = self.ids
+        items = [{'body': 'offset', 'user_id': john, 'timestamp': '2024-01-01T10:00:00+02:00'},
+                 {'body': 'offset', 'user_id': john, 'timestamp': '2024-01-01T08:00:00'}]
+        data = self.client.post('/api/posts:batch', json={'items': items},
+                                headers=self.headers(self.users[0])).get_json()
+        # als UTC gespeichert, derselbe Zeitpunkt ohne Offset ist ein Duplikat
+        self.assertEqual([r['status'] for r in data['items']], ['created', 'duplicate'])
+        post = db.session.get(Post, data['items'][0]['id'])
+        self.assertEqual(post.timestamp, datetime(2024, 1, 1, 8))
+        self.assertEqual(db.session.get(User, john).post_count, 1)
+        self.assertEqual([p.body for p in Post.search('offset', 1, 10).items], ['offset'])
+        self.assertConsistent()
+
+    def test_follows_batch(self):
+        admin, john, susan, mary = self.ids
+        Post.publish(susan, 'from susan')
+        self.users[1].follow(self.users[3])
+        db.session.commit()
+        url = '/api/users/{}/followed:batch'.format(john)
+        data = self.client.post(url, json={'items': [susan, mary, susan, john, 999, 'x']},
+                                headers=self.headers(self.users[1])).get_json()
+        self.assertEqual([r['status'] for r in data['items']],
+                         ['created', 'duplicate', 'duplicate', 'invalid',
+                          'invalid', 'invalid'])
+        self.assertTrue(self.users[1].is_following(self.users[2]))
+        self.assertEqual([p.body for p in self.users[1].timeline()], ['from susan'])
+        self.assertConsistent()
+        response = self.client.post(url, json={'items': [mary]},
+                                    headers=self.headers(self.users[2]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_import_cli(self):
+        admin, john, susan, mary = self.ids
+        lines = [json.dumps({'user_id': john, 'body': 'post {}'.format(i),
+                             'timestamp': '2024-01-0{}T00:00:00'.format(i + 1)})
+                 for i in range(3)] + ['', 'not json']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'posts.ndjson.gz')
+            with gzip.open(path, 'wt') as f:
+                f.write('\n'.join(lines) + '\n')
+            runner = app.test_cli_runner()
+            result = runner.invoke(args=['import', 'posts', path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('3 created, 0 duplicate, 1 invalid', result.output)
+            self.assertIn('line 5: expected an object', result.output)
+
+            # Export und erneuter Import: alles Duplikate
+            export = os.path.join(directory, 'export.ndjson')
+            runner.invoke(args=['export', 'posts', '-o', export])
+            result = runner.invoke(args=['import', 'posts', export])
+            self.assertIn('0 created, 3 duplicate, 0 invalid', result.output)
+
+            path = os.path.join(directory, 'follows.ndjson')
+            with open(path, 'w') as f:
+                f.write(json.dumps({'follower_id': susan, 'followed_id': john}) + '\n')
+            result = runner.invoke(args=['import', 'follows', path])
+            self.assertIn('1 created', result.output)
+        self.assertEqual(db.session.get(User, john).follower_count, 1)
+        self.assertEqual(len(self.users[2].timeline().all()), 3)
+        self.assertConsistent()
+
+
+class ApiCase(unittest.TestCase):
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        tokens.cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def token_headers(self, user):
+        token = user.get_token()
+        db.session.commit()
+        return {'Authorization': 'Bearer ' + token}
+
+    def test_users_collection_is_paginated(self):
+        users = [User(username='u{}'.format(i), email='u{}@example.com'.format(i))
+                 for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        headers = self.token_headers(users[0])
+
+        names = []
+        url = '/api/users?limit=2'
+        while url:
+            data = self.client.get(url, headers=headers).get_json()
+            self.assertLessEqual(data['_meta']['count'], 2)
+            names.extend(item['username'] for item in data['items'])
+            url = data['_links']['next']
+        self.assertEqual(names, ['u0', 'u1', 'u2', 'u3', 'u4'])
+
+        data = self.client.get('/api/users?limit=100000', headers=headers).get_json()
+        self.assertEqual(data['_meta']['limit'], app.config['API_MAX_PER_PAGE'])
+        response = self.client.get('/api/users?cursor=garbage', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_user(self):
+        admin, a, b, c = [User(username=name, email='{}@example.com'.format(name))
+                          for name in ('admin', 'a', 'b', 'c')]
+        db.session.add_all([admin, a, b, c])
+        db.session.commit()
+        a.follow(b)
+        b.follow(c)
+        Post.publish(b.id, 'from b')
+        Post.publish(c.id, 'from c')
+        db.session.commit()
+        # b's Post bei a und b, c's Post bei b und c
+        self.assertEqual(Timeline.query.filter((Timeline.user_id == b.id) |
+                                               (Timeline.author_id == b.id)).count(), 3)
+        graph.follows.mode = 'lazy'
+        try:
+            self.assertEqual(list(graph.follows.ids('followed', a)), [b.id])
+            response = self.client.delete('/api/users/{}'.format(b.id),
+                                          headers=self.token_headers(admin))
+            self.assertEqual(response.status_code, 200)
+            db.session.expire_all()
+            self.assertEqual((a.followed_count, c.follower_count), (0, 0))
+            self.assertEqual(list(graph.follows.ids('followed', a)), [])
+            self.assertEqual(list(graph.follows._entries[('followed', a.id)][1]), [])
+        finally:
+            graph.follows.mode = TestConfig.FOLLOW_GRAPH
+            graph.follows.clear()
+        self.assertEqual(db.session.scalar(select(func.count()).select_from(followers)), 0)
+        self.assertEqual(Timeline.query.filter(
+            (Timeline.user_id == b.id) | (Timeline.author_id == b.id)).count(), 0)
+        self.assertTrue(a.suggestions_stale and c.suggestions_stale)
+
+    def test_users_collection_query_count(self):
+        users = [User(username='u{}'.format(i), email='u{}@example.com'.format(i))
+                 for i in range(10)]
+        db.session.add_all(users)
+        db.session.commit()
+        users[0].follow(users[1])
+        db.session.commit()
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        db.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            data = User.to_collection(10)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(len(data['items']), 10)
+        self.assertEqual(len(statements), 1)
+
+    def test_server_timing(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        response = self.client.get('/api/users', headers=self.token_headers(u))
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[0-9.]+;desc="\d+ queries"')
+        self.assertIn('total;dur=', timing)
+
+    def test_slow_request_is_logged(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        headers = self.token_headers(u)
+        threshold = app.config['SLOW_REQUEST_QUERIES']
+        app.config['SLOW_REQUEST_QUERIES'] = 0
+        try:
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                self.client.get('/api/users', headers=headers)
+        finally:
+            app.config['SLOW_REQUEST_QUERIES'] = threshold
+        self.assertIn('slow request GET /api/users', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_metrics(self):
+        registry.clear()
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        headers = self.token_headers(u)
+        self.client.get('/api/users', headers=headers)
+        self.client.get('/api/users', headers=headers)
+        self.client.get('/api/users/999', headers=headers)
+        response = self.client.get('/metrics')
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('microblog_http_requests_total{endpoint="api.get_users",'
+                      'method="GET",status="200"} 2', text)
+        self.assertIn('microblog_http_request_duration_seconds_bucket{'
+                      'endpoint="api.get_users",method="GET",le="+Inf"} 2', text)
+        self.assertIn('microblog_errors_total{handler="not_found_error",'
+                      'status="404"} 1', text)
+        self.assertIn('microblog_mail_queue{status="pending"} 0', text)
+        self.assertIn('# TYPE microblog_token_cache_hit_ratio gauge', text)
+
+    def test_metrics_aggregate_worker_files(self):
+        registry.clear()
+        registry.inc('microblog_errors_total', handler='unauthorized', status='403')
+        directory = tempfile.mkdtemp()
+        app.config['METRICS_DIR'] = directory
+        try:
+            # Stand eines bereits beendeten Workers
+            with open(os.path.join(directory, '99999999.json'), 'w') as f:
+                json.dump({'pid': 99999999,
+                           'counters': [['microblog_errors_total',
+                                         [['handler', 'unauthorized'],
+                                          ['status', '403']], 2]],
+                           'histograms': [],
+                           'gauges': [['microblog_db_pool_size',
+                                       [['pid', '99999999']], 5]]}, f)
+            counters, histograms, gauges = collect()
+            self.assertTrue(os.path.exists(os.path.join(
+                directory, '{}.json'.format(os.getpid()))))
+        finally:
+            app.config['METRICS_DIR'] = None
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+            os.rmdir(directory)
+        key = ('microblog_errors_total', (('handler', 'unauthorized'),
+                                          ('status', '403')))
+        self.assertEqual(counters[key], 3)
+        self.assertNotIn(('microblog_db_pool_size', (('pid', '99999999'),)), gauges)
+
+    def test_user_posts_collection_is_paginated(self):
+        u = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        db.session.add_all([Post(body='post {}'.format(i), author=u,
+                                 timestamp=now + timedelta(seconds=i))
+                            for i in range(3)])
+        db.session.commit()
+        headers = self.token_headers(u)
+        data = self.client.get('/api/users/{}/posts?limit=2'.format(u.id),
+                               headers=headers).get_json()
+        self.assertEqual([p['body'] for p in data['items']], ['post 2', 'post 1'])
+        data = self.client.get(data['_links']['next'], headers=headers).get_json()
+        self.assertEqual([p['body'] for p in data['items']], ['post 0'])
+        self.assertIsNone(data['_links']['next'])
+
+
+    def test_suggest_users(self):
+        john = User(username='john', email='jj@example.com')
+        db.session.add_all([john, User(username='mary', email='mary@example.com')])
+        db.session.commit()
+        headers = self.token_headers(john)
+        suggest.index.loaded_at = None
+
+        def names(prefix):
+            response = self.client.get('/api/users/suggest?prefix=' + prefix,
+                                       headers=headers)
+            return [item['username'] for item in response.get_json()['items']]
+
+        self.assertEqual(names('J'), ['john'])
+        # only id, username and avatar; email addresses are not searchable
+        self.assertEqual(names('mary@'), [])
+        item = self.client.get('/api/users/suggest?prefix=ma',
+                               headers=headers).get_json()['items'][0]
+        self.assertEqual(sorted(item), ['avatar', 'id', 'username'])
+        # the index follows register, profile edit and delete after commit
+        db.session.add(User(username='joe', email='joe@example.com'))
+        john.username = 'johnny'
+        db.session.commit()
+        self.assertEqual(names('jo'), ['joe', 'johnny'])
+        db.session.delete(User.query.filter_by(username='mary').first())
+        db.session.commit()
+        self.assertEqual(names('m'), [])
+        response = self.client.get('/api/users/suggest?prefix=j')
+        self.assertEqual(response.status_code, 401)
+
+        # after SUGGEST_INDEX_TTL: reloaded in the background, the request
+        # still answers from the old index
+        db.session.add(User(username='jim', email='jim@example.com'))
+        db.session.commit()
+        suggest.index.remove(User.query.filter_by(username='jim').first().id)
+        suggest.index.loaded_at -= app.config['SUGGEST_INDEX_TTL'] + 1
+        self.assertEqual(names('ji'), [])
+        with suggest._loading:
+            self.assertEqual(names('ji'), ['jim'])
+
+
+    def test_export(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        for i in range(5):
+            db.session.add(Post(body='post {}\nline'.format(i), author=u,
+                                timestamp=datetime(2024, 1, 1 + i)))
+        db.session.commit()
+        headers = self.token_headers(u)
+        app.config['EXPORT_CHUNK_SIZE'] = 2
+        try:
+            response = self.client.get('/api/export/posts', headers=headers)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            self.assertTrue(response.is_streamed)
+            rows = [json.loads(line) for line in response.data.splitlines()]
+            self.assertEqual([r['body'] for r in rows],
+                             ['post {}\nline'.format(i) for i in range(5)])
+
+            # inkrementell ab der dritten Zeile, gzip auf Wunsch
+            response = self.client.get(
+                '/api/export/posts?since={}&since_id={}'.format(rows[2]['timestamp'],
+                                                               rows[2]['id']),
+                headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual([json.loads(line)['id'] for line in
+                              gzip.decompress(response.data).splitlines()], [4, 5])
+            # ohne since_id einschließlich des Zeitstempels
+            data = self.client.get('/api/export/posts?since=' + rows[2]['timestamp'],
+                                   headers=headers).data
+            self.assertEqual([json.loads(line)['id'] for line in data.splitlines()],
+                             [3, 4, 5])
+        finally:
+            app.config['EXPORT_CHUNK_SIZE'] = TestConfig.EXPORT_CHUNK_SIZE
+
+        data = self.client.get('/api/export/users', headers=headers).data
+        self.assertEqual(json.loads(data)['post_count'], 5)
+        self.assertNotIn('email', json.loads(data))
+        response = self.client.get('/api/export/posts?since=yesterday', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/export/posts?since_id=x', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'posts.ndjson.gz')
+            result = app.test_cli_runner().invoke(
+                args=['export', 'posts', '--gzip', '-o', path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with gzip.open(path) as f:
+                self.assertEqual(len(f.read().splitlines()), 5)
+
+    def test_export_cursor(self):
+        u = User(username='john', email='john@example.com')
+        # vor der Migration angelegt: profile_updated ist NULL
+        old = User(username='old', email='old@example.com')
+        db.session.add_all([u, old])
+        db.session.commit()
+        db.session.execute(db.update(User).where(User.id == old.id)
+                           .values(profile_updated=None))
+        timestamp = datetime(2024, 1, 1)
+        db.session.add_all([Post(body='post {}'.format(i), author=u, timestamp=timestamp)
+                            for i in range(4)])
+        db.session.commit()
+        app.config['EXPORT_CHUNK_SIZE'] = 2
+        try:
+            # gleiche Zeitstempel: Abbruch nach jeweils zwei Zeilen verliert nichts
+            exported, since, since_id = [], None, None
+            for i in range(3):
+                rows = [json.loads(line) for line in
+                        next(ndjson('posts', since, since_id), '').splitlines()]
+                if rows:
+                    since = parse_timestamp(rows[-1]['timestamp'])
+                    since_id = rows[-1]['id']
+                exported += [r['body'] for r in rows]
+        finally:
+            app.config['EXPORT_CHUNK_SIZE'] = TestConfig.EXPORT_CHUNK_SIZE
+        self.assertEqual(exported, ['post {}'.format(i) for i in range(4)])
+
+        # die Migration setzt profile_updated, danach kommt der User inkrementell
+        since = u.profile_updated
+        db.session.execute(db.update(User).where(User.profile_updated.is_(None))
+                           .values(profile_updated=datetime.utcnow()))
+        db.session.commit()
+        rows = [json.loads(line) for line in ''.join(ndjson('users', since, u.id)).splitlines()]
+        self.assertEqual([r['username'] for r in rows], ['old'])
+
+    def test_token_cache(self):
+        admin = User(username='admin', email='admin@example.com')
+        admin.set_password('cat')
+        db.session.add(admin)
+        db.session.commit()
+        headers = self.token_headers(admin)
+        hits = tokens.cache.hits
+        for i in range(3):
+            self.assertEqual(self.client.get('/api/users', headers=headers).status_code, 200)
+        self.assertEqual(tokens.cache.hits - hits, 2)
+        stats = self.client.get('/api/tokens/cache', headers=headers).get_json()
+        self.assertEqual(stats['size'], 1)
+
+        # revoking invalidates the cached token immediately
+        self.assertEqual(self.client.delete('/api/tokens', headers=headers).status_code, 204)
+        self.assertEqual(self.client.get('/api/users', headers=headers).status_code, 401)
+
+        # rotation through get_token drops the old token as well
+        admin.token_expiration = datetime.utcnow() + timedelta(seconds=30)
+        db.session.commit()
+        old = admin.token
+        self.assertEqual(self.client.get('/api/users', headers=headers).status_code, 200)
+        new = admin.get_token()
+        db.session.commit()
+        self.assertNotEqual(old, new)
+        self.assertEqual(self.client.get('/api/users', headers=headers).status_code, 401)
+
+    def test_token_cache_after_commit(self):
+        admin = User(username='admin', email='admin@example.com')
+        db.session.add(admin)
+        db.session.commit()
+        token = admin.get_token()
+        db.session.commit()
+        tokens.cache.put(token, admin.id, admin.token_expiration)
+        # vor dem Commit kann ein anderer Request den Token noch eintragen
+        admin.revoke_token()
+        self.assertEqual(tokens.cache.get(token), admin.id)
+        db.session.rollback()
+        self.assertEqual(tokens.cache.get(token), admin.id)
+        admin.revoke_token()
+        db.session.commit()
+        self.assertIsNone(tokens.cache.get(token))
+
+    def test_cached_token_of_deleted_user(self):
+        admin = User(username='admin', email='admin@example.com')
+        mary = User(username='mary', email='mary@example.com')
+        db.session.add_all([admin, mary])
+        db.session.commit()
+        headers = self.token_headers(mary)
+        token, admin_id = mary.token, admin.id
+        self.assertEqual(self.client.get('/api/users/{}'.format(mary.id),
+                                         headers=headers).status_code, 200)
+        self.assertIsNotNone(tokens.cache.get(token))
+        # an einem anderen Worker gelöscht: der Cache hier kennt den Token noch
+        db.session.execute(followers.delete())
+        db.session.execute(User.__table__.delete().where(User.id == mary.id))
+        db.session.commit()
+        db.session.expunge_all()
+        response = self.client.delete('/api/tokens', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response.headers)
+        self.assertIsNone(tokens.cache.get(token))
+        # im selben Prozess gelöscht: sofort aus dem Cache
+        admin = db.session.get(User, admin_id)
+        admin_token = admin.get_token()
+        db.session.commit()
+        tokens.cache.put(admin_token, admin.id, admin.token_expiration)
+        db.session.delete(admin)
+        db.session.commit()
+        self.assertIsNone(tokens.cache.get(admin_token))
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
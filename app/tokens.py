@@ -0,0 +1,81 @@
+# app/tokens.py
+"""Prozesslokaler Cache für API-Tokens: token -> (user_id, Ablaufdatum).
+
+Einträge leben höchstens TOKEN_CACHE_TTL Sekunden und nie länger als der
+Token selbst. revoke_token, die Rotation in get_token und das Löschen eines
+Users merken den alten Token vor (record); er verlässt den Cache dieses
+Prozesses erst nach dem Commit, sonst könnte ein gleichzeitiger Request den
+noch gültigen Stand aus der Datenbank wieder eintragen. Andere Worker sehen
+die Änderung spätestens nach Ablauf der TTL.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+
+
+class TokenCache(object):
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = timedelta(seconds=ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def init_app(self, app):
+        self.maxsize = app.config['TOKEN_CACHE_SIZE']
+        self.ttl = timedelta(seconds=app.config['TOKEN_CACHE_TTL'])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        """Liefert die user_id zum Token oder None."""
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def put(self, token, user_id, expiration):
+        valid_until = min(expiration, datetime.utcnow() + self.ttl)
+        with self._lock:
+            self._entries[token] = (user_id, valid_until)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize,
+                'hit_ratio': self.hits / lookups if lookups else None}
+
+
+cache = TokenCache()
+
+
+def record(session, token):
+    """Merkt einen ungültigen Token vor, aus dem Cache nach dem Commit."""
+    if token:
+        session.info.setdefault('revoked_tokens', []).append(token)
+
+
+def committed(session):
+    for token in session.info.pop('revoked_tokens', ()):
+        cache.invalidate(token)
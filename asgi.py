@@ -0,0 +1,6 @@
+from app import create_app
+from app.asgi import AsyncApi
+
+# Lesende API-Endpunkte und Live-Timeline über ASGI, z.B. uvicorn asgi:application
+# (app/asgi.py, app/stream.py)
+application = AsyncApi(create_app())
@@ -0,0 +1,27 @@
+"""Benchmarks für die heißen Pfade von Microblog.
+
+    python -m benchmarks run --users 1000 --posts 20000 --output before.json
+    python -m benchmarks run --output after.json
+    python -m benchmarks compare before.json after.json
+
+``run`` legt eine eigene SQLite-Datenbank an (oder nutzt --database), füllt
+sie per Bulk-Insert mit Usern, einem Power-Law-Followergraphen und Posts
+(siehe seed.py) und misst die Szenarien in scenarios.py über den Flask
+Test-Client. Ergebnisse: p50/p95/p99 in ms und SQL-Queries pro Request.
+
+    python -m benchmarks startup --repeat 20 --output startup.json
+
+``startup`` misst den Kaltstart eines Workers (Import, create_app(), erster
+Request) in frischen Interpretern, siehe startup.py.
+
+    python -m benchmarks bulk --posts 5000 --follows 2000
+
+``bulk`` vergleicht den Massenimport (app/bulk.py) mit einzelnen Writes,
+in Zeilen pro Sekunde, siehe bulk.py.
+
+    python -m benchmarks concurrency --concurrency 10 --concurrency 100 --latency 5
+
+``concurrency`` vergleicht den Durchsatz der lesenden API bei vielen
+gleichzeitigen Verbindungen über WSGI und über app/asgi.py, siehe
+concurrency.py.
+"""
@@ -0,0 +1,261 @@
+# benchmarks/__main__.py
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+
+def run(args):
+    # DATABASE_URL muss vor dem Import von app gesetzt sein (config.py)
+    path = None
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    else:
+        fd, path = tempfile.mkstemp(prefix='microblog-bench-', suffix='.db')
+        os.close(fd)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+
+    from app import create_app, db
+    from benchmarks import harness
+    from benchmarks.scenarios import SCENARIOS
+    from benchmarks.seed import seed
+
+    app = create_app(harness.BenchmarkConfig)
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    names = args.scenario or list(SCENARIOS)
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            data = seed(users=args.users, posts=args.posts, follows=args.follows,
+                        alpha=args.alpha, tokens=args.tokens,
+                        random_seed=args.seed)
+            engine = db.engine
+        data['tokens'] = ['benchmark-token-{}'.format(i)
+                          for i in range(1, data['tokens'] + 1)]
+        client = app.test_client()
+        results = {}
+        for name in names:
+            with app.app_context():
+                fn = SCENARIOS[name](client, data)
+            # Requests ohne äußeren App-Kontext, sonst teilen sie sich ``g``
+            results[name] = harness.measure(fn, args.repeat, engine)
+        meta = {k: v for k, v in data.items() if k != 'tokens'}
+        meta['repeat'] = args.repeat
+        output = harness.report(results, meta, engine)
+    finally:
+        if path:
+            os.unlink(path)
+    harness.print_results(results, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    return 0
+
+
+def compare(args):
+    from benchmarks import harness
+    regressions = harness.compare(harness.load(args.before),
+                                  harness.load(args.after), sys.stdout,
+                                  args.threshold)
+    if regressions:
+        print('p95 regressions over {}%: {}'.format(args.threshold,
+                                                   ', '.join(regressions)))
+        return 1
+    return 0
+
+
+def writers(args):
+    from benchmarks import writers
+    results = {mode: writers.run_mode(mode, args.processes, args.threads,
+                                      args.writes)
+               for mode in args.mode or list(writers.MODES)}
+    writers.print_results(results, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'processes': args.processes,
+                                'threads': args.threads, 'writes': args.writes},
+                       'results': results}, f, indent=2)
+    return 0
+
+
+def writers_setup(args):
+    from benchmarks import writers
+    writers.setup(args.users)
+    return 0
+
+
+def writers_worker(args):
+    from benchmarks import writers
+    writers.worker(args.index, args.threads, args.writes)
+    return 0
+
+
+def bulk(args):
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+        path = None
+    else:
+        fd, path = tempfile.mkstemp(prefix='microblog-bulk-', suffix='.db')
+        os.close(fd)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from benchmarks import bulk
+    try:
+        results = bulk.run(args.users, args.posts, args.follows, args.chunk,
+                           args.seed)
+    finally:
+        if path:
+            os.unlink(path)
+    bulk.print_results(results, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'users': args.users, 'posts': args.posts,
+                                'follows': args.follows, 'chunk': args.chunk},
+                       'results': results}, f, indent=2)
+    return 0
+
+
+def concurrency(args):
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+        path = None
+    else:
+        fd, path = tempfile.mkstemp(prefix='microblog-concurrency-', suffix='.db')
+        os.close(fd)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from benchmarks import concurrency
+    levels = args.concurrency or [1, 10, 100]
+    try:
+        results = concurrency.run(args.users, args.posts, args.follows, levels,
+                                  args.requests, args.threads, args.latency,
+                                  args.seed)
+    finally:
+        if path:
+            os.unlink(path)
+    concurrency.print_results(results, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'users': args.users, 'posts': args.posts,
+                                'requests': args.requests, 'threads': args.threads,
+                                'latency_ms': args.latency},
+                       'results': results}, f, indent=2)
+    return 0
+
+
+def startup(args):
+    import platform
+    from datetime import datetime
+    from benchmarks import harness, startup
+    results, meta = startup.run(args.repeat, args.path, args.database)
+    harness.print_results(results, sys.stdout)
+    print('{} modules loaded, alembic {}'.format(
+        meta['modules'], 'loaded' if meta['alembic'] else 'not loaded'))
+    if args.output:
+        meta.update(python=platform.python_version(),
+                    created=datetime.utcnow().isoformat())
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+    return 0
+
+
+def startup_worker(args):
+    from benchmarks import startup
+    startup.worker(args.path)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('run', help='seed a database and time the hot paths')
+    p.add_argument('--users', type=int, default=1000)
+    p.add_argument('--posts', type=int, default=20000)
+    p.add_argument('--follows', type=int, default=20,
+                   help='average number of followed accounts per user')
+    p.add_argument('--alpha', type=float, default=1.2,
+                   help='power-law exponent of the follower distribution')
+    p.add_argument('--tokens', type=int, default=100)
+    p.add_argument('--repeat', type=int, default=200)
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--database', help='database URL (default: temporary SQLite file)')
+    p.add_argument('--scenario', action='append',
+                   help='only run this scenario (repeatable)')
+    p.add_argument('--output', help='write results as JSON')
+    p.set_defaults(func=run)
+
+    p = commands.add_parser('compare', help='compare two JSON result files')
+    p.add_argument('before')
+    p.add_argument('after')
+    p.add_argument('--threshold', type=float, default=10.0,
+                   help='fail if p95 got worse by more than this percentage')
+    p.set_defaults(func=compare)
+
+    p = commands.add_parser('writers', help='SQLite write throughput with '
+                            'concurrent writers (default, production, queue)')
+    p.add_argument('--processes', type=int, default=4)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--writes', type=int, default=50,
+                   help='posts per writer thread')
+    p.add_argument('--mode', action='append',
+                   help='only run this mode (repeatable)')
+    p.add_argument('--output', help='write results as JSON')
+    p.set_defaults(func=writers)
+
+    p = commands.add_parser('bulk', help='bulk import throughput against '
+                            'single writes (posts and follows)')
+    p.add_argument('--users', type=int, default=200)
+    p.add_argument('--posts', type=int, default=5000)
+    p.add_argument('--follows', type=int, default=2000)
+    p.add_argument('--chunk', type=int, default=1000, help='BULK_CHUNK_SIZE')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--database', help='database URL (default: temporary SQLite file)')
+    p.add_argument('--output', help='write results as JSON')
+    p.set_defaults(func=bulk)
+
+    p = commands.add_parser('concurrency', help='read API throughput with many '
+                            'concurrent connections, WSGI against ASGI')
+    p.add_argument('--users', type=int, default=1000)
+    p.add_argument('--posts', type=int, default=20000)
+    p.add_argument('--follows', type=int, default=20)
+    p.add_argument('--concurrency', type=int, action='append',
+                   help='open connections (repeatable, default: 1, 10, 100)')
+    p.add_argument('--requests', type=int, default=2000,
+                   help='requests per concurrency level')
+    p.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+    p.add_argument('--latency', type=float, default=0,
+                   help='extra milliseconds per SQL statement (SQLite only)')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--database', help='database URL (default: temporary SQLite file)')
+    p.add_argument('--output', help='write results as JSON')
+    p.set_defaults(func=concurrency)
+
+    p = commands.add_parser('startup', help='cold start: import, create_app() '
+                            'and first request in fresh interpreters')
+    p.add_argument('--repeat', type=int, default=20)
+    p.add_argument('--path', default='/login', help='URL of the first request')
+    p.add_argument('--database', help='database URL (default: SQLite in memory)')
+    p.add_argument('--output', help='write results as JSON')
+    p.set_defaults(func=startup)
+
+    # intern, von writers/startup in eigenen Prozessen gestartet
+    p = commands.add_parser('writers-setup')
+    p.add_argument('users', type=int)
+    p.set_defaults(func=writers_setup)
+    p = commands.add_parser('writers-worker')
+    p.add_argument('index', type=int)
+    p.add_argument('threads', type=int)
+    p.add_argument('writes', type=int)
+    p.set_defaults(func=writers_worker)
+    p = commands.add_parser('startup-worker')
+    p.add_argument('path')
+    p.set_defaults(func=startup_worker)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# benchmarks/bulk.py
+"""Durchsatz des Massenimports (app/bulk.py) gegen einzelne Writes.
+
+``single`` legt Posts wie create_post einzeln an (Post.publish über
+app.sqlite.writer, ein Commit pro Post) und Follows wie die follow-View
+(User.set_following). ``bulk`` importiert dieselben Daten mit
+import_posts/import_follows in Blöcken von --chunk Einträgen. Jeder Modus
+startet mit einer leeren Datenbank und denselben Usern.
+"""
+import random
+import time
+
+MODES = ('single', 'bulk')
+
+
+def _data(users, posts, follows, random_seed):
+    rng = random.Random(random_seed)
+    post_items = [{'user_id': rng.randint(1, users),
+                   'body': 'bulk post {}'.format(i)} for i in range(posts)]
+    pairs = set()
+    while len(pairs) < min(follows, users * (users - 1)):
+        pair = rng.randint(1, users), rng.randint(1, users)
+        if pair[0] != pair[1]:
+            pairs.add(pair)
+    follow_items = [{'follower_id': a, 'followed_id': b} for a, b in sorted(pairs)]
+    return post_items, follow_items
+
+
+def _load(mode, post_items, follow_items):
+    from app import bulk
+    from app.models import User, Post
+    from app.sqlite import writer
+    timings = {}
+    start = time.perf_counter()
+    if mode == 'single':
+        for item in follow_items:
+            writer.run(User.set_following, item['follower_id'], item['followed_id'])
+    else:
+        bulk.import_follows(follow_items)
+    timings['follows'] = time.perf_counter() - start
+    start = time.perf_counter()
+    if mode == 'single':
+        for item in post_items:
+            writer.run(Post.publish, item['user_id'], item['body'])
+    else:
+        bulk.import_posts(post_items)
+    timings['posts'] = time.perf_counter() - start
+    return timings
+
+
+def run(users, posts, follows, chunk, random_seed=42):
+    """Misst beide Modi auf der Datenbank aus DATABASE_URL (wird geleert)."""
+    from app import create_app, db, search
+    from app.models import User
+    from benchmarks.harness import BenchmarkConfig
+    post_items, follow_items = _data(users, posts, follows, random_seed)
+    app = create_app(BenchmarkConfig)
+    app.config['BULK_CHUNK_SIZE'] = chunk
+    results = {}
+    for mode in MODES:
+        with app.app_context():
+            db.drop_all()
+            search.drop_fts(db.session.connection())
+            db.create_all()
+            db.session.execute(db.insert(User), [
+                {'id': i, 'username': 'bulk{}'.format(i),
+                 'email': 'bulk{}@example.com'.format(i)}
+                for i in range(1, users + 1)])
+            db.session.commit()
+            timings = _load(mode, post_items, follow_items)
+        results[mode] = {
+            'posts': len(post_items),
+            'follows': len(follow_items),
+            'posts_per_second': round(len(post_items) / timings['posts'], 1),
+            'follows_per_second': round(len(follow_items) / timings['follows'], 1),
+        }
+    return results
+
+
+def print_results(results, out):
+    out.write('{:<8} {:>8} {:>10} {:>8} {:>10}\n'.format(
+        'mode', 'posts', 'posts/s', 'follows', 'follows/s'))
+    for mode, r in results.items():
+        out.write('{:<8} {:>8} {:>10.1f} {:>8} {:>10.1f}\n'.format(
+            mode, r['posts'], r['posts_per_second'], r['follows'],
+            r['follows_per_second']))
@@ -0,0 +1,183 @@
+# benchmarks/concurrency.py
+"""Durchsatz der lesenden API bei vielen gleichzeitigen Verbindungen.
+
+``wsgi`` ruft die Flask-App wie ein Server mit --threads Threads auf
+(gunicorn --threads), ``asgi`` die Coroutine aus app/asgi.py auf einer
+Event-Loop. Beide laufen im selben Prozess ohne HTTP-Server auf derselben,
+mit seed.py gefüllten SQLite-Datei und mit demselben Client: pro Stufe
+--concurrency Verbindungen, die nacheinander Requests an die sechs lesenden
+Endpunkte schicken, zusammen --requests. Gemessen werden Requests/s und die
+Latenz ab dem Absenden (inklusive Warten auf einen freien Thread).
+
+--latency verzögert jedes SQL-Statement um so viele Millisekunden, und zwar
+im Thread der Datenbankverbindung (SQLite-Trace-Callback; bei aiosqlite ist
+das dessen Verbindungs-Thread, nicht die Event-Loop). So verhält sich eine
+langsame Datenbank im Netz: ein WSGI-Thread wartet mit, die Event-Loop
+nicht. Ohne --latency zählt nur der CPU-Aufwand pro Request.
+
+``asgi`` braucht aiosqlite und wird sonst übersprungen.
+"""
+import asyncio
+import importlib.util
+import io
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from benchmarks.harness import percentile
+
+MODES = ('wsgi', 'asgi')
+
+
+def _requests(data, count, random_seed):
+    # (Pfad, Query, Token) über die sechs Endpunkte, zufällige User und Tokens
+    rng = random.Random(random_seed)
+    users = data['users']
+    paths = [
+        lambda: ('/api/users', 'limit=25'),
+        lambda: ('/api/users/{}'.format(rng.randint(1, users)), ''),
+        lambda: ('/api/users/{}/followers'.format(rng.randint(1, users)), 'limit=25'),
+        lambda: ('/api/users/{}/followed'.format(rng.randint(1, users)), 'limit=25'),
+        lambda: ('/api/users/{}/posts'.format(rng.randint(1, users)), 'limit=25'),
+        lambda: ('/api/posts', 'limit=25'),
+    ]
+    return [paths[i % len(paths)]() + (rng.choice(data['tokens']),)
+            for i in range(count)]
+
+
+def _delay(engine, latency):
+    from app import db
+
+    def sleep(statement):
+        time.sleep(latency / 1000.0)
+
+    @db.event.listens_for(engine, 'connect')
+    def trace(dbapi_connection, connection_record):
+        if hasattr(dbapi_connection, 'await_'):
+            # aiosqlite: der Callback läuft im Thread der Verbindung
+            dbapi_connection.await_(dbapi_connection._connection.set_trace_callback(sleep))
+        else:
+            dbapi_connection.set_trace_callback(sleep)
+
+
+async def _clients(call, requests, concurrency):
+    """Schickt requests über concurrency Verbindungen; Latenzen in ms."""
+    pending = iter(requests)
+    timings = []
+
+    async def client():
+        for request in pending:
+            start = time.perf_counter()
+            status = await call(*request)
+            if status != 200:
+                raise RuntimeError('{} {}'.format(status, request[0]))
+            timings.append((time.perf_counter() - start) * 1000.0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for i in range(concurrency)])
+    return timings, time.perf_counter() - start
+
+
+def _wsgi(app, threads):
+    pool = ThreadPoolExecutor(threads)
+    server_name = app.config.get('SERVER_NAME') or 'localhost'
+
+    def handle(environ):
+        app_iter, status, headers = run_wsgi_app(app.wsgi_app, environ)
+        b''.join(app_iter)
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+        return int(status.split()[0])
+
+    async def call(path, query, token):
+        environ = EnvironBuilder(path=path, query_string=query,
+                                 base_url='http://' + server_name,
+                                 headers={'Authorization': 'Bearer ' + token}).get_environ()
+        environ['wsgi.input'] = io.BytesIO()
+        return await asyncio.get_running_loop().run_in_executor(pool, handle, environ)
+
+    async def close():
+        pool.shutdown()
+    return call, close
+
+
+def _asgi(api, server_name):
+    host, _, port = server_name.partition(':')
+
+    async def call(path, query, token):
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': query.encode(), 'server': (host, int(port or 80)),
+                 'headers': [(b'host', server_name.encode()),
+                             (b'authorization', 'Bearer {}'.format(token).encode())]}
+        status = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+        await api(scope, None, send)
+        return status[0]
+    return call
+
+
+def run(users, posts, follows, levels, count, threads, latency, random_seed=42):
+    """Misst beide Modi auf der Datenbank aus DATABASE_URL (wird neu gefüllt)."""
+    from app import create_app, db
+    from benchmarks.harness import BenchmarkConfig
+    from benchmarks.seed import seed
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        data = seed(users=users, posts=posts, follows=follows, tokens=min(users, 100),
+                    random_seed=random_seed)
+        engine = db.engine
+    data['tokens'] = ['benchmark-token-{}'.format(i) for i in range(1, data['tokens'] + 1)]
+    requests = _requests(data, count, random_seed)
+    server_name = app.config.get('SERVER_NAME') or 'localhost'
+    results = {}
+    for mode in MODES:
+        if mode == 'asgi' and importlib.util.find_spec('aiosqlite') is None:
+            results[mode] = None
+            continue
+        if mode == 'wsgi':
+            call, close = _wsgi(app, threads)
+            if latency:
+                engine.dispose()
+                _delay(engine, latency)
+        else:
+            from app.asgi import AsyncApi
+            api = AsyncApi(app)
+            if latency:
+                _delay(api.engine.sync_engine, latency)
+            call, close = _asgi(api, server_name), api.engine.dispose
+        results[mode] = asyncio.run(_levels(call, close, requests, levels))
+    return results
+
+
+async def _levels(call, close, requests, levels):
+    # eine Event-Loop pro Modus: die Verbindungen der async Engine gehören zu ihr
+    results = {}
+    for concurrency in levels:
+        # Aufwärmen: Verbindungen öffnen, Token-Cache füllen
+        await _clients(call, requests[:concurrency], concurrency)
+        timings, elapsed = await _clients(call, requests, concurrency)
+        results[concurrency] = {
+            'requests': len(timings),
+            'requests_per_second': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+        }
+    await close()
+    return results
+
+
+def print_results(results, out):
+    out.write('{:<6} {:>11} {:>10} {:>10} {:>10}\n'.format(
+        'mode', 'concurrency', 'req/s', 'p50 ms', 'p95 ms'))
+    for mode, levels in results.items():
+        if levels is None:
+            out.write('{:<6} skipped (needs aiosqlite)\n'.format(mode))
+            continue
+        for concurrency, r in levels.items():
+            out.write('{:<6} {:>11} {:>10.1f} {:>10.3f} {:>10.3f}\n'.format(
+                mode, concurrency, r['requests_per_second'], r['p50_ms'], r['p95_ms']))
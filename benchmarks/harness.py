@@ -0,0 +1,106 @@
+# benchmarks/harness.py
+import json
+import math
+import platform
+import time
+from datetime import datetime
+import sqlalchemy
+from app import db
+from config import Config
+
+
+class BenchmarkConfig(Config):
+    # wie in Produktion, aber ohne logs/microblog.log (im Repository)
+    LOG_FILE = None
+
+
+class QueryCounter(object):
+    """Zählt die SQL-Statements, die über engine laufen."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        db.event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        db.event.remove(self.engine, 'before_cursor_execute', self._count)
+
+
+def percentile(values, q):
+    # Nearest-rank auf der sortierten Liste
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def measure(fn, repeat, engine, warmup=3):
+    """Ruft fn(i) repeat-mal auf und liefert Latenzen (ms) und Queries."""
+    for i in range(warmup):
+        fn(i)
+    timings = []
+    with QueryCounter(engine) as queries:
+        for i in range(repeat):
+            start = time.perf_counter()
+            fn(i)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    return {
+        'count': repeat,
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'queries': round(queries.count / repeat, 2)
+    }
+
+
+def report(results, meta, engine):
+    return {
+        'meta': dict(meta, python=platform.python_version(),
+                     sqlalchemy=sqlalchemy.__version__,
+                     database=engine.dialect.name,
+                     created=datetime.utcnow().isoformat()),
+        'results': results
+    }
+
+
+def print_results(results, out):
+    out.write('{:<20} {:>9} {:>9} {:>9} {:>9}\n'.format(
+        'scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+    for name, r in results.items():
+        out.write('{:<20} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}\n'.format(
+            name, r['p50_ms'], r['p95_ms'], r['p99_ms'], r['queries']))
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(before, after, out, threshold=10.0):
+    """Vergleicht zwei Läufe; liefert die Szenarien, deren p95 um mehr als
+    threshold Prozent schlechter geworden ist."""
+    def change(old, new):
+        return (new - old) / old * 100.0 if old else 0.0
+
+    regressions = []
+    out.write('{:<20} {:>18} {:>18} {:>14}\n'.format(
+        'scenario', 'p50 ms', 'p95 ms', 'queries'))
+    for name, new in after['results'].items():
+        old = before['results'].get(name)
+        if old is None:
+            out.write('{:<20} (new)\n'.format(name))
+            continue
+        p95 = change(old['p95_ms'], new['p95_ms'])
+        out.write('{:<20} {:>9.2f} {:>+7.1f}% {:>9.2f} {:>+7.1f}% {:>7.2f} {:>+6.2f}\n'.format(
+            name, new['p50_ms'], change(old['p50_ms'], new['p50_ms']),
+            new['p95_ms'], p95, new['queries'], new['queries'] - old['queries']))
+        if p95 > threshold:
+            regressions.append(name)
+    return regressions
@@ -0,0 +1,133 @@
+# benchmarks/scenarios.py
+"""Gemessene Szenarien. Jedes liefert eine Funktion fn(i) für einen Request.
+
+Web-Szenarien melden sich über die Session an (kein Passwort-Hashing pro
+Request), API-Szenarien nutzen die vorab vergebenen Tokens aus seed.py.
+"""
+import random
+import re
+from app import db
+from app.models import User
+from benchmarks.seed import WORDS
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(f):
+        SCENARIOS[name] = f
+        return f
+    return register
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def check(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError('{} {} -> {}'.format(
+            response.request.method, response.request.path, response.status_code))
+    return response
+
+
+def heavy_readers(count):
+    # User mit den meisten gefolgten Accounts, dort ist die Timeline am teuersten
+    return db.session.scalars(db.select(User.id)
+                              .order_by(User.followed_count.desc())
+                              .limit(count)).all()
+
+
+def celebrities(count):
+    return db.session.scalars(db.select(User.id)
+                              .order_by(User.follower_count.desc())
+                              .limit(count)).all()
+
+
+def auth(data, i):
+    token = data['tokens'][i % len(data['tokens'])]
+    return {'Authorization': 'Bearer ' + token}
+
+
+@scenario('index')
+def index(client, data):
+    readers = heavy_readers(20)
+
+    def run(i):
+        login(client, readers[i % len(readers)])
+        check(client.get('/index'))
+    return run
+
+
+@scenario('index_page2')
+def index_page2(client, data):
+    readers = heavy_readers(20)
+    older = re.compile(r'<li class="next">\s*<a href="([^"]+)"')
+
+    def run(i):
+        login(client, readers[i % len(readers)])
+        match = older.search(check(client.get('/index')).get_data(as_text=True))
+        if match:
+            check(client.get(match.group(1).replace('&amp;', '&')))
+    return run
+
+
+@scenario('explore')
+def explore(client, data):
+    def run(i):
+        login(client, 1)
+        check(client.get('/explore'))
+    return run
+
+
+@scenario('explore_search')
+def explore_search(client, data):
+    rng = random.Random(1)
+    terms = [' '.join(rng.sample(WORDS, rng.randint(1, 2))) for i in range(50)]
+
+    def run(i):
+        login(client, 1)
+        check(client.get('/explore', query_string={'search': terms[i % len(terms)]}))
+    return run
+
+
+@scenario('api_users')
+def api_users(client, data):
+    def run(i):
+        check(client.get('/api/users', query_string={'limit': 50},
+                         headers=auth(data, i)))
+    return run
+
+
+@scenario('api_followers')
+def api_followers(client, data):
+    users = celebrities(10)
+
+    def run(i):
+        check(client.get('/api/users/{}/followers'.format(users[i % len(users)]),
+                         query_string={'limit': 50}, headers=auth(data, i)))
+    return run
+
+
+@scenario('token_auth')
+def token_auth(client, data):
+    def run(i):
+        check(client.get('/api/users/{}'.format(i % data['users'] + 1),
+                         headers=auth(data, i)))
+    return run
+
+
+@scenario('follow_unfollow')
+def follow_unfollow(client, data):
+    users = celebrities(10)
+    rng = random.Random(2)
+    readers = rng.sample(range(1, data['users'] + 1), min(50, data['users']))
+
+    def run(i):
+        login(client, readers[i % len(readers)])
+        username = 'user{}'.format(users[i % len(users)])
+        check(client.post('/follow/' + username), 302)
+        check(client.post('/unfollow/' + username), 302)
+    return run
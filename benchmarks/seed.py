@@ -0,0 +1,106 @@
+# benchmarks/seed.py
+"""Synthetische Testdaten: User, Power-Law-Followergraph und Posts.
+
+Alles läuft über ``session.execute(insert(...), rows)`` (executemany), also
+ohne ORM-Events; Zähler, Suchindex und Timelines werden danach mengenbasiert
+nachgezogen.
+"""
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+from flask import current_app
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+from app import db, search
+from app.models import User, Post, Timeline, followers
+
+PASSWORD = 'benchmark'
+
+WORDS = ('flask python sqlite index query cache timeline follow post user '
+         'token search api json fast slow latency python3 graph bulk insert '
+         'commit page cursor server worker queue mail login hello world '
+         'coffee weekend music travel photo summer winter news update').split()
+
+
+def chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def zipf_weights(n, alpha):
+    return list(accumulate(1.0 / (rank + 1) ** alpha for rank in range(n)))
+
+
+def follower_graph(rng, users, follows, alpha):
+    """Liefert {(follower_id, followed_id)} mit Power-Law-Verteilung.
+
+    Wenige Accounts sammeln die meisten Follower; die Anzahl gefolgter
+    Accounts pro User ist Pareto-verteilt mit Mittelwert ~follows.
+    """
+    ids = list(range(1, users + 1))
+    popular = ids[:]
+    rng.shuffle(popular)
+    weights = zipf_weights(users, alpha)
+    edges = set()
+    for follower in ids:
+        count = min(users - 1, int(rng.paretovariate(2.0) * follows / 2))
+        for followed in rng.choices(popular, cum_weights=weights, k=count):
+            if followed != follower:
+                edges.add((follower, followed))
+    return edges
+
+
+def seed(users=1000, posts=20000, follows=20, alpha=1.2, tokens=100,
+         random_seed=42, batch_size=5000):
+    """Füllt die (leere) Datenbank und liefert eine Zusammenfassung."""
+    rng = random.Random(random_seed)
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(
+        PASSWORD, current_app.config['PASSWORD_HASH_METHOD'],
+        current_app.config['PASSWORD_SALT_LENGTH'])
+
+    user_rows = [{'id': i, 'username': 'user{}'.format(i),
+                  'email': 'user{}@example.com'.format(i),
+                  'password_hash': password_hash,
+                  'about_me': 'benchmark user {}'.format(i),
+                  'last_seen': now}
+                 for i in range(1, users + 1)]
+    for row in user_rows[:tokens]:
+        row['token'] = 'benchmark-token-{}'.format(row['id'])
+        row['token_expiration'] = now + timedelta(days=1)
+    for chunk in chunks(user_rows, batch_size):
+        db.session.execute(insert(User), chunk)
+
+    edges = sorted(follower_graph(rng, users, follows, alpha))
+    for chunk in chunks(edges, batch_size):
+        db.session.execute(insert(followers), [
+            {'follower_id': a, 'followed_id': b} for a, b in chunk])
+
+    # Aktive User posten mehr (ebenfalls Zipf), Zeitstempel über 90 Tage
+    authors = list(range(1, users + 1))
+    rng.shuffle(authors)
+    author_weights = zipf_weights(users, 1.0)
+    word_weights = zipf_weights(len(WORDS), 1.0)
+    post_rows = [{'id': i,
+                  'body': ' '.join(rng.choices(WORDS, cum_weights=word_weights,
+                                               k=rng.randint(3, 15)))[:140],
+                  'timestamp': now - timedelta(seconds=rng.randint(0, 90 * 86400)),
+                  'user_id': rng.choices(authors, cum_weights=author_weights)[0]}
+                 for i in range(1, posts + 1)]
+    for chunk in chunks(post_rows, batch_size):
+        db.session.execute(insert(Post), chunk)
+
+    User.repair_counters()
+    connection = db.session.connection()
+    search.reindex(connection)
+    # Timelines: eigene Posts plus Posts gefolgter Nicht-Prominenter
+    db.session.execute(Timeline._insert(
+        select(Post.user_id, Post.id, Post.user_id, Post.timestamp)))
+    db.session.execute(Timeline._insert(
+        select(followers.c.follower_id, Post.id, Post.user_id, Post.timestamp)
+        .join(followers, followers.c.followed_id == Post.user_id)
+        .join(User, User.id == Post.user_id)
+        .where(User.follower_count <= current_app.config['TIMELINE_FANOUT_THRESHOLD'])))
+    db.session.commit()
+    return {'users': users, 'posts': posts, 'follows': len(edges),
+            'alpha': alpha, 'tokens': min(tokens, users), 'seed': random_seed}
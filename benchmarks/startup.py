@@ -0,0 +1,72 @@
+# benchmarks/startup.py
+"""Kaltstart eines Workers: Import von app, create_app() und erster Request.
+
+Jede Messung läuft in einem frischen Interpreter (``startup-worker``), sonst
+wären die Module nach dem ersten Durchlauf schon geladen. ``process`` ist die
+Wandzeit des ganzen Kindprozesses inklusive Interpreterstart. Die Ergebnisse
+haben dasselbe Format wie bei ``run`` und lassen sich mit ``compare``
+vergleichen.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+PHASES = ('import', 'create_app', 'first_request', 'total', 'process')
+
+
+def worker(path):
+    """Misst einen Kaltstart und gibt die Zeiten (Sekunden) als JSON aus."""
+    start = time.perf_counter()
+    from app import create_app, db
+    imported = time.perf_counter()
+    from benchmarks.harness import BenchmarkConfig, QueryCounter
+    configured = time.perf_counter()
+    app = create_app(BenchmarkConfig)
+    created = time.perf_counter()
+    with app.app_context():
+        engine = db.engine
+    client = app.test_client()
+    requested = time.perf_counter()
+    with QueryCounter(engine) as queries:
+        status = client.get(path).status_code
+    done = time.perf_counter()
+    print(json.dumps({
+        'import': imported - start,
+        'create_app': created - configured,
+        'first_request': done - requested,
+        'total': (imported - start) + (created - configured) + (done - requested),
+        'queries': queries.count,
+        'status': status,
+        'modules': len(sys.modules),
+        'alembic': 'alembic' in sys.modules,
+    }))
+
+
+def run(repeat, path, database=None):
+    from benchmarks.harness import percentile
+    env = dict(os.environ, DATABASE_URL=database or 'sqlite://')
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-m', 'benchmarks', 'startup-worker',
+                                 path], env=env, check=True, text=True,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        sample = json.loads(output)
+        sample['process'] = time.perf_counter() - start
+        samples.append(sample)
+    results = {}
+    for phase in PHASES:
+        timings = [s[phase] * 1000.0 for s in samples]
+        results[phase] = {
+            'count': repeat,
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'queries': samples[0]['queries'] if phase == 'first_request' else 0,
+        }
+    meta = {'path': path, 'repeat': repeat, 'status': samples[0]['status'],
+            'modules': samples[0]['modules'], 'alembic': samples[0]['alembic']}
+    return results, meta
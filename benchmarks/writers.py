@@ -0,0 +1,114 @@
+# benchmarks/writers.py
+"""Schreibdurchsatz mit vielen gleichzeitigen Writern auf einer SQLite-Datei.
+
+Für jeden Modus (default, production, queue) wird eine frische Datenbank
+angelegt und mit --processes Prozessen zu je --threads Threads beschrieben
+(Post.publish über app.sqlite.writer, wie in den Views). Jeder Modus läuft
+in eigenen Prozessen, weil config.py die Umgebung beim Import liest.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = {
+    'default': {},
+    'production': {'SQLITE_PRODUCTION': '1'},
+    'queue': {'SQLITE_PRODUCTION': '1', 'SQLITE_WRITE_QUEUE': '1'},
+}
+
+
+def _python(args, env):
+    return subprocess.Popen([sys.executable, '-m', 'benchmarks'] + args, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            text=True)
+
+
+def setup(users):
+    from app import create_app, db
+    from app.models import User
+    from benchmarks.harness import BenchmarkConfig
+    with create_app(BenchmarkConfig).app_context():
+        db.create_all()
+        db.session.execute(db.insert(User), [
+            {'id': i, 'username': 'writer{}'.format(i),
+             'email': 'writer{}@example.com'.format(i)}
+            for i in range(1, users + 1)])
+        db.session.commit()
+
+
+def worker(index, threads, writes):
+    """Schreibt threads * writes Posts und gibt das Ergebnis als JSON aus."""
+    from threading import Thread
+    from sqlalchemy.exc import OperationalError
+    from app import create_app, db
+    from app.models import Post
+    from app.sqlite import writer
+    from benchmarks.harness import BenchmarkConfig
+    app = create_app(BenchmarkConfig)
+    latencies, errors = [], []
+
+    def run(user_id):
+        with app.app_context():
+            for i in range(writes):
+                start = time.perf_counter()
+                try:
+                    writer.run(Post.publish, user_id, 'write {}'.format(i))
+                except OperationalError as e:
+                    errors.append(str(e.orig))
+                    db.session.rollback()
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+    pool = [Thread(target=run, args=(index * threads + t + 1,))
+            for t in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    print(json.dumps({'seconds': time.perf_counter() - start,
+                      'latencies': latencies, 'errors': errors,
+                      'commits': writer.commits}))
+
+
+def run_mode(mode, processes, threads, writes):
+    from benchmarks.harness import percentile
+    fd, path = tempfile.mkstemp(prefix='microblog-writers-', suffix='.db')
+    os.close(fd)
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + path, **MODES[mode])
+    try:
+        if _python(['writers-setup', str(processes * threads)], env).wait():
+            raise RuntimeError('setup failed for mode ' + mode)
+        start = time.perf_counter()
+        children = [_python(['writers-worker', str(i), str(threads), str(writes)], env)
+                    for i in range(processes)]
+        results = [json.loads(child.communicate()[0]) for child in children]
+        seconds = time.perf_counter() - start
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+    latencies = [l * 1000.0 for r in results for l in r['latencies']]
+    errors = [e for r in results for e in r['errors']]
+    return {
+        'writes': len(latencies),
+        'errors': len(errors),
+        'locked': sum('locked' in e for e in errors),
+        'commits': sum(r['commits'] for r in results) if mode == 'queue' else len(latencies),
+        'writes_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+    }
+
+
+def print_results(results, out):
+    out.write('{:<12} {:>8} {:>8} {:>8} {:>10} {:>9} {:>9}\n'.format(
+        'mode', 'writes', 'errors', 'commits', 'writes/s', 'p50 ms', 'p95 ms'))
+    for mode, r in results.items():
+        out.write('{:<12} {:>8} {:>8} {:>8} {:>10.1f} {:>9.2f} {:>9.2f}\n'.format(
+            mode, r['writes'], r['errors'], r['commits'], r['writes_per_second'],
+            r['p50_ms'], r['p95_ms']))
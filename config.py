@@ -1,10 +1,47 @@
 import os
+from sqlalchemy.engine import make_url
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+
+def engine_options(url):
+    # Pool-Einstellungen für alle Engines (Primär und Replicas); nicht gesetzte
+    # Werte bleiben bei den Defaults von SQLAlchemy/Flask-SQLAlchemy
+    options = {}
+    if os.environ.get('DATABASE_POOL_RECYCLE'):
+        options['pool_recycle'] = int(os.environ['DATABASE_POOL_RECYCLE'])
+    if os.environ.get('DATABASE_POOL_PRE_PING'):
+        options['pool_pre_ping'] = True
+    # SQLite in-memory läuft mit StaticPool, der kennt keine Poolgröße
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or url.database not in (None, '', ':memory:'):
+        if os.environ.get('DATABASE_POOL_SIZE'):
+            options['pool_size'] = int(os.environ['DATABASE_POOL_SIZE'])
+        if os.environ.get('DATABASE_MAX_OVERFLOW'):
+            options['max_overflow'] = int(os.environ['DATABASE_MAX_OVERFLOW'])
+    return options
+
+
+def replica_binds():
+    urls = [u.strip() for u in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',')]
+    return {'replica{}'.format(i): url for i, url in enumerate(u for u in urls if u)}
+
+
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or '1iqnFcVDN1y61Eza4lD1z2tgAZ3RF9gy'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # Read-Replicas, kommagetrennt (app/replicas.py)
+    SQLALCHEMY_BINDS = replica_binds()
+    REPLICA_BIND_KEYS = sorted(SQLALCHEMY_BINDS)
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS') or 5)
+    # Async Engine des ASGI-Lesepfads (app/asgi.py); ohne Angabe die URL
+    # oben mit asynchronem Treiber, z.B. sqlite+aiosqlite
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+
+    # Logdatei außerhalb von Debug- und Testmodus, None schaltet sie ab
+    # (Benchmarks, siehe benchmarks/harness.py)
+    LOG_FILE = os.environ.get('LOG_FILE') or os.path.join('logs', 'microblog.log')
 
     # Provisorisch, für Test mit flask shell
     if os.environ.get('SERVER_TYPE') != 'gunicorn':
@@ -13,5 +50,107 @@ class Config(object):
 
     POSTS_PER_PAGE = 5
     USERS_PER_PAGE = 10
+    API_PER_PAGE = 25
+    API_MAX_PER_PAGE = 100
+    # Zeilen pro Datenbank-Block beim NDJSON-Export (app/export.py)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 1000)
+    # Massenimport (app/bulk.py): Einträge pro Transaktion bzw. pro Request
+    BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE') or 1000)
+    BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS') or 10000)
+
+    # Autoren mit mehr Followern werden beim Lesen statt beim Schreiben verteilt
+    TIMELINE_FANOUT_THRESHOLD = int(os.environ.get('TIMELINE_FANOUT_THRESHOLD') or 1000)
+    # Follower pro Transaktion, wenn "flask timeline backfill" die Posts
+    # ehemaliger Celebrities nachverteilt
+    TIMELINE_BACKFILL_BLOCK_SIZE = int(os.environ.get('TIMELINE_BACKFILL_BLOCK_SIZE') or 1000)
+
+    # Volltextsuche: 'auto' (FTS5 unter SQLite, sonst Index-Tabelle), 'fts5', 'index'
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'auto'
+    # Halbwertszeit in Tagen, mit der ältere Treffer im Ranking sinken
+    SEARCH_RECENCY_DAYS = float(os.environ.get('SEARCH_RECENCY_DAYS') or 30)
+
+    # User-Vorschläge (/api/users/suggest)
+    SUGGEST_MAX_RESULTS = 20
+    SUGGEST_INDEX_TTL = int(os.environ.get('SUGGEST_INDEX_TTL') or 300)
+
+    # Cache für API-Tokens (app/tokens.py)
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE') or 10000)
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL') or 60)
+
+    # Gerenderte Post-Zeilen und Profilköpfe (app/fragments.py)
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 10000)
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL') or 300)
+
+    # Follow-Graph im Speicher (app/graph.py): 'off', 'lazy' oder 'preload'
+    FOLLOW_GRAPH = os.environ.get('FOLLOW_GRAPH') or 'off'
+    FOLLOW_GRAPH_TTL = int(os.environ.get('FOLLOW_GRAPH_TTL') or 300)
+    FOLLOW_GRAPH_MAX_BYTES = int(os.environ.get('FOLLOW_GRAPH_MAX_BYTES') or 256 * 1024 * 1024)
+
+    # "Who to follow" (app/recommend.py): Vorschläge pro User, Gewichte der
+    # Scores und User pro Block/Transaktion des Batch-Jobs
+    RECOMMEND_TOP_K = int(os.environ.get('RECOMMEND_TOP_K') or 10)
+    RECOMMEND_FOF_WEIGHT = float(os.environ.get('RECOMMEND_FOF_WEIGHT') or 1.0)
+    RECOMMEND_COFOLLOW_WEIGHT = float(os.environ.get('RECOMMEND_COFOLLOW_WEIGHT') or 0.5)
+    RECOMMEND_BLOCK_SIZE = int(os.environ.get('RECOMMEND_BLOCK_SIZE') or 1000)
+
+    # Live-Timeline per Server-Sent Events (app/stream.py), bedient vom
+    # ASGI-Server (asgi.py); die Home-Timeline öffnet den Stream nur mit
+    # SSE_ENABLED. Broker 'database' (Polling, sieht alle Worker) oder
+    # 'memory' (nur dieser Prozess)
+    SSE_ENABLED = os.environ.get('SSE_ENABLED') is not None
+    SSE_BROKER = os.environ.get('SSE_BROKER') or 'database'
+    SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL') or 1.0)
+    # offene Streams pro Prozess, Ereignisse pro Abo, Heartbeat und Laufzeit
+    # eines Streams in Sekunden, verpasste Posts beim Wiederverbinden
+    SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS') or 5000)
+    SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE') or 100)
+    SSE_HEARTBEAT = int(os.environ.get('SSE_HEARTBEAT') or 15)
+    SSE_MAX_AGE = int(os.environ.get('SSE_MAX_AGE') or 300)
+    SSE_REPLAY_LIMIT = int(os.environ.get('SSE_REPLAY_LIMIT') or 100)
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS') or 3000)
+
+    # last_seen nur alle LAST_SEEN_GRANULARITY Sekunden aktualisieren und
+    # gesammelt alle LAST_SEEN_FLUSH_INTERVAL Sekunden schreiben (0 = sofort)
+    LAST_SEEN_GRANULARITY = int(os.environ.get('LAST_SEEN_GRANULARITY') or 60)
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 30)
+
+    # Passwort-Hashing (app/passwords.py): Verfahren/Kosten im Werkzeug-Format,
+    # Größe des Prozess-Pools und maximale Warteschlange bis 503
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:260000'
+    PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH') or 16)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE') or 16)
+    PASSWORD_HASH_TIMEOUT = int(os.environ.get('PASSWORD_HASH_TIMEOUT') or 10)
+
+    MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'localhost'
+    MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    # Mail-Warteschlange (app/email.py), zugestellt von `flask mail worker`
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 20)
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS') or 5)
+    MAIL_RETRY_BACKOFF = int(os.environ.get('MAIL_RETRY_BACKOFF') or 30)
+    MAIL_POLL_INTERVAL = int(os.environ.get('MAIL_POLL_INTERVAL') or 5)
+    MAIL_CLAIM_TIMEOUT = int(os.environ.get('MAIL_CLAIM_TIMEOUT') or 300)
+
+    # Langsame Requests samt SQL-Statements loggen (app/profiling.py)
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS') or 500)
+    SLOW_REQUEST_QUERIES = int(os.environ.get('SLOW_REQUEST_QUERIES') or 30)
+
+    # Gemeinsames Verzeichnis für die Metriken mehrerer Worker (app/metrics.py)
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL') or 10)
+
+    # SQLite-Produktionsmodus und Writer-Queue (app/sqlite.py)
+    SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION') is not None
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -65536)  # KiB
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 268435456)
+    SQLITE_WRITE_QUEUE = os.environ.get('SQLITE_WRITE_QUEUE') is not None
+    SQLITE_WRITE_BATCH = int(os.environ.get('SQLITE_WRITE_BATCH') or 64)
+    SQLITE_WRITE_WAIT_MS = int(os.environ.get('SQLITE_WRITE_WAIT_MS') or 2)
+    SQLITE_WRITE_TIMEOUT = int(os.environ.get('SQLITE_WRITE_TIMEOUT') or 10)
 
     ADMINS = ["admin@lab2.ifalabs.org"]
\ No newline at end of file
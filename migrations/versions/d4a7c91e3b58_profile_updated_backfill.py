@@ -0,0 +1,34 @@
+"""profile updated backfill
+
+Users created before 95cb182828f5 still have profile_updated NULL and are
+never picked up by incremental user exports (app/export.py). They get the
+upgrade time, so the next incremental export includes them once.
+
+Revision ID: d4a7c91e3b58
+Revises: 8b1f4d7e2a35
+Create Date: 2026-10-19 14:27:51.302846
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c91e3b58'
+down_revision = '8b1f4d7e2a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keine Schemaänderung; nur Daten
+    user = sa.table('user', sa.column('profile_updated'))
+    op.execute(user.update()
+               .where(user.c.profile_updated.is_(None))
+               .values(profile_updated=datetime.utcnow()))
+
+
+def downgrade():
+    # welche Werte vorher NULL waren, ist nicht mehr bekannt
+    pass